@@ -0,0 +1,194 @@
+#! /usr/bin/python3
+
+'''
+This file is part of Lightning Network Probing Simulator.
+
+Copyright © 2020-2021 University of Luxembourg
+
+	Permission is hereby granted, free of charge, to any person obtaining a copy
+	of this software and associated documentation files (the "Software"), to deal
+	in the Software without restriction, including without limitation the rights
+	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+	copies of the Software, and to permit persons to whom the Software is
+	furnished to do so, subject to the following conditions:
+
+	The above copyright notice and this permission notice shall be included in all
+	copies or substantial portions of the Software.
+
+	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+	SOFTWARE.
+
+SPDX-FileType: SOURCE
+SPDX-FileCopyrightText: 2020-2021 University of Luxembourg
+SPDX-License-Identifier: MIT
+'''
+
+'''
+	An asynchronous model of remote probing with in-flight HTLC latency.
+
+	Prober sends each probe and learns its result instantly.
+	Here, each hop takes some time to forward a probe (and to pass the error back),
+	and many probes (towards different target hops) are in flight at the same time.
+	Time is simulated: the event loop jumps to the next scheduled event instead of sleeping.
+'''
+
+import asyncio
+import selectors
+from random import Random
+
+
+class VirtualClockSelector(selectors.DefaultSelector):
+	'''
+		A selector that advances the virtual clock instead of waiting for a timeout.
+	'''
+
+	def __init__(self, loop):
+		super().__init__()
+		self.loop = loop
+
+
+	def select(self, timeout=None):
+		events = super().select(0)
+		if not events and timeout is not None and timeout > 0:
+			self.loop.virtual_time += timeout
+		return events
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+	'''
+		An event loop with simulated time: asyncio.sleep returns immediately,
+		but the loop time advances as if it didn't.
+	'''
+
+	def __init__(self):
+		self.virtual_time = 0.0
+		super().__init__(VirtualClockSelector(self))
+
+
+	def time(self):
+		return self.virtual_time
+
+
+class AsyncProber:
+	'''
+		Probe target hops with a Prober concurrently, taking forwarding latency into account.
+
+		A probe along a path takes the sum of the latencies of the hops it was forwarded along, twice
+		(the HTLC goes forward, and the error comes back along the same hops).
+		Probes towards one target hop are sequential: the next probe depends on the result of the previous one.
+		Probes towards different target hops run concurrently, up to max_in_flight probes at a time.
+		Note: the prober updates its estimates when a probe is sent, not when its result comes back,
+		so concurrent probes may learn about shared intermediary hops a bit earlier than in reality.
+	'''
+
+	def __init__(self, prober, min_hop_latency=0.1, max_hop_latency=0.5, max_in_flight=10, latency_seed=None):
+		'''
+			Parameters:
+			- prober: the Prober instance (holds the graph and the estimates)
+			- min_hop_latency: the minimal latency of a hop (in seconds)
+			- max_hop_latency: the maximal latency of a hop (in seconds)
+			- max_in_flight: the maximal number of probes in flight at the same time
+			- latency_seed: the seed for hop latencies (which are drawn uniformly from [min_hop_latency, max_hop_latency])
+		'''
+		assert(0 <= min_hop_latency <= max_hop_latency)
+		assert(max_in_flight > 0)
+		self.prober = prober
+		self.max_in_flight = max_in_flight
+		rng = Random(latency_seed)
+		self.hop_latency = {(n1, n2): rng.uniform(min_hop_latency, max_hop_latency)
+			for n1, n2 in prober.lnhopgraph.edges()}
+		self.completion_times = dict()
+
+
+	def latency(self, n1, n2):
+		'''
+			Return the latency of a hop (in either direction).
+		'''
+		return self.hop_latency[(n1, n2)] if (n1, n2) in self.hop_latency else self.hop_latency[(n2, n1)]
+
+
+	def probe_latency(self, path, num_hops_forwarded):
+		'''
+			Return the time it takes to get the result of a probe
+			that was forwarded along the first num_hops_forwarded hops of the path.
+		'''
+		return 2 * sum(self.latency(n1, n2) for n1, n2 in zip(path[:num_hops_forwarded], path[1:num_hops_forwarded + 1]))
+
+
+	async def probe_hop(self, target_node_pair, bs, jamming, in_flight):
+		'''
+			Probe a target hop (see Prober.probe_hop), waiting for the result of each probe.
+
+			Parameters:
+			- target_node_pair: a pair of nodes defining the target hop
+			- bs: probe amount choice method
+			- jamming: use jamming-enhanced probing after "regular" probing
+			- in_flight: the semaphore limiting the number of probes in flight
+
+			Return:
+			- num_probes: how many probes were made
+		'''
+		loop = asyncio.get_running_loop()
+		probes = self.prober.probes_for_hop(target_node_pair, bs, jamming)
+		try:
+			path, amount = next(probes)
+			while True:
+				async with in_flight:
+					reached_target, num_hops_forwarded = self.prober.probe_along_path(path, amount)
+					await asyncio.sleep(self.probe_latency(path, num_hops_forwarded))
+				path, amount = probes.send(reached_target)
+		except StopIteration as stop:
+			self.completion_times[target_node_pair] = loop.time()
+			return stop.value
+
+
+	async def probe_hops_concurrently(self, target_hops, bs, jamming):
+		'''
+			Probe all target hops concurrently, with at most max_in_flight probes in flight.
+
+			Return: a list of the numbers of probes, one per target hop
+		'''
+		in_flight = asyncio.Semaphore(self.max_in_flight)
+		return await asyncio.gather(*[self.probe_hop(target_hop, bs, jamming, in_flight) for target_hop in target_hops])
+
+
+	def probe_hops(self, target_hops, bs, jamming):
+		'''
+			Probe a list of target hops afresh, concurrently.
+
+			Parameters:
+			- target_hops: a list of target hops
+			- bs: probe amount choice method
+			- jamming: True if use jamming-enhanced probing after "regular" probing
+
+			Return:
+			- total_gain: total achieved information gain on target hops
+			- probing_speed: average probing speed (bit / message) on target hops
+			- probing_time: the (simulated) time in seconds until all target hops are probed;
+			  completion times of individual target hops are stored in completion_times
+		'''
+		self.prober.reset_all_estimates()
+		self.completion_times = dict()
+		def uncertainty_for_target_hops():
+			return sum([self.prober.lnhopgraph[n1][n2]["hop"].uncertainty for n1, n2 in target_hops])
+		initial_uncertainty_total = uncertainty_for_target_hops()
+		loop = VirtualClockEventLoop()
+		try:
+			num_probes = sum(loop.run_until_complete(self.probe_hops_concurrently(target_hops, bs, jamming)))
+			probing_time = loop.time()
+		finally:
+			loop.close()
+		final_uncertainty_total = uncertainty_for_target_hops()
+		total_gain_bits = initial_uncertainty_total - final_uncertainty_total
+		if num_probes == 0:
+			print("Did zero probes, can't calculate probing speed!")
+			probing_speed = 0
+		else:
+			probing_speed = total_gain_bits / num_probes
+		total_gain = total_gain_bits / initial_uncertainty_total
+		return total_gain, probing_speed, probing_time
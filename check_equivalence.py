@@ -0,0 +1,384 @@
+#! /usr/bin/python3
+
+'''
+This file is part of Lightning Network Probing Simulator.
+
+Copyright © 2020-2021 University of Luxembourg
+
+	Permission is hereby granted, free of charge, to any person obtaining a copy
+	of this software and associated documentation files (the "Software"), to deal
+	in the Software without restriction, including without limitation the rights
+	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+	copies of the Software, and to permit persons to whom the Software is
+	furnished to do so, subject to the following conditions:
+
+	The above copyright notice and this permission notice shall be included in all
+	copies or substantial portions of the Software.
+
+	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+	SOFTWARE.
+
+SPDX-FileType: SOURCE
+SPDX-FileCopyrightText: 2020-2021 University of Luxembourg
+SPDX-License-Identifier: MIT
+'''
+
+'''
+	Check that the optimized code paths give the same results as the reference ones, on synthetic hops and graphs:
+	- HopTable (columns, views, materialized TableHop's) against stand-alone Hop's, including snapshot / restore.
+	- The CSR and shortest path tree routing backends against the NetworkX backend, as bounds change.
+	- Path suggestions from the prober's cached path iterators against fresh path searches.
+	- FailureModel: reproducibility given the seed, and failure positions against their exact distribution
+	  (each node on a path fails independently, as in the original per-hop draws).
+
+	Run `./check_equivalence.py` (see -h for options); it fails with an AssertionError at the first mismatch.
+'''
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from cohort import HopCohort
+from failures import FailureModel
+from graph import create_hop_graph
+from hop import Hop, dir0, dir1, IN_FLIGHT
+from hop_table import HopTable
+from prober import Prober
+from routing import NetworkXRouting, CSRRouting, ShortestPathTreeRouting, ROUTING_BACKENDS
+from synthetic import generate_hop, probe_hop_without_jamming
+
+from itertools import islice
+import numpy as np
+from random import random, randrange, choice, sample, seed, getrandbits
+
+
+MIN_CAPACITY = 1_000
+MAX_CAPACITY = 10_000_000
+# routing queries are made for these amounts
+AMOUNTS = [1, 10_000, 100_000, 1_000_000, 5_000_000]
+
+
+def consistent_amount(hop, direction):
+	'''
+		Draw a probe amount whose outcome doesn't depend on in-flight payments.
+
+		Hop.probe only sees a share of each balance (see IN_FLIGHT), whereas the bounds must contain the true balances:
+		a probe that fails because of in-flight payments may contradict them (and break the invariants).
+	'''
+	available = [hop.b[i] if direction == dir0 else hop.c[i] - hop.b[i] for i in hop.available_channels(direction)]
+	top = max(available, default=0)
+	while True:
+		amount = randrange(1, max(hop.c) + 2)
+		if amount <= int(top * IN_FLIGHT) or amount > top:
+			return amount
+
+
+def assert_same_estimates(hop, table, index):
+	'''
+		Assert that a hop in a table (as seen through its columns and its materialized TableHop) has the estimates of hop.
+	'''
+	view = table.view(index)
+	channels = table.channels(index)
+	expected = (hop.h_l, hop.h_u, hop.g_l, hop.g_u, hop.b_l, hop.b_u)
+	# the columns (answered by the view without materializing the hop)
+	assert((view.h_l, view.h_u, view.g_l, view.g_u, table.b_l[channels].tolist(), table.b_u[channels].tolist()) == expected), index
+	assert(view.uncertainty == hop.uncertainty), (index, view.uncertainty, hop.uncertainty)
+	# the materialized hop
+	table_hop = table.hop(index)
+	assert((table_hop.h_l, table_hop.h_u, table_hop.g_l, table_hop.g_u, table_hop.b_l, table_hop.b_u) == expected), index
+	assert(table_hop.S_F == hop.S_F), index
+	assert(table_hop.j == hop.j), index
+
+
+def check_hop_table(num_hops, num_steps):
+	'''
+		Apply the same random sequence of probes, jams, resets, snapshots and restores
+		to stand-alone Hop's and to the hops of a HopTable, and compare their estimates after every step.
+	'''
+	specs = []
+	for _ in range(num_hops):
+		hop = generate_hop(1, 4, MIN_CAPACITY, MAX_CAPACITY, probability_bidirectional=0.7)
+		specs.append((hop.c, hop.e[dir0], hop.e[dir1], hop.b))
+	hops = [Hop(*spec) for spec in specs]
+	table = HopTable(specs)
+	# (table token, hop tokens) of the last snapshot
+	snapshot = None
+	for _ in range(num_steps):
+		k = randrange(num_hops)
+		hop, view = hops[k], table.view(k)
+		action = random()
+		if action < 0.05:
+			snapshot = (table.snapshot_estimates(), [hop.snapshot_estimates() for hop in hops])
+		elif action < 0.1 and snapshot is not None:
+			table.restore_estimates(snapshot[0])
+			for hop, estimates in zip(hops, snapshot[1]):
+				hop.restore_estimates(estimates)
+		elif action < 0.12:
+			table.reset_estimates()
+			for hop in hops:
+				hop.reset_estimates()
+		elif action < 0.2:
+			i, direction = randrange(hop.N), choice((dir0, dir1))
+			hop.jam_all_except_in_direction(i, direction)
+			view.jam_all_except_in_direction(i, direction)
+		elif action < 0.25:
+			hop.unjam_all()
+			view.unjam_all()
+		else:
+			jamming = hop.is_jamming()
+			if hop.worth_probing() and not jamming:
+				# the same state must lead to the same decision
+				decision = hop.next_dir_and_a(bs=False, jamming=False)
+				assert(view.next_dir_and_a(bs=False, jamming=False) == decision), k
+			# when jamming, we probe through the only unjammed channel (see Hop.probe)
+			direction = choice([direction for direction in (dir0, dir1)
+				if not jamming or len(hop.available_channels(direction)) <= 1])
+			amount = consistent_amount(hop, direction)
+			assert(view.probe(direction, amount) == hop.probe(direction, amount)), k
+		# a restore or a reset changes all hops
+		for index in range(num_hops) if action < 0.12 else [k]:
+			assert_same_estimates(hops[index], table, index)
+	print("HopTable:", num_hops, "hops,", num_steps, "steps: OK")
+
+
+class FullBalanceHop(Hop):
+	'''
+		A hop whose probes see the full balances (see consistent_amount):
+		cohorts choose their own amounts, so we can't avoid amounts that contradict the bounds otherwise.
+	'''
+
+	def b_in_dir(self, i, direction):
+		return self.b[i] if direction == dir0 else self.c[i] - self.b[i]
+
+
+def check_cohort(num_hops):
+	'''
+		Probe the same hops one by one and in lockstep as HopCohort's,
+		and compare the numbers of probes and the final estimates.
+	'''
+	specs = []
+	for _ in range(num_hops):
+		hop = generate_hop(1, 4, MIN_CAPACITY, MAX_CAPACITY, probability_bidirectional=0.7)
+		specs.append((hop.c, hop.e[dir0], hop.e[dir1], hop.b))
+	for bs in (True, False):
+		hops = [FullBalanceHop(*spec) for spec in specs]
+		num_probes = [probe_hop_without_jamming(hop, bs) for hop in hops]
+		cohort_hops = [FullBalanceHop(*spec) for spec in specs]
+		for N in set(hop.N for hop in cohort_hops):
+			hop_indices = [k for k, hop in enumerate(cohort_hops) if hop.N == N]
+			cohort_num_probes = HopCohort([cohort_hops[k] for k in hop_indices]).probe_without_jamming(bs)
+			assert(cohort_num_probes == [num_probes[k] for k in hop_indices]), (bs, N)
+		for k, (hop, cohort_hop) in enumerate(zip(hops, cohort_hops)):
+			assert((cohort_hop.h_l, cohort_hop.h_u, cohort_hop.g_l, cohort_hop.g_u, cohort_hop.b_l, cohort_hop.b_u)
+				== (hop.h_l, hop.h_u, hop.g_l, hop.g_u, hop.b_l, hop.b_u)), (bs, k)
+			assert(cohort_hop.S_F == hop.S_F), (bs, k)
+	print("HopCohort:", num_hops, "hops: OK")
+
+
+def synthetic_hop_graph(num_nodes, num_hops):
+	'''
+		Create a hop graph (see graph.create_hop_graph) with random node IDs and random hops between them.
+	'''
+	nodes = ["02%064x" % getrandbits(256) for _ in range(num_nodes)]
+	pairs, hops = set(), []
+	while len(hops) < num_hops:
+		n1, n2 = sorted(sample(nodes, 2))
+		if (n1, n2) not in pairs:
+			pairs.add((n1, n2))
+			hop = generate_hop(1, 3, MIN_CAPACITY, MAX_CAPACITY, probability_bidirectional=0.7)
+			hops.append((n1, n2, hop.c, hop.e[dir0], hop.e[dir1]))
+	return create_hop_graph(nodes, hops)
+
+
+def path_admits_amount(hop_graph, path, amount):
+	'''
+		Return True if all hops of the path may forward the amount (according to the current upper bounds).
+	'''
+	for n1, n2 in zip(path, path[1:]):
+		hop = hop_graph[n1][n2]["hop"]
+		if amount > (hop.h_u if n1 < n2 else hop.g_u):
+			return False
+	return True
+
+
+def check_routing(num_nodes, num_hops, num_rounds, num_queries):
+	'''
+		Compare the paths found by the routing backends on a synthetic hop graph.
+		CSRRouting must find the same paths as NetworkXRouting (in the same order);
+		ShortestPathTreeRouting must find paths of the same length (ties may be broken differently).
+		Between rounds, bounds drop (as hops are probed) or are reset.
+	'''
+	hop_graph = synthetic_hop_graph(num_nodes, num_hops)
+	nodes = list(hop_graph.nodes())
+	root = choice(nodes)
+	reference = NetworkXRouting(hop_graph, hop_graph.to_directed(as_view=True))
+	csr = CSRRouting(hop_graph)
+	trees = ShortestPathTreeRouting(hop_graph, root)
+	num_paths = 0
+	for round in range(num_rounds):
+		for _ in range(num_queries):
+			target, amount = choice(nodes), choice(AMOUNTS)
+			expected = reference.shortest_path(root, target, amount)
+			assert(csr.shortest_path(root, target, amount) == expected), (root, target, amount)
+			tree_path = trees.shortest_path(root, target, amount)
+			if expected is None:
+				assert(tree_path is None), (root, target, amount)
+			else:
+				assert(tree_path is not None and len(tree_path) == len(expected)), (root, target, amount)
+				assert(tree_path[0] == root and tree_path[-1] == target), tree_path
+				assert(path_admits_amount(hop_graph, tree_path, amount)), tree_path
+			# the first few simple paths between any two nodes
+			source = choice(nodes)
+			if source != target:
+				expected_paths = list(islice(reference.shortest_simple_paths(source, target, amount), 5))
+				assert(list(islice(csr.shortest_simple_paths(source, target, amount), 5)) == expected_paths), (source, target, amount)
+				num_paths += len(expected_paths)
+		if round % 4 == 3:
+			# bounds may increase: trees must be rebuilt
+			hop_graph.graph["hop_table"].reset_estimates()
+		else:
+			# probes only decrease upper bounds: outdated trees must be detected
+			for n1, n2 in sample(list(hop_graph.edges()), num_hops // 10):
+				hop = hop_graph[n1][n2]["hop"]
+				direction = choice((dir0, dir1))
+				hop.probe(direction, consistent_amount(hop, direction))
+	print("Routing:", num_nodes, "nodes,", num_hops, "hops,", num_rounds * num_queries, "queries,", num_paths, "simple paths: OK")
+
+
+def write_synthetic_snapshot(snapshot_filename, num_nodes, num_channels):
+	'''
+		Write a snapshot (in the format of clightning's listchannels.json) with random channels between random nodes.
+
+		Return: the list of node IDs
+	'''
+	nodes = ["02%064x" % getrandbits(256) for _ in range(num_nodes)]
+	channel_directions = []
+	for i in range(num_channels):
+		source, destination = sample(nodes, 2)
+		capacity = randrange(MIN_CAPACITY, MAX_CAPACITY)
+		for n1, n2 in ((source, destination), (destination, source)):
+			channel_directions.append({"short_channel_id": str(i) + "x1x0", "source": n1, "destination": n2,
+				"satoshis": capacity, "active": random() < 0.9})
+	with open(snapshot_filename, "w") as snapshot_file:
+		json.dump({"channels": channel_directions}, snapshot_file)
+	return nodes
+
+
+def check_path_iterators(num_nodes, num_channels, num_queries):
+	'''
+		Check that the paths suggested by Prober.path_for_amount (which reuses path iterators across probes)
+		exist exactly when a fresh path search finds a path, with every routing backend.
+		In particular, an iterator created for a larger amount (with fewer paths, or none at all)
+		must not hide the paths for a smaller amount.
+	'''
+	with tempfile.TemporaryDirectory() as directory:
+		snapshot_filename = os.path.join(directory, "listchannels-2000-01-01.json")
+		nodes = write_synthetic_snapshot(snapshot_filename, num_nodes, num_channels)
+		for backend in ROUTING_BACKENDS:
+			prober = Prober(snapshot_filename, "PROBER", sample(nodes, 3), MAX_CAPACITY, routing=backend)
+			target_hops = list(prober.lnhopgraph.edges())
+			for _ in range(num_queries):
+				target_hop = choice(target_hops)
+				if random() < 0.5:
+					target_hop = target_hop[::-1]
+				for amount in sorted(sample(AMOUNTS, 3), reverse=True):
+					path = prober.path_for_amount(target_hop, amount)
+					fresh_path = next(prober.paths_for_amount(target_hop, amount), None)
+					assert((path is None) == (fresh_path is None)), (backend, target_hop, amount, path, fresh_path)
+					if path is not None:
+						assert(path[-2:] == list(target_hop) and prober.path_admits_amount(path, amount)), path
+				# lower some bounds, as probes do
+				for n1, n2 in sample(target_hops, len(target_hops) // 50):
+					hop = prober.lnhopgraph[n1][n2]["hop"]
+					direction = choice((dir0, dir1))
+					hop.probe(direction, consistent_amount(hop, direction))
+	print("Path iterators:", len(ROUTING_BACKENDS), "backends,", num_queries, "target hops each: OK")
+
+
+def failure_position_probabilities(failure_model, path):
+	'''
+		Return the exact probabilities of the failure positions 0..len(path)-1 of a path (see FailureModel.failure_position).
+	'''
+	probabilities, reached = [], 1.0
+	for node in path[1:]:
+		failure_rate = failure_model.node_failure_rate(node)
+		probabilities.append(reached * failure_rate)
+		reached *= 1 - failure_rate
+	return probabilities + [reached]
+
+
+def check_failures(num_samples, tolerance=0.01):
+	'''
+		Check that failure models are reproducible given the seed, that spawned models have independent streams,
+		and that failure positions (drawn one by one and in batches) follow their exact distribution.
+	'''
+	paths = [[randrange(50) for _ in range(randrange(2, 10))] for _ in range(100)]
+	node_failure_rates = {node: random() for node in range(0, 50, 5)}
+	for rates in (None, node_failure_rates):
+		# the same seed gives the same failures
+		models = [FailureModel(0.1, rates, seed=1), FailureModel(0.1, rates, seed=1)]
+		assert(all((models[0].failure_positions(paths) == models[1].failure_positions(paths)).all() for _ in range(10)))
+		assert([models[0].failure_position(path) for path in paths] == [models[1].failure_position(path) for path in paths])
+		# spawned models are reproducible, and their streams differ
+		children = [FailureModel(0.1, rates, seed=2).spawn(3) for _ in range(2)]
+		for child, same_child in zip(*children):
+			assert((child.failure_positions(paths) == same_child.failure_positions(paths)).all())
+		streams = [tuple(child.failure_positions(paths * 10)) for child in children[0]]
+		assert(len(set(streams)) == len(streams))
+		# failure positions follow the exact distribution
+		model = FailureModel(0.1, rates, seed=3)
+		for path in paths[:10]:
+			expected = failure_position_probabilities(model, path)
+			# drawing one by one is slower: draw fewer samples (and allow a larger deviation)
+			for positions, max_deviation in ((model.failure_positions([path] * num_samples), tolerance),
+				(np.array([model.failure_position(path) for _ in range(num_samples // 10)]), 3 * tolerance)):
+				frequencies = np.bincount(positions, minlength=len(path)) / len(positions)
+				assert(len(frequencies) == len(path)), frequencies
+				assert(np.abs(frequencies - expected).max() < max_deviation), (path, frequencies, expected)
+	# nodes that never fail (or always fail)
+	assert((FailureModel(0).failure_positions(paths) == [len(path) - 1 for path in paths]).all())
+	assert((FailureModel(1).failure_positions(paths) == 0).all())
+	print("FailureModel:", len(paths), "paths,", num_samples, "samples per path: OK")
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--seed", default=0, type=int,
+		help="The seed for the random module.")
+	parser.add_argument("--num_hops", default=100, type=int,
+		help="The number of synthetic hops.")
+	parser.add_argument("--num_steps", default=5000, type=int,
+		help="The number of updates applied to the hops.")
+	parser.add_argument("--num_nodes", default=300, type=int,
+		help="The number of nodes in the synthetic graph (for routing).")
+	parser.add_argument("--num_graph_hops", default=900, type=int,
+		help="The number of hops in the synthetic graph (for routing).")
+	parser.add_argument("--num_rounds", default=8, type=int,
+		help="The number of rounds of routing queries (bounds change between rounds).")
+	parser.add_argument("--num_queries", default=100, type=int,
+		help="The number of routing queries per round.")
+	parser.add_argument("--num_channels", default=600, type=int,
+		help="The number of channels in the synthetic snapshot (for path iterators).")
+	parser.add_argument("--num_failure_samples", default=50_000, type=int,
+		help="The number of failure positions drawn per path (for failure models).")
+	args = parser.parse_args()
+	seed(args.seed)
+	check_hop_table(args.num_hops, args.num_steps)
+	check_cohort(args.num_hops)
+	check_routing(args.num_nodes, args.num_graph_hops, args.num_rounds, args.num_queries)
+	check_path_iterators(args.num_nodes, args.num_channels, args.num_queries)
+	check_failures(args.num_failure_samples)
+
+
+if __name__ == "__main__":
+	start_time = time.time()
+	main()
+	end_time = time.time()
+	print("Completed in", round(end_time - start_time), "seconds.")
@@ -0,0 +1,405 @@
+#! /usr/bin/python3
+
+'''
+This file is part of Lightning Network Probing Simulator.
+
+Copyright © 2020-2021 University of Luxembourg
+
+	Permission is hereby granted, free of charge, to any person obtaining a copy
+	of this software and associated documentation files (the "Software"), to deal
+	in the Software without restriction, including without limitation the rights
+	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+	copies of the Software, and to permit persons to whom the Software is
+	furnished to do so, subject to the following conditions:
+
+	The above copyright notice and this permission notice shall be included in all
+	copies or substantial portions of the Software.
+
+	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+	SOFTWARE.
+
+SPDX-FileType: SOURCE
+SPDX-FileCopyrightText: 2020-2021 University of Luxembourg
+SPDX-License-Identifier: MIT
+'''
+
+'''
+	Probing a cohort of hops with the same number of channels in lockstep (without jamming).
+	At each step, directions and amounts for all hops that are still worth probing
+	are chosen with a few vectorized S(F) calculations (one row per hop, direction, and amount),
+	then all probes are done and all bounds are updated as array operations over (H,) and (H, N) bound columns.
+	Rectangles are only rebuilt for hops whose bounds have changed.
+	The decisions are the same as those of Hop.next_dir_and_a, so are the probing results.
+'''
+
+import numpy as np
+
+from hop import Hop, dir0, dir1, S_F_generic_batch, popcount, VALIDATION_FULL
+from rectangle import RectangleBatch
+
+
+class HopCohort:
+	'''
+		A group of hops with the same number of channels.
+		Capacities and enabled channels don't change during probing: we store them as (H, N) arrays.
+	'''
+
+	def __init__(self, hops):
+		'''
+			Initialize a cohort.
+
+			Parameters:
+			- hops: a non-empty list of Hop's with the same number of channels
+		'''
+		assert(hops), "Cohort must contain at least one hop"
+		self.hops = hops
+		self.N = hops[0].N
+		assert(all(hop.N == self.N for hop in hops)), "All hops in a cohort must have the same number of channels"
+		self.c = np.array([hop.c for hop in hops], dtype=np.int64)
+		self.enabled = {
+			direction: np.array([[hop.is_enabled(i, direction) for i in range(self.N)] for hop in hops], dtype=bool)
+			for direction in (dir0, dir1)}
+		# a balance bound is only updated if the probe went through the only enabled channel
+		self.single_enabled_dir0 = np.array([popcount(hop.e_mask[dir0]) == 1 for hop in hops], dtype=bool)
+		self.single_enabled_dir1 = np.array([popcount(hop.e_mask[dir1]) == 1 for hop in hops], dtype=bool)
+
+
+	def current_rectangles(self, members):
+		'''
+			Stack the current R_h_l, R_h_u, R_g_l, R_g_u of several hops.
+
+			Parameters:
+			- members: indices of hops in the cohort
+
+			Return:
+			- a dict from rectangle name to a RectangleBatch with one row per member
+		'''
+		rectangles = {}
+		for name in ("R_h_l", "R_h_u", "R_g_l", "R_g_u"):
+			batches = [getattr(self.hops[k], name).as_batch(self.N) for k in members]
+			rectangles[name] = RectangleBatch(
+				np.concatenate([batch.l_vertices for batch in batches]),
+				np.concatenate([batch.u_vertices for batch in batches]))
+		return rectangles
+
+
+	def validate_full(self, members):
+		'''
+			Return a boolean array: True for members whose validation level is full (as in Hop.S_F_a_expected).
+			Hops may have different levels (see Hop.set_validation), and levels may change after the cohort is created.
+		'''
+		return np.array([self.hops[k].validation == VALIDATION_FULL for k in members], dtype=bool)
+
+
+	def S_F_a_expected(self, members, rectangles, rows, directions, amounts, exact=True):
+		'''
+			Vectorized Hop.S_F_a_expected (without jamming) for many hops, directions, and amounts at once.
+
+			Parameters:
+			- members: indices of hops in the cohort (as passed to current_rectangles)
+			- rectangles: the current rectangles of members (see current_rectangles)
+			- rows: for each row, the position of its hop in members
+			- directions: for each row, the probe direction
+			- amounts: for each row, the probe amount
+			- exact: if False, calculate areas as floating point numbers
+
+			Return: S_F_a: an array of areas "under the cut", one per row
+		'''
+		hop_indices = np.asarray(members)[rows]
+		c = self.c[hop_indices]
+		bounds = (np.asarray(amounts, dtype=np.int64) - 1)[:, None]
+		is_dir0 = np.asarray(directions, dtype=bool)[:, None]
+		def effective_vertices(enabled):
+			# see Hop.effective_vertices
+			keep_bound = (enabled | (self.N == 1) | (bounds < 0)) & (bounds <= c)
+			return np.where(keep_bound, bounds, c)
+		enabled_dir0, enabled_dir1 = self.enabled[dir0][hop_indices], self.enabled[dir1][hop_indices]
+		zeros = np.zeros_like(c)
+		# mimic the scenario when probe fails: probing rectangles in the probe direction, current ones otherwise
+		R_h_u, R_g_u = rectangles["R_h_u"], rectangles["R_g_u"]
+		new_R_h_u = RectangleBatch(
+			np.where(is_dir0, zeros, R_h_u.l_vertices[rows]),
+			np.where(is_dir0, effective_vertices(enabled_dir0), R_h_u.u_vertices[rows]))
+		new_R_g_u = RectangleBatch(
+			np.where(is_dir0, R_g_u.l_vertices[rows], c - effective_vertices(enabled_dir1)),
+			np.where(is_dir0, R_g_u.u_vertices[rows], c))
+		# dir0: probe failed => all enabled channels have insufficient balances
+		new_b_u = np.where(is_dir0 & enabled_dir0, np.minimum(c, bounds), c)
+		# dir1: we know the probe went through the only enabled channel
+		single_enabled = self.single_enabled_dir1[hop_indices][:, None]
+		new_b_l = np.where(~is_dir0 & single_enabled & enabled_dir1, np.maximum(zeros, c - bounds - 1), zeros)
+		R_h_l, R_g_l = rectangles["R_h_l"], rectangles["R_g_l"]
+		return S_F_generic_batch(
+			RectangleBatch(R_h_l.l_vertices[rows], R_h_l.u_vertices[rows]), new_R_h_u,
+			RectangleBatch(R_g_l.l_vertices[rows], R_g_l.u_vertices[rows]), new_R_g_u,
+			RectangleBatch(new_b_l, new_b_u), exact,
+			validate = self.validate_full(members)[rows])
+
+
+	def nbs_amounts(self, members, rectangles, rows, directions, a_l, a_u, S_F_half, amounts_per_pass=16):
+		'''
+			Vectorized Hop.nbs_amount: find the NBS amounts for many hops and directions at once.
+			All searches advance together: each pass evaluates amounts_per_pass amounts for every unfinished search.
+
+			Parameters:
+			- members, rectangles: see S_F_a_expected
+			- rows, directions: for each search, the position of its hop in members and the probe direction
+			- a_l: for each search, the amount that is known to leave too little under the cut (exclusive)
+			- a_u: for each search, the highest amount to consider (inclusive)
+			- S_F_half: for each search, the target area under the cut (a list of Python integers)
+			- amounts_per_pass: how many amounts to evaluate per search in one pass
+
+			Return:
+			- a: an array of NBS amounts, one per search
+		'''
+		rows, directions = np.asarray(rows), np.asarray(directions, dtype=bool)
+		a_l, a_u = np.asarray(a_l, dtype=np.int64), np.asarray(a_u, dtype=np.int64)
+		S_F_half = np.array(S_F_half, dtype=object)
+		def enough_under_cut(searches, amounts, exact):
+			# amounts is a (len(searches), k) array
+			k = amounts.shape[1]
+			S_F_a = self.S_F_a_expected(members, rectangles, np.repeat(rows[searches], k),
+				np.repeat(directions[searches], k), amounts.ravel(), exact)
+			target = S_F_half[searches] if exact else S_F_half[searches].astype(float)
+			return (S_F_a.reshape(len(searches), k) >= target[:, None]).astype(bool)
+		def search(searches, exact):
+			lo, hi = a_l[searches].copy(), a_u[searches].copy()
+			while True:
+				unfinished = np.flatnonzero(hi - lo > 1)
+				if len(unfinished) == 0:
+					return hi
+				lo_u, hi_u = lo[unfinished], hi[unfinished]
+				# evenly spaced amounts from lo + 1 to hi - 1 (inclusive; repeated if there are fewer)
+				steps = np.arange(amounts_per_pass, dtype=np.int64)
+				amounts = lo_u[:, None] + 1 + steps * (hi_u - lo_u - 2)[:, None] // max(1, amounts_per_pass - 1)
+				enough = enough_under_cut(searches[unfinished], amounts, exact)
+				any_enough = enough.any(axis=1)
+				first_enough = np.argmax(enough, axis=1)
+				positions = np.arange(len(unfinished))
+				hi[unfinished] = np.where(any_enough, amounts[positions, first_enough], hi_u)
+				lo[unfinished] = np.where(any_enough,
+					np.where(first_enough > 0, amounts[positions, first_enough - 1], lo_u),
+					amounts[:, -1])
+		all_searches = np.arange(len(rows))
+		a = search(all_searches, exact=False)
+		# see Hop.nbs_amount: check approximate results with exact areas
+		has_prev = a - 1 > a_l
+		enough = enough_under_cut(all_searches, a[:, None], exact=True)[:, 0]
+		enough_prev = np.zeros(len(rows), dtype=bool)
+		if has_prev.any():
+			with_prev = np.flatnonzero(has_prev)
+			enough_prev[with_prev] = enough_under_cut(with_prev, (a - 1)[with_prev, None], exact=True)[:, 0]
+		correct = (enough | (a == a_u)) & ~enough_prev
+		if not correct.all():
+			incorrect = np.flatnonzero(~correct)
+			a[incorrect] = search(incorrect, exact=True)
+		return a
+
+
+	def next_dirs_and_amounts(self, members, bs, threshold_area_difference=0.1):
+		'''
+			Choose the direction and the amount for the next probe for several hops (see Hop.next_dir_and_a).
+			Decisions are looked up in and added to the decision cache shared with Hop.
+
+			Parameters:
+			- members: indices of hops in the cohort that are worth probing
+			- bs: True if we do binary search only amounts; False if we use NBS amount choice
+			- threshold_area_difference: see Hop.calculate_next_dir
+
+			Return:
+			- a list of (chosen_dir, amount) pairs, one per member
+		'''
+		cache = Hop.decision_cache
+		def cached(key):
+			return None if key is None else cache.get(key)
+		def remember(key, decision):
+			if key is not None:
+				cache.put(key, decision)
+		def next_a_key(hop, direction):
+			return None if cache is None else hop.next_a_key(direction, bs, False)
+		chosen_dirs, amounts, dir_keys = [], [], []
+		# amounts we still have to calculate: (position in members, direction, a_l, a_u, S_F_half)
+		searches = []
+		for position, k in enumerate(members):
+			hop = self.hops[k]
+			assert(not hop.is_jamming()), "Cohorts are only probed without jamming"
+			assert(hop.can_forward(dir0) or hop.can_forward(dir1)), hop
+			dir_key = None if cache is None else hop.next_dir_key(bs, False, threshold_area_difference=threshold_area_difference)
+			chosen_dir = cached(dir_key)
+			if chosen_dir is None:
+				should_consider_dir0, should_consider_dir1 = hop.worth_probing_h(), hop.worth_probing_g()
+				if not should_consider_dir0:
+					chosen_dir = dir1
+				elif not should_consider_dir1:
+					chosen_dir = dir0
+			considered_dirs = (dir0, dir1) if chosen_dir is None else (chosen_dir,)
+			hop_amounts = {}
+			for direction in considered_dirs:
+				hop_amounts[direction] = cached(next_a_key(hop, direction))
+				if hop_amounts[direction] is None:
+					a_l, a_u = (hop.h_l + 1, hop.h_u) if direction == dir0 else (hop.g_l + 1, hop.g_u)
+					if bs:
+						hop_amounts[direction] = (a_l + a_u + 1) // 2
+					else:
+						searches.append((position, direction, a_l, a_u, max(1, hop.S_F // 2)))
+			chosen_dirs.append(chosen_dir)
+			amounts.append(hop_amounts)
+			dir_keys.append(dir_key)
+		rectangles = self.current_rectangles(members) if not bs else None
+		if searches:
+			rows, directions, a_l, a_u, S_F_half = zip(*searches)
+			nbs_amounts = self.nbs_amounts(members, rectangles, rows, directions, a_l, a_u, S_F_half)
+			for (position, direction, _, _, _), a in zip(searches, nbs_amounts.tolist()):
+				amounts[position][direction] = a
+		for position, k in enumerate(members):
+			for direction, a in amounts[position].items():
+				assert(a > 0)
+				remember(next_a_key(self.hops[k], direction), a)
+		# choose between two directions (see Hop.calculate_next_dir)
+		undecided = [position for position, chosen_dir in enumerate(chosen_dirs) if chosen_dir is None]
+		if undecided and not bs:
+			rows = np.repeat(undecided, 2)
+			directions = [dir0, dir1] * len(undecided)
+			S_F_a = self.S_F_a_expected(members, rectangles, rows, directions,
+				[amounts[position][direction] for position, direction in zip(rows.tolist(), directions)])
+		for i, position in enumerate(undecided):
+			a_dir0, a_dir1 = amounts[position][dir0], amounts[position][dir1]
+			if bs:
+				# choose smaller amount: more likely to pass
+				chosen_dir = dir0 if a_dir0 < a_dir1 else dir1
+			else:
+				# prefer amount that splits in half better
+				S_F_half = max(1, self.hops[members[position]].S_F // 2)
+				S_F_a_dir0, S_F_a_dir1 = S_F_a[2 * i], S_F_a[2 * i + 1]
+				if abs(S_F_a_dir0 - S_F_a_dir1) / S_F_half < threshold_area_difference:
+					chosen_dir = dir0 if a_dir0 < a_dir1 else dir1
+				else:
+					chosen_dir = dir0 if abs(S_F_a_dir0 - S_F_half) < abs(S_F_a_dir1 - S_F_half) else dir1
+			chosen_dirs[position] = chosen_dir
+		for position, chosen_dir in enumerate(chosen_dirs):
+			remember(dir_keys[position], chosen_dir)
+		return [(chosen_dir, amounts[position][chosen_dir]) for position, chosen_dir in enumerate(chosen_dirs)]
+
+
+	def load_bounds(self):
+		'''
+			Copy the current bounds of all hops into (H,) and (H, N) arrays (the columns of HopTable).
+			Also store the balances available for probes in each direction (see Hop.b_in_dir);
+			-1 for disabled channels, so that no probe passes through them.
+		'''
+		self.h_l, self.h_u, self.g_l, self.g_u = (np.array([getattr(hop, name) for hop in self.hops], dtype=np.int64)
+			for name in ("h_l", "h_u", "g_l", "g_u"))
+		self.b_l = np.array([hop.b_l for hop in self.hops], dtype=np.int64)
+		self.b_u = np.array([hop.b_u for hop in self.hops], dtype=np.int64)
+		self.b_in_dir = {
+			direction: np.array([[hop.b_in_dir(i, direction) if hop.is_enabled(i, direction) else -1
+				for i in range(self.N)] for hop in self.hops], dtype=np.int64)
+			for direction in (dir0, dir1)}
+
+
+	def store_bounds(self, k):
+		# write the bounds of hop k back to the Hop and update its rectangles (see Hop.probe)
+		hop = self.hops[k]
+		hop.h_l, hop.h_u, hop.g_l, hop.g_u = (int(self.h_l[k]), int(self.h_u[k]), int(self.g_l[k]), int(self.g_u[k]))
+		hop.b_l[:] = self.b_l[k].tolist()
+		hop.b_u[:] = self.b_u[k].tolist()
+		hop.update_dependent_hop_properties()
+		if hop.uncertainty == 0:
+			hop.set_bounds_from_corner()
+			self.h_l[k], self.h_u[k], self.g_l[k], self.g_u[k] = hop.h_l, hop.h_u, hop.g_l, hop.g_u
+			self.b_l[k], self.b_u[k] = hop.b_l, hop.b_u
+
+
+	def worth_probing(self, members):
+		# vectorized Hop.worth_probing_h() or Hop.worth_probing_g() (no channels are jammed)
+		can_forward = {direction: self.enabled[direction][members].any(axis=1) for direction in (dir0, dir1)}
+		return ((can_forward[dir0] & (self.h_u[members] - self.h_l[members] > 1))
+			| (can_forward[dir1] & (self.g_u[members] - self.g_l[members] > 1)))
+
+
+	def probe(self, members, directions, amounts):
+		'''
+			Vectorized Hop.probe (without jamming): update the bounds of several hops as a result of one probe each.
+			Only the cohort's arrays are updated (see store_bounds).
+
+			Parameters:
+			- members: indices of hops in the cohort
+			- directions: for each member, the probe direction
+			- amounts: for each member, the probe amount
+
+			Return:
+			- changed: a boolean array, True for members whose bounds have changed
+		'''
+		is_dir0 = np.asarray(directions, dtype=bool)
+		a = np.asarray(amounts, dtype=np.int64)
+		c, enabled_dir0, enabled_dir1 = self.c[members], self.enabled[dir0][members], self.enabled[dir1][members]
+		h_l, h_u, g_l, g_u = self.h_l[members], self.h_u[members], self.g_l[members], self.g_u[members]
+		b_l, b_u = self.b_l[members], self.b_u[members]
+		any_dir0, any_dir1 = enabled_dir0.any(axis=1), enabled_dir1.any(axis=1)
+		def masked_max(values, mask):
+			return np.where(mask, values, np.iinfo(np.int64).min).max(axis=1)
+		def masked_min(values, mask):
+			return np.where(mask, values, np.iinfo(np.int64).max).min(axis=1)
+		b_in_dir = np.where(is_dir0, self.b_in_dir[dir0][members].max(axis=1), self.b_in_dir[dir1][members].max(axis=1))
+		probe_passed = a <= b_in_dir
+		# should only update if the amount is between current bounds (and there is a channel to probe)
+		should_update_h = is_dir0 & any_dir0 & (h_l < a) & (a <= h_u)
+		should_update_g = ~is_dir0 & any_dir1 & (g_l < a) & (a <= g_u)
+		# dir0, probe passed: update h_l, then b_l of the only enabled channel, then g_u
+		rows = should_update_h & probe_passed
+		h_l = np.where(rows, a - 1, h_l)
+		b_l = np.where((rows & self.single_enabled_dir0[members])[:, None] & enabled_dir0, np.maximum(b_l, h_l[:, None]), b_l)
+		g_u = np.where(rows & any_dir1, np.minimum(g_u, masked_max(c - b_l, enabled_dir1)), g_u)
+		# dir0, probe failed: update h_u, then b_u of all enabled channels, then g_l
+		rows = should_update_h & ~probe_passed
+		h_u = np.where(rows, a - 1, h_u)
+		b_u = np.where(rows[:, None] & enabled_dir0, np.minimum(b_u, h_u[:, None]), b_u)
+		g_l = np.where(rows & any_dir1, np.maximum(g_l, masked_min(c - b_u - 1, enabled_dir1)), g_l)
+		# dir1, probe passed: update g_l, then b_u of the only enabled channel, then h_u
+		rows = should_update_g & probe_passed
+		g_l = np.where(rows, a - 1, g_l)
+		b_u = np.where((rows & self.single_enabled_dir1[members])[:, None] & enabled_dir1, np.minimum(b_u, c - g_l[:, None] - 1), b_u)
+		h_u = np.where(rows & any_dir0, np.minimum(h_u, masked_max(b_u, enabled_dir0)), h_u)
+		# dir1, probe failed: update g_u, then b_l of all enabled channels, then h_l
+		rows = should_update_g & ~probe_passed
+		g_u = np.where(rows, a - 1, g_u)
+		b_l = np.where(rows[:, None] & enabled_dir1, np.maximum(b_l, c - g_u[:, None] - 1), b_l)
+		h_l = np.where(rows & any_dir0, np.maximum(h_l, masked_min(b_l, enabled_dir0)), h_l)
+		changed = ((h_l != self.h_l[members]) | (h_u != self.h_u[members]) | (g_l != self.g_l[members]) | (g_u != self.g_u[members])
+			| (b_l != self.b_l[members]).any(axis=1) | (b_u != self.b_u[members]).any(axis=1))
+		self.h_l[members], self.h_u[members], self.g_l[members], self.g_u[members] = h_l, h_u, g_l, g_u
+		self.b_l[members], self.b_u[members] = b_l, b_u
+		return changed
+
+
+	def probe_without_jamming(self, bs):
+		'''
+			Probe all hops in lockstep until h and g are fully probed (see synthetic.probe_hop_without_jamming).
+			After each step, only the hops whose bounds have changed (or have no uncertainty left) are written back
+			and have their rectangles updated.
+
+			Parameters:
+			- bs: amount choice method
+
+			Return:
+			- num_probes: a list of the numbers of probes done, one per hop
+		'''
+		self.load_bounds()
+		num_probes = np.zeros(len(self.hops), dtype=int)
+		members = np.flatnonzero(self.worth_probing(np.arange(len(self.hops))))
+		while len(members) > 0:
+			chosen_dirs, amounts = zip(*self.next_dirs_and_amounts(members.tolist(), bs))
+			changed = self.probe(members, chosen_dirs, amounts)
+			num_probes[members] += 1
+			for k in members[changed].tolist():
+				self.store_bounds(k)
+			for k in members[~changed].tolist():
+				if self.hops[k].uncertainty == 0:
+					self.store_bounds(k)
+			members = members[self.worth_probing(members)]
+		return num_probes.tolist()
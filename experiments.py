@@ -39,7 +39,7 @@ from hop import Hop
 from plot import plot
 
 
-def experiment_1(prober, num_target_hops, num_runs_per_experiment, min_num_channels, max_num_channels):
+def experiment_1(prober, num_target_hops, num_runs_per_experiment, min_num_channels, max_num_channels, num_workers=1):
 	'''
 		Measure the information gain and probing speed for direct and remote probing.
 
@@ -57,6 +57,7 @@ def experiment_1(prober, num_target_hops, num_runs_per_experiment, min_num_chann
 			if False, run only direct probing on synthetic hops; 
 			if True, run direct and remote probing on synthetic and snapshot hops.
 		- jamming: use jamming (after h and g are fully probed without jamming)
+		- num_workers: the number of worker processes for remote probing (see Prober.probe_hops)
 
 		Return: None (saves the resulting plots)
 	'''
@@ -91,7 +92,8 @@ def experiment_1(prober, num_target_hops, num_runs_per_experiment, min_num_chann
 				#print("Selected" if prober is not None else "Generated", len(target_hops), "target hops with", num_channels, "channels.")
 				if remote_probing:
 					assert(prober is not None)
-					gain, speed = prober.probe_hops(target_hops_node_pairs, bs=bs, jamming=jamming)
+					gain, speed = prober.probe_hops(target_hops_node_pairs, bs=bs, jamming=jamming,
+						num_workers=num_workers)
 				else:
 					gain, speed = probe_hops_direct(target_hops, bs=bs, jamming=jamming)
 				gain_list.append(gain)
@@ -109,7 +111,10 @@ def experiment_1(prober, num_target_hops, num_runs_per_experiment, min_num_chann
 			"-" if not remote_probing else "-.", "blue" if not remote_probing else "red")
 		speed_line = (speeds, remote_or_direct + ", " + bs_or_nbs, line, color)
 		return gains_line, speed_line
-	def run_and_store_result(gains_all_lines, speed_all_lines, pos, jamming, remote_probing, bs):
+	def run_and_store_result(gains_all_lines, speed_all_lines, pos, jamming, remote_probing, bs, failure_model):
+		if prober is not None:
+			# each process gets its own random stream of failures
+			prober.failure_model = failure_model
 		gains_line, speed_line = run_one_instance_of_experiment_1(jamming, remote_probing, bs)
 		if pos % 2 == 0:
 			gains_all_lines[pos // 2] = gains_line
@@ -121,13 +126,15 @@ def experiment_1(prober, num_target_hops, num_runs_per_experiment, min_num_chann
 	y_gains_lines_jamming = manager.list([0 for _ in range(2)])
 	y_speed_lines_vanilla = manager.list([0 for _ in range(4)])
 	y_speed_lines_jamming = manager.list([0 for _ in range(4)])
+	failure_models = prober.failure_model.spawn(8) if prober is not None else [None] * 8
 	for i, jamming in enumerate((False, True)):
 		for j, remote_probing in enumerate((False, True)):
 			for k, bs in enumerate((False, True)):
 				gains_results = y_gains_lines_jamming if jamming else y_gains_lines_vanilla
 				speed_results = y_speed_lines_jamming if jamming else y_speed_lines_vanilla
 				pos = 2 * j + k
-				proc = Process(target=run_and_store_result, args=(gains_results, speed_results, pos, jamming, remote_probing, bs, ))
+				proc = Process(target=run_and_store_result, args=(gains_results, speed_results, pos, jamming, remote_probing, bs,
+					failure_models[4 * i + pos], ))
 				procs.append(proc)
 				proc.start()
 	for proc in procs:
@@ -287,16 +294,11 @@ def measure_success_rate(prober, targets):
 	successes = 0
 	global_attempts = 0
 	for target in targets:
-		paths = prober.paths_for_amount(target, PAYMENT_AMOUNT, max_paths_suggested=max_paths_suggested)
-		attempts = 0
-		while attempts < max_paths_suggested:
-			try:
-				path = next(paths)
-				successes += prober.issue_probe_along_path(path, PAYMENT_AMOUNT)
-			except Exception as e:
-				break
-			attempts += 1
-		global_attempts += attempts
+		# paths are searched for lazily, so each path reflects the bounds updated by the previous probes
+		for path in prober.paths_for_amount(target, PAYMENT_AMOUNT, max_paths_suggested=max_paths_suggested):
+			# the failure position is drawn from the prober's failure model (once per path)
+			successes += prober.issue_probe_along_path(path, PAYMENT_AMOUNT)
+			global_attempts += 1
 
 	if global_attempts == 0:
 		print('all tries failed')
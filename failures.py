@@ -0,0 +1,119 @@
+#! /usr/bin/python3
+
+'''
+This file is part of Lightning Network Probing Simulator.
+
+Copyright © 2020-2021 University of Luxembourg
+
+	Permission is hereby granted, free of charge, to any person obtaining a copy
+	of this software and associated documentation files (the "Software"), to deal
+	in the Software without restriction, including without limitation the rights
+	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+	copies of the Software, and to permit persons to whom the Software is
+	furnished to do so, subject to the following conditions:
+
+	The above copyright notice and this permission notice shall be included in all
+	copies or substantial portions of the Software.
+
+	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+	SOFTWARE.
+
+SPDX-FileType: SOURCE
+SPDX-FileCopyrightText: 2020-2021 University of Luxembourg
+SPDX-License-Identifier: MIT
+'''
+
+'''
+	A model of probe failures unrelated to liquidity (e.g., a node being offline).
+'''
+
+import numpy as np
+
+
+DEFAULT_FAILURE_RATE = 0.1
+
+
+class FailureModel:
+	'''
+		Each node on a path fails to accept a probe with some probability, independently of everything else.
+		For simplicity, this approach has no memory: a node that failed in previous probe may be fine in the next one.
+
+		Failures are drawn from a NumPy random generator owned by the model (not from the global random module),
+		so runs are reproducible given the seed, and each process can get an independent stream (see spawn).
+	'''
+
+	def __init__(self, failure_rate=DEFAULT_FAILURE_RATE, node_failure_rates=None, seed=None):
+		'''
+			Parameters:
+			- failure_rate: the failure probability of nodes not in node_failure_rates
+			- node_failure_rates: a dictionary {node: failure probability} (None if all nodes fail at failure_rate);
+			  nodes are node numbers, as in paths (see node_ids.py)
+			- seed: the seed (or a numpy.random.SeedSequence) for the random generator
+		'''
+		assert(0 <= failure_rate <= 1)
+		assert(node_failure_rates is None or all(0 <= p <= 1 for p in node_failure_rates.values()))
+		self.failure_rate = failure_rate
+		self.node_failure_rates = node_failure_rates if node_failure_rates is not None else dict()
+		self.seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+		self.rng = np.random.default_rng(self.seed_sequence)
+
+
+	def spawn(self, num_models):
+		'''
+			Create failure models with the same failure rates and independent random streams
+			(e.g., one per worker process).
+
+			Parameters:
+			- num_models: the number of models to create
+
+			Return: a list of FailureModel instances
+		'''
+		return [FailureModel(self.failure_rate, self.node_failure_rates, seed_sequence)
+			for seed_sequence in self.seed_sequence.spawn(num_models)]
+
+
+	def node_failure_rate(self, node):
+		return self.node_failure_rates.get(node, self.failure_rate)
+
+
+	def failure_position(self, path):
+		'''
+			Draw where a probe along a path fails for reasons unrelated to liquidity.
+
+			Parameters:
+			- path: a list of nodes
+
+			Return: the index of the first hop (path[i], path[i+1]) that the probe fails to cross
+			because path[i+1] failed, or the number of hops if no node failed
+		'''
+		return int(self.failure_positions([path])[0])
+
+
+	def failure_positions(self, paths):
+		'''
+			Draw failure positions (see failure_position) for many paths at once.
+
+			Parameters:
+			- paths: a list of paths (lists of nodes)
+
+			Return: a NumPy array of failure positions, one per path
+		'''
+		num_hops = np.array([len(path) - 1 for path in paths], dtype=int)
+		if not self.node_failure_rates:
+			# the first failure among independent trials with the same probability is geometrically distributed
+			if self.failure_rate == 0:
+				return num_hops
+			return np.minimum(self.rng.geometric(self.failure_rate, size=len(paths)) - 1, num_hops)
+		# one draw per hop of every path
+		failure_rates = np.array([self.node_failure_rate(node) for path in paths for node in path[1:]])
+		offsets = np.concatenate(([0], np.cumsum(num_hops)))
+		failed_hops = np.flatnonzero(self.rng.random(len(failure_rates)) < failure_rates)
+		path_indices = np.searchsorted(offsets, failed_hops, side="right") - 1
+		positions = num_hops.copy()
+		np.minimum.at(positions, path_indices, failed_hops - offsets[path_indices])
+		return positions
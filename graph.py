@@ -32,13 +32,26 @@ SPDX-License-Identifier: MIT
 	Auxiliary operations with the LN graph.
 '''
 
-from hop import Hop, dir0, dir1
+from hop import dir0, dir1
+from hop_table import HopTable
+from node_ids import NodeIds
 
 import networkx as nx
 import json
+import re
+from random import randrange
+
+
+# read snapshots in chunks of this many characters
+SNAPSHOT_CHUNK_SIZE = 1 << 20
+CHANNELS_ARRAY_START = re.compile(r'"channels"\s*:\s*\[')
+ARRAY_SEPARATOR = re.compile(r'[\s,]*')
 
 
 class Channel:
+	# there is one Channel per channel in the snapshot: don't keep a dictionary per object
+	__slots__ = ("source", "destination", "capacity", "dir0_enabled", "dir1_enabled")
+
 	def __init__(self, source, destination, capacity, dir0_enabled, dir1_enabled):
 		self.source = source
 		self.destination = destination
@@ -47,72 +60,204 @@ class Channel:
 		self.dir1_enabled = dir1_enabled
 
 
-def create_multigraph_from_snapshot(snapshot_filename):
+def read_channel_directions(snapshot_file, chunk_size=SNAPSHOT_CHUNK_SIZE):
 	'''
-		Create a NetworkX multigraph from a clightning's listchannels.json snapshot.
-		Multigraph means each edge corresponds to an edge (parallel edges allowed).
+		Read the channel directions from a clightning's listchannels.json snapshot one by one.
+		Only the current chunk of the file is kept in memory (not the whole JSON document).
+
+		Parameters:
+		- snapshot_file: the snapshot file (opened for reading)
+		- chunk_size: read the file in chunks of this many characters
+
+		Return: a generator of dictionaries, one per element of the "channels" array
+	'''
+	decoder = json.JSONDecoder()
+	buffer, position, end_of_file = "", 0, False
+	def read_more():
+		nonlocal buffer, position, end_of_file
+		chunk = snapshot_file.read(chunk_size)
+		end_of_file = not chunk
+		# drop the part of the buffer that was already parsed
+		buffer, position = buffer[position:] + chunk, 0
+		return not end_of_file
+	# find the beginning of the channels array
+	while True:
+		match = CHANNELS_ARRAY_START.search(buffer, position)
+		if match is not None:
+			position = match.end()
+			break
+		if not read_more():
+			raise ValueError("No channels array in the snapshot")
+	while True:
+		# skip whitespace and commas between array elements
+		while True:
+			match = ARRAY_SEPARATOR.match(buffer, position)
+			position = match.end()
+			if position < len(buffer) or not read_more():
+				break
+		if position == len(buffer):
+			raise ValueError("Unexpected end of the snapshot")
+		if buffer[position] == "]":
+			return
+		try:
+			channel_direction, position = decoder.raw_decode(buffer, position)
+		except json.JSONDecodeError:
+			# the element may continue in the next chunk
+			if not read_more():
+				raise
+			continue
+		yield channel_direction
+
+
+def read_snapshot_channels(snapshot_filename):
+	'''
+		Read the channels from a clightning's listchannels.json snapshot.
+
+		The snapshot is read incrementally (see read_channel_directions):
+		each channel direction is folded into a Channel as it is read.
 
 		Parameters:
 		- snapshot_filename: path to the snapshot
 
-		Return: the multigraph (the maximal connected component only).
+		Return: a dictionary {short channel ID: Channel} (in the order of the snapshot)
 	'''
 	print("Creating LN graph from file:", snapshot_filename, "...")
-	with open(snapshot_filename, 'r') as snapshot_file:
-		network = json.load(snapshot_file)
-	edges_set, nodes_set = set(), set()
-	edges, channels = [], dict()
+	channels = dict()
 	# cid -> Channel
-	for channel_direction in network["channels"]:
-		cid = channel_direction["short_channel_id"]
-		direction = channel_direction["source"] < channel_direction["destination"]
-		if direction == dir0:
-			source = channel_direction["source"]
-			destination = channel_direction["destination"]
-		else:
-			source = channel_direction["destination"]
-			destination = channel_direction["source"]
-		if cid not in channels:
-			#print("creating new channel for", cid)
-			dir0_enabled, dir1_enabled = (channel_direction["active"], False) if direction == dir0 else (False, channel_direction["active"])
-			channel = Channel(source, destination, channel_direction["satoshis"], dir0_enabled, dir1_enabled)
-			channels[cid] = channel
-		else:
-			#print("updating existing channels for", cid)
-			channel = channels[cid]
+	with open(snapshot_filename, 'r') as snapshot_file:
+		for channel_direction in read_channel_directions(snapshot_file):
+			cid = channel_direction["short_channel_id"]
+			direction = channel_direction["source"] < channel_direction["destination"]
 			if direction == dir0:
-				channel.dir0_enabled = channel_direction["active"]
+				source = channel_direction["source"]
+				destination = channel_direction["destination"]
+			else:
+				source = channel_direction["destination"]
+				destination = channel_direction["source"]
+			if cid not in channels:
+				#print("creating new channel for", cid)
+				dir0_enabled, dir1_enabled = (channel_direction["active"], False) if direction == dir0 else (False, channel_direction["active"])
+				channel = Channel(source, destination, channel_direction["satoshis"], dir0_enabled, dir1_enabled)
+				channels[cid] = channel
 			else:
-				channel.dir1_enabled = channel_direction["active"]
+				#print("updating existing channels for", cid)
+				channel = channels[cid]
+				if direction == dir0:
+					channel.dir0_enabled = channel_direction["active"]
+				else:
+					channel.dir1_enabled = channel_direction["active"]
 	# count how many uni-directional channels we have
 	num_bidirectional = sum([1 for cid in channels if channels[cid].dir0_enabled and channels[cid].dir1_enabled ])
 	print("Total channels:", len(channels))
 	print("Bidirectional channels:", num_bidirectional)
-	for cid in channels:
-		channel = channels[cid]
-		edges.append((channel.source, channel.destination, cid,
-			{
-			"capacity": channel.capacity,
-			"dir0_enabled": channel.dir0_enabled,
-			"dir1_enabled": channel.dir1_enabled,
-			}))
-		edges_set.add(cid)
-		nodes_set.add(source)
-		nodes_set.add(destination)
-	nodes = list(nodes_set)
+	return channels
+
+
+def largest_connected_component(pairs):
+	'''
+		Find the largest connected component of a graph given by its edges, with union-find over node numbers.
+		If several components are equally large, the one whose first node appears first is chosen.
+
+		Parameters:
+		- pairs: an iterable of node pairs (edges)
+
+		Return:
+		- nodes: the nodes of the largest component (in the order of their first appearance in pairs)
+		- num_nodes: the number of nodes in the graph
+		- num_components: the number of connected components
+	'''
+	# nodes are numbered in the order of their first appearance
+	node_index = dict()
+	# the parent of each node; the root of a component is its first node
+	parent = []
+	def find(i):
+		while parent[i] != i:
+			# path halving
+			parent[i] = parent[parent[i]]
+			i = parent[i]
+		return i
+	for n1, n2 in pairs:
+		for node in (n1, n2):
+			if node not in node_index:
+				node_index[node] = len(parent)
+				parent.append(len(parent))
+		root1, root2 = find(node_index[n1]), find(node_index[n2])
+		if root1 != root2:
+			parent[max(root1, root2)] = min(root1, root2)
+	roots = [find(i) for i in range(len(parent))]
+	component_sizes = dict()
+	for root in roots:
+		component_sizes[root] = component_sizes.get(root, 0) + 1
+	# roots appear in the order of components' first nodes: max picks the first of equally large components
+	largest_root = max(component_sizes, key=component_sizes.get) if component_sizes else None
+	nodes = [node for node, root in zip(node_index, roots) if root == largest_root]
+	return nodes, len(parent), len(component_sizes)
+
+
+def snapshot_hop_graph_structure(snapshot_filename):
+	'''
+		Group the channels of a snapshot into hops, in one pass over the channels (without a multigraph).
+		Only the largest connected component is kept (as in create_multigraph_from_snapshot).
+
+		Parameters:
+		- snapshot_filename: path to the snapshot
+
+		Return:
+		- nodes: the list of nodes (in the order of their first channel)
+		- hops: a list of (n1, n2, capacities, e_dir0, e_dir1) tuples, one per hop (in the order of their first channel),
+		  as in hop_graph_structure (n1 < n2)
+		- n_channels: the number of channels in the snapshot
+	'''
+	channels = read_snapshot_channels(snapshot_filename)
+	# (n1, n2) -> (n1, n2, capacities, e_dir0, e_dir1); Channel sources are always smaller than destinations
+	hops = dict()
+	for channel in channels.values():
+		pair = (channel.source, channel.destination)
+		if pair not in hops:
+			hops[pair] = (channel.source, channel.destination, [], [], [])
+		_, _, capacities, e_dir0, e_dir1 = hops[pair]
+		if channel.dir0_enabled:
+			e_dir0.append(len(capacities))
+		if channel.dir1_enabled:
+			e_dir1.append(len(capacities))
+		capacities.append(channel.capacity)
+	# continue with the largest connected component
+	# (parallel channels don't affect connectivity: node pairs of hops are enough)
+	nodes, num_nodes, num_components = largest_connected_component(hops)
+	print("LN snapshot contains:", num_nodes, "nodes,", len(channels), "channels.")
+	print("Components:", num_components, ". Continuing with the largest component.")
+	largest_component = set(nodes)
+	hops = [hop for (n1, n2), hop in hops.items() if n1 in largest_component]
+	print("LN graph created with", len(nodes), "nodes,", sum(len(capacities) for _, _, capacities, _, _ in hops), "channels.")
+	return nodes, hops, len(channels)
+
+
+def create_multigraph_from_snapshot(snapshot_filename):
+	'''
+		Create a NetworkX multigraph from a clightning's listchannels.json snapshot.
+		Multigraph means each edge corresponds to an edge (parallel edges allowed).
+		(To create a hop graph, snapshot_hop_graph_structure is faster: it doesn't need a multigraph.)
+
+		Parameters:
+		- snapshot_filename: path to the snapshot
+
+		Return: the multigraph (the maximal connected component only).
+	'''
+	channels = read_snapshot_channels(snapshot_filename)
+	# find the largest connected component first, and only add its channels to the multigraph
+	nodes, num_nodes, num_components = largest_connected_component(
+		(channel.source, channel.destination) for channel in channels.values())
+	print("LN snapshot contains:", num_nodes, "nodes,", len(channels), "channels.")
+	print("Components:", num_components, ". Continuing with the largest component.")
+	largest_component = set(nodes)
 	g = nx.MultiGraph()
 	g.add_nodes_from(nodes)
-	g.add_edges_from(edges)
-	print("LN snapshot contains:", g.number_of_nodes(), "nodes,", g.number_of_edges(), "channels.")
-	# continue with the largest connected component
-	components = sorted(nx.connected_components(g), key=len, reverse=True)
-	print("Components:", len(components), ". Continuing with the largest component.")
-	def connected_component_subgraphs(G):
-		# https://github.com/rkistner/chinese-postman/issues/21#issuecomment-568980233
-		for c in nx.connected_components(G):
-			yield G.subgraph(c)
-	# create a new MultiGraph to unfreeze
-	g = nx.MultiGraph(max(connected_component_subgraphs(g), key=len))
+	g.add_edges_from((channel.source, channel.destination, cid,
+		{
+		"capacity": channel.capacity,
+		"dir0_enabled": channel.dir0_enabled,
+		"dir1_enabled": channel.dir1_enabled,
+		}) for cid, channel in channels.items() if channel.source in largest_component)
 	print("LN graph created with", g.number_of_nodes(), "nodes,", g.number_of_edges(), "channels.")
 	return g, len(channels)
 
@@ -123,18 +268,36 @@ def ln_multigraph_to_hop_graph(ln_multigraph):
 		A hopgraph doesn't allow parallel edges.
 		Instead, parallel channels are encoded in edge attributes.
 
+		All hops are stored in a HopTable (available as the "hop_table" graph attribute);
+		each edge only holds a lightweight view of its hop.
+
 		Parameters:
 		- ln_multigraph: LN model multigraph
 
 		Return:
-		- hop_graph: a non-directed graph where each edge models a hop
+		- hop_graph: a non-directed graph where each edge models a hop (between node numbers, see node_ids.py)
 	'''
-	hop_graph = nx.Graph()
-	# initialize hop graph with nodes and empty edge attributes
+	return create_hop_graph(*hop_graph_structure(ln_multigraph))
+
+
+def hop_graph_structure(ln_multigraph):
+	'''
+		Group the channels of an LN multigraph into hops (see ln_multigraph_to_hop_graph).
+
+		Parameters:
+		- ln_multigraph: LN model multigraph
+
+		Return:
+		- nodes: the list of nodes (in the order of the hop graph)
+		- hops: a list of (n1, n2, capacities, e_dir0, e_dir1) tuples, one per hop (in the order of the hop graph)
+	'''
+	nodes = dict()
+	hops = dict()
 	for n1, n2 in ln_multigraph.edges():
-		hop_graph.add_nodes_from([n1, n2])
-		hop_graph.add_edge(n1, n2)
-	for n1, n2, k, d in ln_multigraph.edges(keys=True, data=True):
+		nodes.setdefault(n1, None)
+		nodes.setdefault(n2, None)
+		if (n1, n2) in hops:
+			continue
 		multi_edge = ln_multigraph[n1][n2]
 		cids = [cid for cid in multi_edge]
 		capacities, e_dir0, e_dir1 = [], [], []
@@ -144,7 +307,49 @@ def ln_multigraph_to_hop_graph(ln_multigraph):
 				e_dir0.append(i)
 			if multi_edge[cid]["dir1_enabled"]:
 				e_dir1.append(i)
-		hop_graph[n1][n2]["hop"] = Hop(capacities, e_dir0, e_dir1)
-	return hop_graph
+		hops[(n1, n2)] = (n1, n2, capacities, e_dir0, e_dir1)
+	return list(nodes), list(hops.values())
+
+
+def create_hop_graph(nodes, hops):
+	'''
+		Create a hop graph with random balances (see ln_multigraph_to_hop_graph).
+
+		Parameters:
+		- nodes: the list of nodes
+		- hops: a list of (n1, n2, capacities, e_dir0, e_dir1) tuples, one per hop
+
+		Return:
+		- hop_graph: a non-directed graph where each edge models a hop
+		  Nodes of the graph are node numbers; the NodeIds mapping is available as the "node_ids" graph attribute.
+	'''
+	node_ids = NodeIds(nodes)
+	numbers = node_ids.numbers
+	hop_ends = [(numbers[n1], numbers[n2]) for n1, n2, _, _, _ in hops]
+	# pick balances randomly between zero and capacity (in the same order as Hop does)
+	hop_table = HopTable([(capacities, e_dir0, e_dir1, [randrange(c) for c in capacities])
+		for _, _, capacities, e_dir0, e_dir1 in hops])
+	return assemble_hop_graph(node_ids, [numbers[node] for node in nodes], hop_ends, hop_table)
+
+
+def assemble_hop_graph(node_ids, graph_nodes, hop_ends, hop_table):
+	'''
+		Create a hop graph whose edges are views of the hops in a hop table.
+
+		Parameters:
+		- node_ids: the NodeIds of the nodes
+		- graph_nodes: the node numbers of the nodes, in the order of the graph
+		- hop_ends: a list of (n1, n2) node number pairs, one per hop of the table
+		- hop_table: the HopTable with the hops
 
-	
\ No newline at end of file
+		Return:
+		- hop_graph: the hop graph (see create_hop_graph)
+	'''
+	hop_graph = nx.Graph()
+	hop_graph.add_nodes_from(graph_nodes)
+	hop_graph.add_edges_from(hop_ends)
+	for index, (n1, n2) in enumerate(hop_ends):
+		hop_graph[n1][n2]["hop"] = hop_table.view(index)
+	hop_graph.graph["hop_table"] = hop_table
+	hop_graph.graph["node_ids"] = node_ids
+	return hop_graph
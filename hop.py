@@ -32,19 +32,188 @@ SPDX-License-Identifier: MIT
 	A model of a hop with parallel channels.
 '''
 
-from rectangle import ProbingRectangle, Rectangle
+from rectangle import ProbingRectangle, Rectangle, ProbingRectangleBatch, RectangleBatch
 
-from itertools import product
+from collections import OrderedDict
 from math import log2
 from random import randint, randrange
 
+import numpy as np
+
 # We encode channel direction as a boolean.
 # Direction 0 is from the alphanumerically lower node ID to the higher, direction 1 is the opposite.
+# (Hop graphs compare node numbers instead, which are ordered as node IDs, see node_ids.py.)
 dir0 = True
 dir1 = False
 
+# We assume some payment traffic across the channel locked in-flight, so probes only see this share of the balance
+# in either direction (see Hop.probe).
+IN_FLIGHT = 0.5
+
+# Validation levels: how often hops check their invariants (asserts on bounds and rectangles).
+# Full: after every update (and in every S(F) calculation).
+# Sampled: after every validation_sample_period-th update.
+# Off: never (fastest, for production runs).
+VALIDATION_FULL = "full"
+VALIDATION_SAMPLED = "sampled"
+VALIDATION_OFF = "off"
+VALIDATION_LEVELS = [VALIDATION_FULL, VALIDATION_SAMPLED, VALIDATION_OFF]
+
+
+def set_validation(validation, validation_sample_period=None):
+	'''
+		Set the default validation level for all hops (unless overridden per hop).
+
+		Parameters:
+		- validation: one of VALIDATION_LEVELS
+		- validation_sample_period: in sampled mode, check every this many updates (if None, keep the current value)
+	'''
+	assert(validation in VALIDATION_LEVELS), validation
+	Hop.validation = validation
+	if validation_sample_period is not None:
+		assert(validation_sample_period > 0)
+		Hop.validation_sample_period = validation_sample_period
+
+
+# Sets of channels (enabled, jammed) are stored as integer bitmasks: bit i is set if channel i is in the set.
+
+def channels_to_mask(channels):
+	'''
+		Return the bitmask of a collection of channel indices.
+	'''
+	mask = 0
+	for i in channels:
+		mask |= 1 << i
+	return mask
+
+
+def mask_to_channels(mask):
+	'''
+		Return the list of channel indices in a bitmask (in increasing order).
+	'''
+	channels = []
+	while mask:
+		lowest_bit = mask & -mask
+		channels.append(lowest_bit.bit_length() - 1)
+		mask ^= lowest_bit
+	return channels
+
+
+def popcount(mask):
+	'''
+		Return the number of channels in a bitmask.
+	'''
+	return bin(mask).count("1")
+
+
+def S_F_generic_batch(R_h_l, R_h_u, R_g_l, R_g_u, R_b, exact=True, validate=True):
+	'''
+		Vectorized Hop.S_F_generic: calculate S(F) for each row of five RectangleBatch'es.
+		The rows may correspond to different amounts for one hop, or to different hops of the same dimension.
+
+		Parameters:
+		- R_h_l, R_h_u, R_g_l, R_g_u, R_b: RectangleBatch'es (see Hop.S_F_generic)
+		- exact: if False, calculate areas as floating point numbers
+		- validate: check invariants (in exact mode only): a boolean for all rows, or a boolean array selecting the rows to check
+
+		Return:
+		- S_F: an array of areas of F, one per row
+	'''
+	k = max(len(R_h_l), len(R_h_u), len(R_g_l), len(R_g_u), len(R_b))
+	N = R_b.l_vertices.shape[1]
+	# intersect (R_h_u or R_h_l) with (R_g_u or R_g_l) and R_b: R_u_u, R_u_l, R_l_u, R_l_l
+	# (all four at once: one NumPy pass is much cheaper than many small ones)
+	l_vertices = np.empty((4, k, N), dtype=np.int64)
+	u_vertices = np.empty((4, k, N), dtype=np.int64)
+	for i, (R_h, R_g) in enumerate(((R_h_u, R_g_u), (R_h_u, R_g_l), (R_h_l, R_g_u), (R_h_l, R_g_l))):
+		np.maximum(R_h.l_vertices, R_g.l_vertices, out=l_vertices[i])
+		np.minimum(R_h.u_vertices, R_g.u_vertices, out=u_vertices[i])
+	np.maximum(l_vertices, R_b.l_vertices, out=l_vertices)
+	np.minimum(u_vertices, R_b.u_vertices, out=u_vertices)
+	# the (cheaper) floating point pass is only a screening heuristic: check invariants in exact passes
+	validate = np.asarray(validate) & exact
+	if validate.any():
+		R_u_u, R_l_l = RectangleBatch(l_vertices[0], u_vertices[0]), RectangleBatch(l_vertices[3], u_vertices[3])
+		assert((R_l_l.is_inside(R_u_u) | ~validate).all())
+	# exact areas are multiplied as Python integers: they easily overflow 64 bits
+	widths = np.maximum(u_vertices - l_vertices + 1, 0)
+	S_u_u, S_u_l, S_l_u, S_l_l = widths.astype(object if exact else float).prod(axis=2)
+	S_F = S_u_u - S_u_l - S_l_u + S_l_l
+	if validate.any():
+		assert(((S_F >= 0) | ~validate).all())
+	return S_F
+
+
+class DecisionCache:
+	'''
+		A bounded LRU cache of probing decisions (directions and amounts).
+
+		Decisions only depend on the hop's capacities, enabled and jammed channels, and current bounds
+		(not on the true balances), so hops in identical states can share them.
+	'''
+
+	def __init__(self, max_size=2**16):
+		'''
+			Parameters:
+			- max_size: the maximal number of cached decisions (least recently used ones are evicted)
+		'''
+		assert(max_size > 0)
+		self.max_size = max_size
+		self.decisions = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+
+	def __len__(self):
+		return len(self.decisions)
+
+
+	def get(self, key):
+		'''
+			Return the cached decision for key, or None if there is none.
+		'''
+		decision = self.decisions.get(key)
+		if decision is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+			self.decisions.move_to_end(key)
+		return decision
+
+
+	def put(self, key, decision):
+		self.decisions[key] = decision
+		if len(self.decisions) > self.max_size:
+			self.decisions.popitem(last=False)
+
+
+	def clear(self):
+		self.decisions.clear()
+		self.hits, self.misses = 0, 0
+
+
+def set_decision_cache(max_size):
+	'''
+		Set up the decision cache shared by all hops.
+
+		Parameters:
+		- max_size: the maximal number of cached decisions (if 0, decisions are not cached)
+
+		Return: the new cache (its hits and misses attributes count cache lookups), or None
+	'''
+	Hop.decision_cache = DecisionCache(max_size) if max_size > 0 else None
+	return Hop.decision_cache
+
+
 class Hop:
 
+	# probing decisions shared by all hops (see set_decision_cache)
+	decision_cache = DecisionCache()
+
+	# the default validation level and sampling period (see set_validation)
+	validation = VALIDATION_FULL
+	validation_sample_period = 100
+
 	def __init__(self, capacities, e_dir0, e_dir1, balances=None, granularity=1):
 		'''
 			Initialize a hop.
@@ -64,7 +233,8 @@ class Hop:
 			assert(max(e_dir1) <= self.N)
 		self.c = capacities
 		self.e = {dir0: e_dir0, dir1: e_dir1}	# enabled
-		self.j = {dir0: [], dir1: []}			# jammed
+		self.e_mask = {dir0: channels_to_mask(e_dir0), dir1: channels_to_mask(e_dir1)}
+		self.j_mask = {dir0: 0, dir1: 0}		# jammed (see the j property)
 		if balances:
 			# if balances are provided, check their consistency w.r.t. capacities
 			assert(all(0 <= b <= c for b,c in zip(balances, capacities)))
@@ -73,34 +243,63 @@ class Hop:
 			# for each channel, pick a balance randomly between zero and capacity
 			self.b = [randrange(self.c[i]) for i in range(self.N)]
 		# h is how much a hop can forward in dir0, if no channels are jammed
-		self.h = max([b for i,b in enumerate(self.b) if i in self.e[dir0]]) if self.can_forward(dir0) else 0
+		self.h = max([b for i,b in enumerate(self.b) if self.is_enabled(i, dir0)]) if self.can_forward(dir0) else 0
 		# g is how much a hop can forward in dir1, if no channels are jammed
-		self.g = max([self.c[i] - b for i,b in enumerate(self.b) if i in self.e[dir1]]) if self.can_forward(dir1) else 0
+		self.g = max([self.c[i] - b for i,b in enumerate(self.b) if self.is_enabled(i, dir1)]) if self.can_forward(dir1) else 0
 		self.granularity = granularity
 		self.uncertainty = None 	# will be set later
+		self.num_updates = 0
+		# initial estimates (see reset_estimates), keyed by whether the hop can forward in dir0 and dir1
+		self.initial_estimates = dict()
 		self.reset_estimates()
 
 
+	@property
+	def j(self):
+		# jammed channels in each direction, as lists of indices
+		return {dir0: mask_to_channels(self.j_mask[dir0]), dir1: mask_to_channels(self.j_mask[dir1])}
+
+
+	def is_enabled(self, channel_index, direction):
+		return (self.e_mask[direction] >> channel_index) & 1 == 1
+
+
+	def is_jammed(self, channel_index, direction):
+		return (self.j_mask[direction] >> channel_index) & 1 == 1
+
+
+	def is_jamming(self):
+		# at least one channel is jammed in some direction
+		return self.j_mask[dir0] != 0 or self.j_mask[dir1] != 0
+
+
+	def available_mask(self, direction):
+		# available channels are channels that are enabled and not jammed
+		return self.e_mask[direction] & ~self.j_mask[direction]
+
+
+	def available_channels(self, direction):
+		return mask_to_channels(self.available_mask(direction))
+
+
 	def can_forward(self, direction):
 		# there is at least one channel enabled and not jammed in this direction
-		return not all(i in self.j[direction] for i in self.e[direction])
+		return self.available_mask(direction) != 0
 
 
 	def jam(self, channel_index, direction):
 		num_jams = 0
-		if channel_index not in self.j[direction]:
+		if not self.is_jammed(channel_index, direction):
 			#print("jamming channel", channel_index, "in direction", "dir0" if direction else "dir1")
-			self.j[direction].append(channel_index)
+			self.j_mask[direction] |= 1 << channel_index
 			num_jams += 1
 		return num_jams
 
 
 	def jam_all_except_in_direction(self, channel_index, direction):
-		num_jams = 0
-		for i in self.e[direction]:
-			if i != channel_index:
-				num_jams += self.jam(i, direction)
-		return num_jams
+		to_jam = self.available_mask(direction) & ~(1 << channel_index)
+		self.j_mask[direction] |= to_jam
+		return popcount(to_jam)
 
 	def jam_all(self):
 		jammed_channels = 0
@@ -130,14 +329,12 @@ class Hop:
 
 
 	def unjam(self, channel_index, direction):
-		if channel_index in self.j[direction]:
-			#print("unjamming channel", channel_index, "in direction", "dir0" if direction else "dir1")
-			self.j[direction].remove(channel_index)
+		#print("unjamming channel", channel_index, "in direction", "dir0" if direction else "dir1")
+		self.j_mask[direction] &= ~(1 << channel_index)
 
 
 	def unjam_all_in_direction(self, direction):
-		for i in self.e[direction]:
-			self.unjam(i, direction)
+		self.j_mask[direction] &= ~self.e_mask[direction]
 
 
 	def unjam_all(self):
@@ -145,27 +342,74 @@ class Hop:
 		self.unjam_all_in_direction(dir1)
 
 
-	def get_corner_points(self):
+	def set_validation(self, validation, validation_sample_period=None):
+		'''
+			Set the validation level for this hop only (see the module-level set_validation).
+		'''
+		assert(validation in VALIDATION_LEVELS), validation
+		self.validation = validation
+		if validation_sample_period is not None:
+			assert(validation_sample_period > 0)
+			self.validation_sample_period = validation_sample_period
+
+
+	def should_validate(self):
+		'''
+			Return True if the invariants should be checked after the current update.
+		'''
+		if self.validation == VALIDATION_FULL:
+			return True
+		if self.validation == VALIDATION_OFF:
+			return False
+		return self.num_updates % self.validation_sample_period == 0
+
+
+	def get_corner_points(self, max_points=None):
 		'''
 			Get the corner points of R_u_u that are not yet excluded from F.
 			We could similarly get all points, but it's very slow.
 			We use this as a shortcut to stop probing when only one point remains.
 
+			A corner is excluded if it is inside R_u_l or inside R_l_u,
+			i.e., if its coordinates are within R_u_l (or within R_l_u) along every dimension.
+			Instead of checking all 2^N corners, we choose coordinates dimension by dimension
+			and only follow the choices that still lead to a viable corner.
+			Hence, each returned point costs O(N), and we return at most S_F points.
+
+			Parameters:
+			- max_points: stop after finding this many points (if None, return all corner points)
+
 			Return: points: a list of points (each point is a list of self.N coordinates).
 		'''
-		R_b = Rectangle([b_l_i + 1 for b_l_i in self.b_l], self.b_u)
-		R_u_u = self.R_h_u.intersect_with(self.R_g_u).intersect_with(R_b)
-		R_u_l = self.R_h_u.intersect_with(self.R_g_l).intersect_with(R_b)
-		R_l_u = self.R_h_l.intersect_with(self.R_g_u).intersect_with(R_b)
-		ranges = [[R_u_u.l_vertex[i], R_u_u.u_vertex[i]] for i in range(len(R_u_u.l_vertex))]
+		R_u_u, R_u_l, R_l_u = self.R_u_u, self.R_u_l, self.R_l_u
+		if R_u_u.is_empty:
+			return []
+		def is_outside(R, i, x):
+			return R.is_empty or not R.l_vertex[i] <= x <= R.u_vertex[i]
+		# the (distinct) coordinates of corners along each dimension,
+		# and whether a coordinate alone puts a corner outside R_u_l and outside R_l_u
+		choices = [[(x, is_outside(R_u_l, i, x), is_outside(R_l_u, i, x))
+			for x in sorted({R_u_u.l_vertex[i], R_u_u.u_vertex[i]})] for i in range(self.N)]
+		# reachable[i]: all combinations of (outside R_u_l, outside R_l_u) achievable along dimensions i..N-1
+		reachable = [None] * self.N + [{(False, False)}]
+		for i in reversed(range(self.N)):
+			reachable[i] = {(out_u_l or rest_u_l, out_l_u or rest_l_u)
+				for (_, out_u_l, out_l_u) in choices[i] for (rest_u_l, rest_l_u) in reachable[i + 1]}
 		points = []
-		points_left = self.S_F
-		for p in product(*ranges):
-			if not R_u_l.contains_point(p) and not R_l_u.contains_point(p):
-				points.append(p)
-				points_left -= 1
-			if points_left == 0:
-				break
+		max_points = self.S_F if max_points is None else min(max_points, self.S_F)
+		def collect(i, point, out_u_l, out_l_u):
+			if len(points) == max_points:
+				return
+			if i == self.N:
+				points.append(list(point))
+				return
+			for x, x_out_u_l, x_out_l_u in choices[i]:
+				if any((out_u_l or x_out_u_l or rest_u_l) and (out_l_u or x_out_l_u or rest_l_u)
+					for (rest_u_l, rest_l_u) in reachable[i + 1]):
+					point.append(x)
+					collect(i + 1, point, out_u_l or x_out_u_l, out_l_u or x_out_l_u)
+					point.pop()
+		collect(0, [], False, False)
 		return points
 
 	def update_dependent_hop_properties(self):
@@ -179,46 +423,141 @@ class Hop:
 			This holds only for hop-level bounds (obtained without probing),
 			but does not hold for balance bounds (obtained with probing).
 			Hence, R_b is a Rectangle, whereas all others are ProbingRectangle's.
+
+			A probe usually moves only one or two bounds.
+			We remember the bounds used in the previous update
+			and only rebuild the rectangles (and the intersection areas) that depend on changed bounds.
+
+			Invariants are checked according to the validation level.
 		'''
-		self.R_h_l = ProbingRectangle(self, direction = dir0, bound = self.h_l)
-		self.R_h_u = ProbingRectangle(self, direction = dir0, bound = self.h_u)
-		self.R_g_l = ProbingRectangle(self, direction = dir1, bound = self.g_l)
-		self.R_g_u = ProbingRectangle(self, direction = dir1, bound = self.g_u)
-		self.R_b   = Rectangle([b_l_i + 1 for b_l_i in self.b_l], self.b_u)
-		self.S_F = self.S_F_generic(self.R_h_l, self.R_h_u, self.R_g_l, self.R_g_u, self.R_b)
+		self.num_updates += 1
+		validate = self.should_validate()
+		# if some updates are not checked, rectangles may have changed since the last check: check all of them
+		check_all = self.validation != VALIDATION_FULL
+		bounds = (self.h_l, self.h_u, self.g_l, self.g_u, tuple(self.b_l), tuple(self.b_u))
+		prev_bounds = self.bounds_at_last_update
+		# after reset_estimates, there are no previous bounds, and everything is rebuilt
+		changed_h_l = prev_bounds is None or prev_bounds[0] != bounds[0]
+		changed_h_u = prev_bounds is None or prev_bounds[1] != bounds[1]
+		changed_g_l = prev_bounds is None or prev_bounds[2] != bounds[2]
+		changed_g_u = prev_bounds is None or prev_bounds[3] != bounds[3]
+		changed_b   = prev_bounds is None or prev_bounds[4:] != bounds[4:]
+		if changed_h_l:
+			self.R_h_l = ProbingRectangle(self, direction = dir0, bound = self.h_l)
+		if changed_h_u:
+			self.R_h_u = ProbingRectangle(self, direction = dir0, bound = self.h_u)
+		if changed_g_l:
+			self.R_g_l = ProbingRectangle(self, direction = dir1, bound = self.g_l)
+		if changed_g_u:
+			self.R_g_u = ProbingRectangle(self, direction = dir1, bound = self.g_u)
+		if changed_b:
+			# copy b_u: the rectangle must not change when b_u is updated in place
+			self.R_b = Rectangle([b_l_i + 1 for b_l_i in self.b_l], self.b_u.copy())
+		# each intersection depends on one bound on h, one bound on g, and R_b
+		if changed_h_u or changed_g_u or changed_b:
+			self.R_u_u = self.R_h_u.intersect_with(self.R_g_u).intersect_with(self.R_b)
+			self.S_u_u = self.R_u_u.S()
+		if changed_h_u or changed_g_l or changed_b:
+			self.R_u_l = self.R_h_u.intersect_with(self.R_g_l).intersect_with(self.R_b)
+			self.S_u_l = self.R_u_l.S()
+		if changed_h_l or changed_g_u or changed_b:
+			self.R_l_u = self.R_h_l.intersect_with(self.R_g_u).intersect_with(self.R_b)
+			self.S_l_u = self.R_l_u.S()
+		if changed_h_l or changed_g_l or changed_b:
+			self.R_l_l = self.R_h_l.intersect_with(self.R_g_l).intersect_with(self.R_b)
+			self.S_l_l = self.R_l_l.S()
+		self.S_F = self.S_u_u - self.S_u_l - self.S_l_u + self.S_l_l
+		self.bounds_at_last_update = bounds
+		if validate:
+			self.check_invariants(changed_h_l or check_all, changed_h_u or check_all,
+				changed_g_l or check_all, changed_g_u or check_all, changed_b or check_all)
 		self.uncertainty = max(0, log2(self.S_F) - log2(self.granularity))
+
+
+	def check_invariants(self, check_h_l=True, check_h_u=True, check_g_l=True, check_g_u=True, check_b=True):
+		'''
+			Assert that the current bounds and rectangles are consistent with each other and with the true balances.
+
+			Parameters:
+			- check_h_l, check_h_u, check_g_l, check_g_u, check_b: check the respective rectangles
+			  (the bounds and S(F) are always checked)
+		'''
+		if check_h_l or check_h_u or check_g_l or check_g_u or check_b:
+			assert(self.R_l_l.is_inside(self.R_u_u)), self
+		assert(self.S_F >= 0), self
 		assert(all(-1 <= self.b_l[i] <= self.b_u[i] <= self.c[i] for i in range(len(self.c)))), self
 		assert(-1 <= self.h_l < self.h <= self.h_u <= max(self.c)), self
 		assert(-1 <= self.g_l < self.g <= self.g_u <= max(self.c)), self
-		# Assert that the true balances are inside F (as defined by the current bounds)
-		b_inside_R_h_u = self.R_h_u.contains_point(self.b)
-		b_inside_R_g_u = self.R_g_u.contains_point(self.b)
-		b_inside_R_h_l = self.R_h_l.contains_point(self.b)
-		b_inside_R_g_l = self.R_g_l.contains_point(self.b)
-		b_inside_R_b   = self.R_b.contains_point(self.b)
+		# Assert that the true balances are inside F (as defined by the current bounds).
+		# The true balances never change, so we only check the rebuilt rectangles.
 		# B must be within the upper bounds' rectangles
-		assert(b_inside_R_h_u), 		"\nB:\n" + "\n".join([str(self.b), str(self.R_h_u)])
-		assert(b_inside_R_g_u), 		"\nB:\n" + "\n".join([str(self.b), str(self.R_g_u)])
+		if check_h_u:
+			assert(self.R_h_u.contains_point(self.b)), 		"\nB:\n" + "\n".join([str(self.b), str(self.R_h_u)])
+		if check_g_u:
+			assert(self.R_g_u.contains_point(self.b)), 		"\nB:\n" + "\n".join([str(self.b), str(self.R_g_u)])
 		# B must be outside the lower bounds' rectangles
-		assert(not b_inside_R_h_l), 	"\nB:\n" + "\n".join([str(self.b), str(self.R_h_l)])
-		assert(not b_inside_R_g_l), 	"\nB:\n" + "\n".join([str(self.b), str(self.R_g_l)])
+		if check_h_l:
+			assert(not self.R_h_l.contains_point(self.b)), 	"\nB:\n" + "\n".join([str(self.b), str(self.R_h_l)])
+		if check_g_l:
+			assert(not self.R_g_l.contains_point(self.b)), 	"\nB:\n" + "\n".join([str(self.b), str(self.R_g_l)])
 		# B must be inside the current balance bounds rectangle
-		assert(b_inside_R_b), 			"\nB:\n" + "\n".join([str(self.b), str(self.R_b)])
+		if check_b:
+			assert(self.R_b.contains_point(self.b)), 		"\nB:\n" + "\n".join([str(self.b), str(self.R_b)])
 
 
 	def reset_estimates(self):
 		'''
 			Set all variable hop parameters to their initial values.
 			MUST be called on hop initialization and before running repeated probing on the same hops.
+
+			The initial estimates only depend on whether the hop can forward in each direction.
+			They are calculated once and then restored from a cached snapshot.
 		'''
+		key = (self.can_forward(dir0), self.can_forward(dir1))
+		if key in self.initial_estimates:
+			self.restore_estimates(self.initial_estimates[key])
+			return
 		self.h_l = -1
 		self.g_l = -1
 		# NB: setting upper bound to max(self.c) (and not 0) if hop can't forward is correct from the rectangle theory viewpoint
-		self.h_u = max([c for (i,c) in enumerate(self.c) if i in self.e[dir0]]) if self.can_forward(dir0) else max(self.c)
-		self.g_u = max([c for (i,c) in enumerate(self.c) if i in self.e[dir1]]) if self.can_forward(dir1) else max(self.c)
+		self.h_u = max([c for (i,c) in enumerate(self.c) if self.is_enabled(i, dir0)]) if self.can_forward(dir0) else max(self.c)
+		self.g_u = max([c for (i,c) in enumerate(self.c) if self.is_enabled(i, dir1)]) if self.can_forward(dir1) else max(self.c)
 		self.b_l = [-1] * self.N
 		self.b_u = [self.c[i] for i in range(len(self.c))]
+		# force rebuilding all rectangles
+		self.bounds_at_last_update = None
 		self.update_dependent_hop_properties()
+		self.initial_estimates[key] = self.snapshot_estimates()
+
+
+	def snapshot_estimates(self):
+		'''
+			Capture the current estimates (bounds and all properties derived from them).
+			Jammed channels are not part of the estimates.
+
+			Return: an immutable token to pass to restore_estimates
+		'''
+		# rectangles are never modified after creation, so they can be shared between tokens and the hop
+		return (self.bounds_at_last_update,
+			(self.R_h_l, self.R_h_u, self.R_g_l, self.R_g_u, self.R_b, self.R_u_u, self.R_u_l, self.R_l_u, self.R_l_l),
+			(self.S_u_u, self.S_u_l, self.S_l_u, self.S_l_l, self.S_F),
+			self.uncertainty)
+
+
+	def restore_estimates(self, estimates):
+		'''
+			Restore the estimates captured by snapshot_estimates.
+			Nothing is recalculated: this takes time proportional to the number of channels.
+
+			Parameters:
+			- estimates: a token returned by snapshot_estimates (of this hop)
+		'''
+		bounds, rectangles, areas, self.uncertainty = estimates
+		self.h_l, self.h_u, self.g_l, self.g_u = bounds[:4]
+		self.b_l, self.b_u = list(bounds[4]), list(bounds[5])
+		(self.R_h_l, self.R_h_u, self.R_g_l, self.R_g_u, self.R_b, self.R_u_u, self.R_u_l, self.R_l_u, self.R_l_l) = rectangles
+		self.S_u_u, self.S_u_l, self.S_l_u, self.S_l_l, self.S_F = areas
+		self.bounds_at_last_update = bounds
 
 
 	def __str__(self):
@@ -276,7 +615,7 @@ class Hop:
 			# h and g are "permanent" hop properties, assuming all channels unjammed.
 			# For single-channel hops, h / g bounds are not independent.
 			# Hence, it is sufficient for channel to be enabled in one direction.
-			if (ch_i in self.e[direction] or self.N == 1 or bound < 0) and bound <= self.c[ch_i]:
+			if (self.is_enabled(ch_i, direction) or self.N == 1 or bound < 0) and bound <= self.c[ch_i]:
 				eff_bound = bound
 			else:
 				eff_bound = self.c[ch_i]
@@ -285,7 +624,8 @@ class Hop:
 		def effective_coordinate(bound, ch_i):
 			return effective_bound(bound, ch_i) if direction == dir0 else self.c[ch_i] - effective_bound(bound, ch_i)
 		eff_vertex = [effective_coordinate(bound, ch_i) for ch_i in range(self.N)]
-		assert(max(eff_vertex) <= max(self.c) + 1), (eff_vertex, max(self.c))
+		if self.validation == VALIDATION_FULL:
+			assert(max(eff_vertex) <= max(self.c) + 1), (eff_vertex, max(self.c))
 		#print("coordinates of effective vertex for bound = ", bound, "in", ("dir0" if direction else "dir1"), ":", eff_vertex)
 		return eff_vertex
 	
@@ -337,10 +677,12 @@ class Hop:
 		print("\nR_l_u:", R_l_u, R_l_u.S())
 		print("\nR_l_l:", R_l_l, R_l_l.S())
 		'''
-		assert(R_l_l.is_inside(R_u_u)), self
+		if self.validation == VALIDATION_FULL:
+			assert(R_l_l.is_inside(R_u_u)), self
 		S_F = R_u_u.S() - R_u_l.S() - R_l_u.S() + R_l_l.S()
 		#print(R_u_u.S(), "-", R_u_l.S(), "-", R_l_u.S(), "+", R_l_l.S(), "=", S_F)
-		assert(S_F >= 0), self
+		if self.validation == VALIDATION_FULL:
+			assert(S_F >= 0), self
 		return S_F
 
 
@@ -357,8 +699,8 @@ class Hop:
 		new_b_l = [0] * len(self.b_l)
 		new_b_u = self.c.copy()
 		# available channels are channels that are enabled and not jammed
-		available_channels = [i for i in self.e[direction] if i not in self.j[direction]]
-		jamming = len(self.j[dir0]) > 0 or len(self.j[dir1]) > 0
+		available_channels = self.available_channels(direction)
+		jamming = self.is_jamming()
 		# mimic the scenario when probe fails
 		if direction == dir0:
 			new_R_h_u = self.R_h_u if jamming else ProbingRectangle(self, direction = dir0, bound = a - 1)
@@ -379,6 +721,122 @@ class Hop:
 		return S_F_a
 
 
+	def effective_vertices(self, direction, bounds):
+		'''
+			Vectorized effective_vertex: calculate effective vertices for many bounds at once.
+
+			Parameters:
+			- direction: True if the bounds correspond to probes in dir0, False otherwise
+			- bounds: a 1-D array of k bounds (each bound equals a - 1)
+
+			Return:
+			- eff_vertices: a (k, N) array, one effective vertex per row
+		'''
+		c = np.array(self.c, dtype=np.int64)
+		bounds = np.asarray(bounds, dtype=np.int64)[:, None]
+		enabled = np.zeros(self.N, dtype=bool)
+		enabled[mask_to_channels(self.e_mask[direction])] = True
+		# see effective_bound in effective_vertex
+		keep_bound = (enabled | (self.N == 1) | (bounds < 0)) & (bounds <= c)
+		eff_bounds = np.where(keep_bound, bounds, c)
+		eff_vertices = eff_bounds if direction == dir0 else c - eff_bounds
+		if self.validation == VALIDATION_FULL:
+			assert(eff_vertices.max() <= max(self.c) + 1), (eff_vertices, max(self.c))
+		return eff_vertices
+
+
+	def S_F_a_expected_batch(self, direction, amounts, exact=True):
+		'''
+			Vectorized S_F_a_expected: calculate the area under the cut for many probe amounts at once.
+
+			All rectangles are represented as RectangleBatch'es, one row per amount
+			(or a single row if the rectangle is the same for all amounts).
+
+			Parameters:
+			- direction: probe direction (dir0 / dir1)
+			- amounts: a 1-D array of k probe amounts
+			- exact: if False, calculate areas as floating point numbers
+			  (much faster, but imprecise for large hops, especially if S_F_a is small)
+
+			Return: S_F_a: an array of k areas "under the cut" (Python integers if exact)
+		'''
+		amounts = np.asarray(amounts, dtype=np.int64)
+		def as_batch(R):
+			return R.as_batch(self.N)
+		new_b_l = np.zeros((len(amounts), self.N), dtype=np.int64)
+		new_b_u = np.empty_like(new_b_l)
+		new_b_u[:] = self.c
+		# available channels are channels that are enabled and not jammed
+		available_channels = self.available_channels(direction)
+		jamming = self.is_jamming()
+		# mimic the scenario when probe fails
+		if direction == dir0:
+			new_R_h_u = as_batch(self.R_h_u) if jamming else ProbingRectangleBatch(self, direction = dir0, bounds = amounts - 1)
+			new_R_g_u = as_batch(self.R_g_u)
+			# probe failed => all available channels have insufficient balances
+			new_b_u[:, available_channels] = np.minimum(new_b_u[:, available_channels], (amounts - 1)[:, None])
+		else:
+			new_R_h_u = as_batch(self.R_h_u)
+			new_R_g_u = as_batch(self.R_g_u) if jamming else ProbingRectangleBatch(self, direction = dir1, bounds = amounts - 1)
+			if len(available_channels) == 1:
+				# we can only update the lower bound if there is only one available channel
+				# and we know the probe went through this channel
+				i = available_channels[0]
+				new_b_l[:, i] = np.maximum(new_b_l[:, i], self.c[i] - amounts)
+		new_R_b = RectangleBatch(new_b_l, new_b_u)
+		return S_F_generic_batch(as_batch(self.R_h_l), new_R_h_u, as_batch(self.R_g_l), new_R_g_u, new_R_b, exact,
+			validate = self.validation == VALIDATION_FULL)
+
+
+	def nbs_amount(self, direction, a_l, a_u, S_F_half, amounts_per_pass=64):
+		'''
+			Find the NBS amount: the smallest amount in (a_l, a_u] that leaves at least S_F_half under the cut.
+			If no such amount exists, return a_u.
+
+			The area under the cut grows with the amount.
+			Instead of halving the interval with one S(F) calculation per step,
+			we evaluate amounts_per_pass evenly spaced amounts at once and narrow the interval
+			to the two neighboring amounts around the target area.
+
+			We first narrow the interval using approximate (floating point) areas,
+			and then check the result with exact areas.
+			If the approximation was misleading, we repeat the search with exact areas.
+
+			Parameters:
+			- direction: probe direction (dir0 / dir1)
+			- a_l: the amount that is known to leave too little under the cut (exclusive)
+			- a_u: the highest amount to consider (inclusive)
+			- S_F_half: the target area under the cut
+			- amounts_per_pass: how many amounts to evaluate in one vectorized pass
+
+			Return:
+			- a: the NBS amount
+		'''
+		def search(a_l, a_u, exact):
+			while a_u - a_l > 1:
+				# evenly spaced distinct amounts from a_l + 1 to a_u - 1 (inclusive)
+				num_amounts = min(amounts_per_pass, a_u - a_l - 1)
+				amounts = a_l + 1 + np.arange(num_amounts, dtype=np.int64) * (a_u - a_l - 2) // max(1, num_amounts - 1)
+				enough = self.S_F_a_expected_batch(direction, amounts, exact) >= S_F_half
+				if enough.any():
+					first_enough = int(np.argmax(enough))
+					a_u = int(amounts[first_enough])
+					if first_enough > 0:
+						a_l = int(amounts[first_enough - 1])
+				else:
+					a_l = int(amounts[-1])
+			return a_u
+		a = search(a_l, a_u, exact=False)
+		# a is the NBS amount if a leaves enough under the cut (or a = a_u), and a - 1 doesn't (or a - 1 = a_l)
+		if a - 1 > a_l:
+			enough_prev, enough = self.S_F_a_expected_batch(direction, [a - 1, a]) >= S_F_half
+		else:
+			enough_prev, enough = False, self.S_F_a_expected_batch(direction, [a])[0] >= S_F_half
+		if (enough or a == a_u) and not enough_prev:
+			return a
+		return search(a_l, a_u, exact=True)
+
+
 	def worth_probing_h(self):
 		# is there any uncertainty left about h that we resolve it without jamming?
 		return self.can_forward(dir0) and self.h_u - self.h_l > 1
@@ -403,15 +861,52 @@ class Hop:
 		return self.uncertainty > 0
 
 
+	def decision_key(self):
+		'''
+			Return a canonical (hashable) description of everything that probing decisions depend on.
+		'''
+		# bounds_at_last_update holds all current bounds (they are only changed before an update)
+		return (tuple(self.c), self.e_mask[dir0], self.e_mask[dir1], self.j_mask[dir0], self.j_mask[dir1],
+			self.bounds_at_last_update)
+
+
+	def next_a_key(self, direction, bs, jamming):
+		'''
+			Return the decision cache key for next_a.
+		'''
+		return ("a", direction, bs, jamming, self.decision_key())
+
+
+	def next_dir_key(self, bs, jamming, prefer_small_amounts=False, threshold_area_difference=0.1):
+		'''
+			Return the decision cache key for next_dir.
+		'''
+		return ("dir", bs, jamming, prefer_small_amounts, threshold_area_difference, self.decision_key())
+
+
 	def next_a(self, direction, bs, jamming):
+		'''
+			Suggest the amount for the next probe in direction (see calculate_next_a).
+			Decisions are cached for hops in identical states.
+		'''
+		if self.decision_cache is None:
+			return self.calculate_next_a(direction, bs, jamming)
+		key = self.next_a_key(direction, bs, jamming)
+		a = self.decision_cache.get(key)
+		if a is None:
+			a = self.calculate_next_a(direction, bs, jamming)
+			self.decision_cache.put(key, a)
+		return a
+
+
+	def calculate_next_a(self, direction, bs, jamming):
 		'''
 			Calculate the optimal (NBS) amount for probe in direction.
 			The NBS amount shrinks S(F) by half.
 			(In other words, the probe leaves S_F/2 under the cut.)
-			We look for the NBS amount a using binary search:
-			starting from the current bounds in the required direction, we choose a in the middle.
-			We then check the area under the cut _if_ we probed with this amount.
-			Depending on if S_F_a < S_F or S_F_a > S_F, we increase / decrease a.
+			We look for the NBS amount a between the current bounds in the required direction:
+			we check the area under the cut _if_ we probed with a batch of candidate amounts,
+			and narrow the bounds to the candidates around S_F / 2 (see nbs_amount).
 
 			Parameters:
 			- direction: dir0 or dir1
@@ -425,30 +920,49 @@ class Hop:
 			a_l, a_u = (self.h_l + 1, self.h_u) if direction == dir0 else (self.g_l + 1, self.g_u)
 		else:
 			# individual balance bounds may be outside bounds for h / g (those are bounds for maximums!)
-			available_channels = [i for i in self.e[direction] if i not in self.j[direction]]
+			available_channels = self.available_channels(direction)
 			assert(len(available_channels) == 1), "We only support probing one unjammed channel at a time"
 			i = available_channels[0]
 			a_l, a_u = (self.b_l[i] + 1, self.b_u[i]) if direction == dir0 else (self.c[i] - self.b_u[i], self.c[i] - self.b_l[i] - 1)
-		a = (a_l + a_u + 1) // 2
 		if not bs and not jamming:
-			# we only do binary search over S(F) in pre-jamming probing phase
-			while True:
-				S_F_a = self.S_F_a_expected(direction, a)
-				#print(a_l, a, a_u)
-				if S_F_a < S_F_half:
-					a_l = a
-				else:
-					a_u = a
-				new_a = (a_l + a_u + 1) // 2
-				if new_a == a:
-					break
-				a = new_a
-				#print("if a = ", a, ", then area under cut = ", S_F_a, ", need", S_F_half)
+			# we only do NBS search over S(F) in pre-jamming probing phase
+			a = self.nbs_amount(direction, a_l, a_u, S_F_half)
+		else:
+			a = (a_l + a_u + 1) // 2
 		assert(a > 0)
 		return a
 
 
 	def next_dir(self, bs, jamming, prefer_small_amounts=False, threshold_area_difference=0.1):
+		'''
+			Suggest the direction for the next probe (see calculate_next_dir).
+			Decisions are cached for hops in identical states.
+		'''
+		if self.decision_cache is None:
+			return self.calculate_next_dir(bs, jamming, prefer_small_amounts, threshold_area_difference)
+		key = self.next_dir_key(bs, jamming, prefer_small_amounts, threshold_area_difference)
+		chosen_dir = self.decision_cache.get(key)
+		if chosen_dir is None:
+			chosen_dir = self.calculate_next_dir(bs, jamming, prefer_small_amounts, threshold_area_difference)
+			self.decision_cache.put(key, chosen_dir)
+		return chosen_dir
+
+
+	def next_dir_and_a(self, bs, jamming):
+		'''
+			Suggest the direction and the amount for the next probe.
+
+			Return:
+			- chosen_dir: the suggested direction (None if the hop can't forward in either direction)
+			- a: the suggested amount in this direction
+		'''
+		chosen_dir = self.next_dir(bs, jamming)
+		if chosen_dir is None:
+			return None, None
+		return chosen_dir, self.next_a(chosen_dir, bs, jamming)
+
+
+	def calculate_next_dir(self, bs, jamming, prefer_small_amounts=False, threshold_area_difference=0.1):
 		'''
 			Suggest the NBS direction for the next probe.
 
@@ -486,6 +1000,37 @@ class Hop:
 		return chosen_dir
 
 
+	def b_in_dir(self, i, direction):
+		# the balance of channel i available in the direction, limited by the in-flight payments (see IN_FLIGHT)
+		return (int)((self.b[i] if direction == dir0 else self.c[i] - self.b[i]) * IN_FLIGHT)
+
+
+	def set_bounds_from_corner(self):
+		'''
+			Called when no uncertainty is left after a probe.
+			If exactly one corner is a viable point, set all bounds to it.
+		'''
+		# we only need to know if there is exactly one viable corner
+		corner_points = self.get_corner_points(max_points=2)
+		assert(len(corner_points) <= 1)
+		if len(corner_points) == 1:
+			p = corner_points[0]
+			for i in range(self.N):
+				if self.worth_probing_channel(i):
+					self.b_l[i] = p[i] - 1
+					self.b_u[i] = p[i]
+			if len(self.e[dir0]) > 0:
+				self.h_l = max(self.h_l, min([p[i] for i in self.e[dir0]]) - 1)
+				self.h_u = min(self.h_u, max([p[i] for i in self.e[dir0]]))
+			if len(self.e[dir1]):
+				self.g_l = max(self.g_l, min([self.c[i] - p[i] for i in self.e[dir1]]) - 1)
+				self.g_u = min(self.g_u, max([self.c[i] - p[i] for i in self.e[dir1]]))
+		else:
+			print("Corners are not viable points, continue probing")
+			pass
+		self.update_dependent_hop_properties()
+
+
 	def probe(self, direction, amount):
 		'''
 			Update the bounds as a result of a probe.
@@ -498,20 +1043,15 @@ class Hop:
 			- None (the current bounds are updated)
 		'''
 		#print("doing probe", amount, "in", "dir0" if direction else "dir1")
-		jamming = len(self.j[dir0]) > 0 or len(self.j[dir1]) > 0
+		jamming = self.is_jamming()
 		#print("Are we jamming?", jamming)
-		available_channels = [i for i in self.e[direction] if i not in self.j[direction]]
+		available_channels = self.available_channels(direction)
 		if jamming:
 			# if we're jamming, we must jam all channels except one
 			assert(len(available_channels) <= 1)
-		def b_in_dir(i, direction):
-			# We assume some payment traffic across the channel locked in-flight, so we limit the
-			# available balance in either direction.
-			IN_FLIGHT = 0.5
-			return (int)((self.b[i] if direction == dir0 else self.c[i] - self.b[i]) * IN_FLIGHT)
 		if available_channels == []:
 			return False
-		probe_passed = amount <= max(b_in_dir(i, direction) for i in available_channels)
+		probe_passed = amount <= max(self.b_in_dir(i, direction) for i in available_channels)
 		if direction == dir0:
 			# should only update if the amount is between current bounds
 			# this is not always true for intermediary hops
@@ -573,42 +1113,19 @@ class Hop:
 		#print("after probe:", self.h_l, self.h_u, self.g_l, self.g_u)
 		self.update_dependent_hop_properties()
 		if self.uncertainty == 0:
-			corner_points = self.get_corner_points()
-			assert(len(corner_points) <= 1)
-			if len(corner_points) == 1:
-				p = corner_points[0]
-				for i in range(self.N):
-					if self.worth_probing_channel(i):
-						self.b_l[i] = p[i] - 1
-						self.b_u[i] = p[i]
-				if len(self.e[dir0]) > 0:
-					self.h_l = max(self.h_l, min([p[i] for i in self.e[dir0]]) - 1)
-					self.h_u = min(self.h_u, max([p[i] for i in self.e[dir0]]))
-				if len(self.e[dir1]):
-					self.g_l = max(self.g_l, min([self.c[i] - p[i] for i in self.e[dir1]]) - 1)
-					self.g_u = min(self.g_u, max([self.c[i] - p[i] for i in self.e[dir1]]))
-			else:
-				print("Corners are not viable points, continue probing")
-				pass
-			self.update_dependent_hop_properties()
+			self.set_bounds_from_corner()
 		return probe_passed
 
 	def available_dirs(self):
-		result = 0
-		for i in range(self.N):
-			if i not in self.j[0]:
-				result += 1
-			if i not in self.j[1]:
-				result += 1
-		return result
+		return 2 * self.N - popcount(self.j_mask[dir0]) - popcount(self.j_mask[dir1])
 
 	def available_capacity(self):
 		result = 0
-		for i in range(self.N):
-			if i not in self.j[0]:
-				result += self.c[i]
-			if i not in self.j[1]:
-				result += self.c[i]
+		for i, c in enumerate(self.c):
+			if not self.is_jammed(i, dir0):
+				result += c
+			if not self.is_jammed(i, dir1):
+				result += c
 		return result
 
 	# Returns true if rebalance-and-jam is more efficient, or false if simple slot jamming is more
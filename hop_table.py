@@ -0,0 +1,496 @@
+#! /usr/bin/python3
+
+'''
+This file is part of Lightning Network Probing Simulator.
+
+Copyright © 2020-2021 University of Luxembourg
+
+	Permission is hereby granted, free of charge, to any person obtaining a copy
+	of this software and associated documentation files (the "Software"), to deal
+	in the Software without restriction, including without limitation the rights
+	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+	copies of the Software, and to permit persons to whom the Software is
+	furnished to do so, subject to the following conditions:
+
+	The above copyright notice and this permission notice shall be included in all
+	copies or substantial portions of the Software.
+
+	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+	SOFTWARE.
+
+SPDX-FileType: SOURCE
+SPDX-FileCopyrightText: 2020-2021 University of Luxembourg
+SPDX-License-Identifier: MIT
+'''
+
+'''
+	A columnar store for all hops of an LN graph.
+
+	Hop properties are kept in NumPy arrays (columns) instead of one Hop object per hop.
+	Per-channel columns (capacities, balances, balance bounds) are concatenated for all hops;
+	each hop refers to its channels by an offset (start) and a length (N).
+	Per-hop columns hold the bounds on h and g, the uncertainty, and the enabled / jammed bitmasks.
+
+	The graph stores a lightweight HopView per edge.
+	Simple queries (bounds, capacities, jamming) are answered from the columns.
+	Anything else materializes a full TableHop, which writes its estimates back to the columns.
+'''
+
+from hop import Hop, dir0, dir1, channels_to_mask, mask_to_channels
+
+from math import log2
+from random import randrange
+
+import numpy as np
+
+
+class HopTable:
+
+	def __init__(self, hops, granularity=1):
+		'''
+			Initialize a hop table.
+
+			Parameters:
+			- hops: a list of (capacities, e_dir0, e_dir1, balances) tuples, one per hop
+			  (if balances is None, balances are generated randomly, as in Hop)
+			- granularity: see Hop
+		'''
+		N = np.array([len(capacities) for capacities, _, _, _ in hops], dtype=np.int64)
+		c = np.array([c for capacities, _, _, _ in hops for c in capacities], dtype=np.int64)
+		balances = []
+		for capacities, _, _, hop_balances in hops:
+			if hop_balances:
+				assert(all(0 <= b <= c for b,c in zip(hop_balances, capacities)))
+				balances.extend(hop_balances)
+			else:
+				balances.extend(randrange(c) for c in capacities)
+		self.init_channels(N, c, np.array(balances, dtype=np.int64), granularity)
+		# enabled and jammed channels, as bitmasks (Python integers: hops may have more than 64 channels)
+		self.e_mask = {
+			dir0: np.array([channels_to_mask(e_dir0) for _, e_dir0, _, _ in hops], dtype=object),
+			dir1: np.array([channels_to_mask(e_dir1) for _, _, e_dir1, _ in hops], dtype=object)}
+		self.enabled = {
+			dir0: self.channel_flags([e_dir0 for _, e_dir0, _, _ in hops]),
+			dir1: self.channel_flags([e_dir1 for _, _, e_dir1, _ in hops])}
+		self.init_hops()
+
+
+	@classmethod
+	def from_columns(cls, channels_indptr, c, enabled_dir0, enabled_dir1, b=None, granularity=1):
+		'''
+			Create a hop table from per-channel columns (such as those of a compiled snapshot, see snapshot_cache.py),
+			without building per-hop lists.
+
+			Parameters:
+			- channels_indptr: the channels of the i-th hop are channels_indptr[i]:channels_indptr[i+1]
+			- c: capacities, one per channel
+			- enabled_dir0, enabled_dir1: True for channels enabled in the respective direction, one per channel
+			- b: balances, one per channel (if None, balances are generated randomly, as in Hop)
+			- granularity: see Hop
+		'''
+		table = cls.__new__(cls)
+		c = np.array(c, dtype=np.int64)
+		if b is None:
+			# in the same order as Hop (and __init__) draws them
+			b = np.array([randrange(c_i) for c_i in c.tolist()], dtype=np.int64)
+		else:
+			b = np.array(b, dtype=np.int64)
+			assert(((0 <= b) & (b <= c)).all())
+		table.init_channels(np.diff(np.asarray(channels_indptr, dtype=np.int64)), c, b, granularity)
+		table.enabled = {dir0: np.array(enabled_dir0, dtype=bool), dir1: np.array(enabled_dir1, dtype=bool)}
+		table.e_mask = {dir0: table.channel_masks(table.enabled[dir0]), dir1: table.channel_masks(table.enabled[dir1])}
+		table.init_hops()
+		return table
+
+
+	def init_channels(self, N, c, b, granularity):
+		'''
+			Initialize the hop boundaries, capacities, and balances (see __init__ and from_columns).
+		'''
+		self.granularity = granularity
+		# the validation level of hops in this table (if None, the default Hop validation level is used)
+		self.validation, self.validation_sample_period = None, None
+		self.N = N
+		assert((self.N > 0).all())
+		self.start = np.zeros(len(N), dtype=np.int64)
+		self.start[1:] = np.cumsum(self.N)[:-1]
+		self.c = c
+		self.b = b
+
+
+	def init_hops(self):
+		'''
+			Initialize the remaining columns, once the channels and enabled channels are set (see init_channels).
+		'''
+		self.j_mask = {dir0: np.zeros(len(self.N), dtype=object), dir1: np.zeros(len(self.N), dtype=object)}
+		# h is how much a hop can forward in dir0, if no channels are jammed (see Hop)
+		self.h = np.maximum.reduceat(np.where(self.enabled[dir0], self.b, 0), self.start)
+		# g is how much a hop can forward in dir1, if no channels are jammed
+		self.g = np.maximum.reduceat(np.where(self.enabled[dir1], self.c - self.b, 0), self.start)
+		self.h_l, self.h_u = np.empty_like(self.N), np.empty_like(self.N)
+		self.g_l, self.g_u = np.empty_like(self.N), np.empty_like(self.N)
+		self.b_l, self.b_u = np.empty_like(self.c), np.empty_like(self.c)
+		self.uncertainty = np.empty(len(self.N), dtype=float)
+		# materialized hops (None if a hop is only represented in the columns)
+		self.hops = [None] * len(self.N)
+		# True for hops that were removed from the graph (see remove_hops)
+		self.removed = np.zeros(len(self.N), dtype=bool)
+		# incremented whenever an upper bound (h_u or g_u) may have increased (probes only decrease them)
+		self.upper_bounds_epoch = 0
+		self.reset_estimates()
+
+
+	def __len__(self):
+		return len(self.N)
+
+
+	def channel_flags(self, channel_lists):
+		'''
+			Convert per-hop lists of channel indices into a per-channel boolean column.
+		'''
+		flags = np.zeros(len(self.c), dtype=bool)
+		for start, N, channels in zip(self.start.tolist(), self.N.tolist(), channel_lists):
+			# ignore out-of-range indices, as Hop does
+			flags[[start + i for i in channels if i < N]] = True
+		return flags
+
+
+	def channel_masks(self, flags):
+		'''
+			Convert a per-channel boolean column into per-hop bitmasks (see channels_to_mask).
+		'''
+		if self.N.max() < 63:
+			# the bits of a hop fit into a (signed) 64-bit integer
+			bits = np.arange(len(self.c), dtype=np.int64) - np.repeat(self.start, self.N)
+			return np.add.reduceat(np.where(flags, np.left_shift(1, bits), 0), self.start).astype(object)
+		return np.array([channels_to_mask(np.flatnonzero(flags[start:start + N]).tolist())
+			for start, N in zip(self.start.tolist(), self.N.tolist())], dtype=object)
+
+
+	def channels(self, index):
+		'''
+			Return the slice of per-channel columns that belongs to a hop.
+		'''
+		start = int(self.start[index])
+		return slice(start, start + int(self.N[index]))
+
+
+	def add_hop(self, capacities, e_dir0, e_dir1, balances=None):
+		'''
+			Append a hop to the table (see add_hops).
+
+			Return: the index of the new hop
+		'''
+		return self.add_hops([(capacities, e_dir0, e_dir1, balances)])[0]
+
+
+	def add_hops(self, hops):
+		'''
+			Append hops to the table.
+			All columns are re-allocated once per call: add many hops at once rather than one by one.
+
+			Parameters:
+			- hops: a list of (capacities, e_dir0, e_dir1, balances) tuples, as in __init__
+
+			Return: the list of indices of the new hops
+		'''
+		if not hops:
+			return []
+		other = HopTable(hops, self.granularity)
+		other.start += len(self.c)
+		for name in ("N", "start", "h", "g", "h_l", "h_u", "g_l", "g_u", "uncertainty", "removed", "c", "b", "b_l", "b_u"):
+			setattr(self, name, np.concatenate((getattr(self, name), getattr(other, name))))
+		for columns, other_columns in ((self.e_mask, other.e_mask), (self.j_mask, other.j_mask), (self.enabled, other.enabled)):
+			for direction in (dir0, dir1):
+				columns[direction] = np.concatenate((columns[direction], other_columns[direction]))
+		self.hops.extend([None] * len(other))
+		self.upper_bounds_epoch += 1
+		return list(range(len(self) - len(other), len(self)))
+
+
+	def remove_hops(self, indices):
+		'''
+			Mark hops as removed from the graph.
+			Their rows stay in the table (so that other indices don't change) but are no longer used.
+			(To change a hop's channels, remove it and add the updated hop.)
+		'''
+		for index in indices:
+			self.removed[index] = True
+			self.hops[index] = None
+
+
+	def hop_spec(self, index):
+		'''
+			Return the (capacities, e_dir0, e_dir1, balances) tuple of a hop, as accepted by add_hops.
+		'''
+		channels = self.channels(index)
+		return (self.c[channels].tolist(), mask_to_channels(self.e_mask[dir0][index]),
+			mask_to_channels(self.e_mask[dir1][index]), self.b[channels].tolist())
+
+
+	def can_forward(self, direction):
+		'''
+			Return a boolean array: True if a hop has a channel enabled and not jammed in this direction.
+		'''
+		can_forward = self.e_mask[direction] != 0
+		# few hops are jammed: check them one by one
+		for index in np.flatnonzero(self.j_mask[direction] != 0).tolist():
+			can_forward[index] = self.e_mask[direction][index] & ~self.j_mask[direction][index] != 0
+		return can_forward
+
+
+	def reset_estimates(self):
+		'''
+			Set all variable hop parameters to their initial values (see Hop.reset_estimates).
+			Jammed channels stay jammed, as in Hop.
+			Materialized hops reset themselves (cheaply, from their cached initial estimates).
+		'''
+		self.upper_bounds_epoch += 1
+		max_c = np.maximum.reduceat(self.c, self.start)
+		self.h_l[:] = -1
+		self.g_l[:] = -1
+		self.h_u[:] = np.where(self.can_forward(dir0), np.maximum.reduceat(np.where(self.enabled[dir0], self.c, 0), self.start), max_c)
+		self.g_u[:] = np.where(self.can_forward(dir1), np.maximum.reduceat(np.where(self.enabled[dir1], self.c, 0), self.start), max_c)
+		self.b_l[:] = -1
+		self.b_u[:] = self.c
+		# Initially, R_h_l and R_g_l are empty, and R_b is the whole [0, c] box, hence S(F) = S(R_h_u & R_g_u).
+		# Along each dimension, R_h_u spans [0, eff_h] and R_g_u spans [c - eff_g, c] (see Hop.effective_vertex).
+		single_channel = np.repeat(self.N == 1, self.N)
+		h_u, g_u = np.repeat(self.h_u, self.N), np.repeat(self.g_u, self.N)
+		eff_h = np.where((self.enabled[dir0] | single_channel | (h_u < 0)) & (h_u <= self.c), h_u, self.c)
+		eff_g = np.where((self.enabled[dir1] | single_channel | (g_u < 0)) & (g_u <= self.c), g_u, self.c)
+		widths = np.maximum(eff_h + eff_g - self.c + 1, 0)
+		# exact areas are multiplied as Python integers: they easily overflow 64 bits
+		S_F = np.multiply.reduceat(widths.astype(object), self.start)
+		self.uncertainty[:] = [max(0, log2(S) - log2(self.granularity)) for S in S_F]
+		for hop in self.hops:
+			if hop is not None:
+				hop.reset_estimates()
+
+
+	def snapshot_estimates(self):
+		'''
+			Capture the current estimates of all hops (see Hop.snapshot_estimates).
+
+			Return: an immutable token to pass to restore_estimates
+		'''
+		columns = []
+		for column in (self.h_l, self.h_u, self.g_l, self.g_u, self.b_l, self.b_u, self.uncertainty):
+			column = column.copy()
+			column.setflags(write=False)
+			columns.append(column)
+		hops = tuple((index, hop.snapshot_estimates()) for index, hop in enumerate(self.hops) if hop is not None)
+		return tuple(columns), hops
+
+
+	def restore_estimates(self, estimates):
+		'''
+			Restore the estimates of all hops captured by snapshot_estimates.
+			Columns are copied back; materialized hops restore their own snapshots.
+			Hops materialized after the snapshot was taken are dropped (and re-created from the columns when needed).
+
+			Parameters:
+			- estimates: a token returned by snapshot_estimates (of this table)
+		'''
+		columns, hops = estimates
+		self.upper_bounds_epoch += 1
+		for column, saved_column in zip((self.h_l, self.h_u, self.g_l, self.g_u, self.b_l, self.b_u, self.uncertainty), columns):
+			column[:] = saved_column
+		hop_estimates = dict(hops)
+		for index, hop in enumerate(self.hops):
+			if hop is not None:
+				if index in hop_estimates:
+					hop.restore_estimates(hop_estimates[index])
+				else:
+					self.hops[index] = None
+
+
+	def store_estimates(self, index, hop):
+		'''
+			Write the current estimates of a (materialized) hop back to the columns.
+		'''
+		if hop.h_u > self.h_u[index] or hop.g_u > self.g_u[index]:
+			self.upper_bounds_epoch += 1
+		self.h_l[index], self.h_u[index] = hop.h_l, hop.h_u
+		self.g_l[index], self.g_u[index] = hop.g_l, hop.g_u
+		channels = self.channels(index)
+		self.b_l[channels] = hop.b_l
+		self.b_u[channels] = hop.b_u
+		self.uncertainty[index] = hop.uncertainty
+
+
+	def set_validation(self, validation, validation_sample_period=None):
+		'''
+			Set the validation level for all hops in this table (see hop.set_validation).
+		'''
+		self.validation, self.validation_sample_period = validation, validation_sample_period
+		for hop in self.hops:
+			if hop is not None:
+				hop.set_validation(validation, validation_sample_period)
+
+
+	def hop(self, index):
+		'''
+			Return the full Hop object for a hop, materializing it from the columns if needed.
+		'''
+		if self.hops[index] is None:
+			self.hops[index] = TableHop(self, index)
+		return self.hops[index]
+
+
+	def view(self, index):
+		return HopView(self, index)
+
+
+	def hop_capacities(self):
+		'''
+			Return an array of total capacities of all hops.
+		'''
+		return np.add.reduceat(self.c, self.start)
+
+
+
+class HopMasks:
+	'''
+		The enabled or jammed bitmasks of one hop (indexed by direction), stored in the table.
+	'''
+	__slots__ = ("columns", "index")
+
+	def __init__(self, columns, index):
+		self.columns = columns
+		self.index = index
+
+	def __getitem__(self, direction):
+		return self.columns[bool(direction)][self.index]
+
+	def __setitem__(self, direction, mask):
+		self.columns[bool(direction)][self.index] = mask
+
+
+
+class TableHop(Hop):
+	'''
+		A Hop whose state is stored in a HopTable.
+		The jammed bitmasks live in the table; the estimates are written back after every update.
+	'''
+
+	def __init__(self, table, index):
+		channels = table.channels(index)
+		# don't write the estimates of a freshly initialized hop back to the table
+		self.table, self.index = None, index
+		e_mask = HopMasks(table.e_mask, index)
+		Hop.__init__(self, table.c[channels].tolist(), mask_to_channels(e_mask[dir0]), mask_to_channels(e_mask[dir1]),
+			table.b[channels].tolist(), table.granularity)
+		self.e_mask = e_mask
+		self.j_mask = HopMasks(table.j_mask, index)
+		if table.validation is not None:
+			self.set_validation(table.validation, table.validation_sample_period)
+		# load the current estimates
+		self.h_l, self.h_u = int(table.h_l[index]), int(table.h_u[index])
+		self.g_l, self.g_u = int(table.g_l[index]), int(table.g_u[index])
+		self.b_l, self.b_u = table.b_l[channels].tolist(), table.b_u[channels].tolist()
+		self.table = table
+		self.bounds_at_last_update = None
+		self.update_dependent_hop_properties()
+
+
+	def update_dependent_hop_properties(self):
+		Hop.update_dependent_hop_properties(self)
+		if self.table is not None:
+			self.table.store_estimates(self.index, self)
+
+
+	def restore_estimates(self, estimates):
+		Hop.restore_estimates(self, estimates)
+		if self.table is not None:
+			self.table.store_estimates(self.index, self)
+
+
+
+class HopView:
+	'''
+		A lightweight stand-in for a Hop stored in a HopTable.
+		Queries on capacities, bounds and jamming are answered from the table columns.
+		Other attributes are taken from the materialized TableHop.
+	'''
+	__slots__ = ("table", "index")
+
+	def __init__(self, table, index):
+		self.table = table
+		self.index = index
+
+	def __getattr__(self, name):
+		if name.startswith("__"):
+			# don't materialize on special attribute lookups (such as copy protocols)
+			raise AttributeError(name)
+		return getattr(self.table.hop(self.index), name)
+
+	def __copy__(self):
+		# a view refers to a hop in the table: copies of a view refer to the same hop
+		return self
+
+	def __deepcopy__(self, memo):
+		return self
+
+	def __str__(self):
+		return str(self.table.hop(self.index))
+
+	@property
+	def N(self):
+		return int(self.table.N[self.index])
+
+	@property
+	def c(self):
+		return self.table.c[self.table.channels(self.index)].tolist()
+
+	@property
+	def e_mask(self):
+		return HopMasks(self.table.e_mask, self.index)
+
+	@property
+	def j_mask(self):
+		return HopMasks(self.table.j_mask, self.index)
+
+	@property
+	def h_l(self):
+		return int(self.table.h_l[self.index])
+
+	@property
+	def h_u(self):
+		return int(self.table.h_u[self.index])
+
+	@property
+	def g_l(self):
+		return int(self.table.g_l[self.index])
+
+	@property
+	def g_u(self):
+		return int(self.table.g_u[self.index])
+
+	@property
+	def uncertainty(self):
+		return float(self.table.uncertainty[self.index])
+
+
+	# these methods only depend on capacities and bitmasks
+	is_enabled = Hop.is_enabled
+	is_jammed = Hop.is_jammed
+	is_jamming = Hop.is_jamming
+	available_mask = Hop.available_mask
+	available_channels = Hop.available_channels
+	can_forward = Hop.can_forward
+	jam = Hop.jam
+	jam_all_except_in_direction = Hop.jam_all_except_in_direction
+	jam_all = Hop.jam_all
+	jam_random = Hop.jam_random
+	unjam = Hop.unjam
+	unjam_all_in_direction = Hop.unjam_all_in_direction
+	unjam_all = Hop.unjam_all
+	available_dirs = Hop.available_dirs
+	available_capacity = Hop.available_capacity
+	rebalance_and_jam_efficiency = Hop.rebalance_and_jam_efficiency
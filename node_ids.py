@@ -0,0 +1,99 @@
+#! /usr/bin/python3
+
+'''
+This file is part of Lightning Network Probing Simulator.
+
+Copyright © 2020-2021 University of Luxembourg
+
+	Permission is hereby granted, free of charge, to any person obtaining a copy
+	of this software and associated documentation files (the "Software"), to deal
+	in the Software without restriction, including without limitation the rights
+	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+	copies of the Software, and to permit persons to whom the Software is
+	furnished to do so, subject to the following conditions:
+
+	The above copyright notice and this permission notice shall be included in all
+	copies or substantial portions of the Software.
+
+	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+	SOFTWARE.
+
+SPDX-FileType: SOURCE
+SPDX-FileCopyrightText: 2020-2021 University of Luxembourg
+SPDX-License-Identifier: MIT
+'''
+
+'''
+	Interning of node IDs.
+
+	Node IDs (public keys) are long strings. Hop graphs use dense node numbers instead:
+	they take less memory, and comparing them (to find the direction of a hop) is faster.
+	Node IDs are only needed for input (such as entry nodes) and output.
+'''
+
+
+class NodeIds:
+	'''
+		A two-way mapping between node IDs and node numbers.
+
+		Node IDs given at creation are numbered in sorted order,
+		so comparing their numbers is the same as comparing the node IDs themselves:
+		direction 0 of a hop (from the lower node to the higher, see hop.py) doesn't depend on which one we compare.
+		Node IDs added later (see intern) get the next numbers;
+		for hops with such nodes, directions are defined by node numbers.
+	'''
+
+	def __init__(self, node_ids=[]):
+		'''
+			Initialize the mapping.
+
+			Parameters:
+			- node_ids: the initial node IDs (must be unique)
+		'''
+		self.ids = sorted(node_ids)
+		self.numbers = {node_id: number for number, node_id in enumerate(self.ids)}
+		assert(len(self.numbers) == len(self.ids))
+
+
+	def __len__(self):
+		return len(self.ids)
+
+
+	def __contains__(self, node_id):
+		return node_id in self.numbers
+
+
+	def number(self, node_id):
+		'''
+			Return the number of a known node ID.
+		'''
+		return self.numbers[node_id]
+
+
+	def intern(self, node_id):
+		'''
+			Return the number of a node ID, giving it the next number if it is new.
+		'''
+		if node_id not in self.numbers:
+			self.numbers[node_id] = len(self.ids)
+			self.ids.append(node_id)
+		return self.numbers[node_id]
+
+
+	def node_id(self, number):
+		'''
+			Return the node ID of a node number.
+		'''
+		return self.ids[number]
+
+
+	def node_ids(self, numbers):
+		'''
+			Return the node IDs of a list of node numbers (such as a path).
+		'''
+		return [self.ids[number] for number in numbers]
@@ -33,16 +33,63 @@ SPDX-License-Identifier: MIT
 '''
 
 
-from hop import Hop, dir0, dir1
-from graph import create_multigraph_from_snapshot, ln_multigraph_to_hop_graph
+from hop import dir0, dir1, popcount, VALIDATION_LEVELS
+from snapshot_cache import load_hop_graph
+from routing import create_routing, filtered_routing_graph, PathIterator, ROUTING_TREES, ROUTING_BACKENDS
+from failures import FailureModel
+from top_hops import TopHopRanking
 
-import networkx as nx
-from random import random, shuffle, sample
+from multiprocessing import get_context
+from random import random, shuffle, sample, seed, randrange
+
+
+# falling through the paths of a path iterator, search for a new shortest path after skipping this many paths
+MAX_SKIPPED_PATHS = 10
+
+
+# the prober in a worker process and the estimates each group starts from (see Prober.probe_hops_in_parallel)
+worker_prober = None
+worker_initial_estimates = None
+
+
+def init_worker(prober, initial_estimates):
+	'''
+		Initialize a worker process: the prober and the initial estimates are inherited
+		from the parent process (forked, not copied).
+	'''
+	global worker_prober, worker_initial_estimates
+	worker_prober = prober
+	worker_initial_estimates = initial_estimates
+
+
+def probe_target_hop_group(task):
+	'''
+		Probe a group of target hops in a worker process (see Prober.probe_hops_in_parallel).
+
+		Parameters:
+		- task: a tuple (target_hops, bs, jamming, group_seed, failure_model)
+
+		Return: a list of (target_hop, gain, num_probes, estimates) tuples, one per target hop
+	'''
+	target_hops, bs, jamming, group_seed, failure_model = task
+	# each group starts from the same estimates with its own random streams,
+	# so the results don't depend on the number of workers or on which worker probes which group
+	seed(group_seed)
+	worker_prober.failure_model = failure_model
+	worker_prober.restore_estimates(worker_initial_estimates)
+	results = []
+	for n1, n2 in target_hops:
+		target_hop = worker_prober.lnhopgraph[n1][n2]["hop"]
+		initial_uncertainty = target_hop.uncertainty
+		num_probes = worker_prober.probe_hop((n1, n2), bs, jamming)
+		results.append(((n1, n2), initial_uncertainty - target_hop.uncertainty, num_probes, target_hop.snapshot_estimates()))
+	return results
 
 
 class Prober:
 
-	def __init__(self, snapshot_filename, node_id, entry_nodes, entry_channel_capacity, granularity=1):
+	def __init__(self, snapshot_filename, node_id, entry_nodes, entry_channel_capacity, granularity=1,
+		validation=None, validation_sample_period=None, routing=ROUTING_TREES, failure_model=None):
 		'''
 			Initialize a Prober.
 
@@ -52,16 +99,44 @@ class Prober:
 			- entry_nodes: node IDs of nodes that the prober opens channels to
 			- entry_channel_capacity: the capacity of each entry channel
 			- granularity: the prober wants to know balance up to this granularity (in satoshis)
+			- validation: the validation level for this prober's hops (if None, the default level is used)
+			- validation_sample_period: in sampled validation mode, check every this many updates per hop
+			- routing: the path search backend (see routing.ROUTING_BACKENDS)
+			- failure_model: the model of probe failures unrelated to liquidity
+			  (if None, nodes fail at the default rate, seeded from the global random module)
+			Node IDs are interned: the graph, paths, and target hops use node numbers (see node_ids.py).
 		'''
-		self.our_node_id = node_id
+		assert(routing in ROUTING_BACKENDS), routing
 		# parse snapshot date from filename to include in plot title
 		self.snapshot_date = snapshot_filename[-len("yyyy-mm-dd.json"):-len(".json")]
-		ln_multigraph, n_channels = create_multigraph_from_snapshot(snapshot_filename)
-		self.lnhopgraph = ln_multigraph_to_hop_graph(ln_multigraph)
+		# use the compiled snapshot if there is one (see snapshot_cache.py)
+		self.lnhopgraph, n_channels = load_hop_graph(snapshot_filename)
+		# all hops are stored in columns of this table (graph edges hold views)
+		self.hop_table = self.lnhopgraph.graph["hop_table"]
+		# node ID <-> node number (only needed for input and output)
+		self.node_ids = self.lnhopgraph.graph["node_ids"]
+		self.our_node = self.node_ids.intern(node_id)
+		if validation is not None:
+			self.set_validation(validation, validation_sample_period)
 		self.n_channels = n_channels
-		for entry_node in entry_nodes:
-			self.open_channel(self.our_node_id, entry_node, entry_channel_capacity)
-		self.local_routing_graph = self.lnhopgraph.to_directed()
+		self.failure_model = failure_model if failure_model is not None else FailureModel(seed=randrange(2**32))
+		self.routing_backend = routing
+		self.routing = None
+		# (n1, n2) -> PathIterator for paths ending with the target hop n1 -> n2
+		self.path_iterators = dict()
+		self.update_channels(open_channels=[(self.our_node, self.node_ids.intern(entry_node), entry_channel_capacity, 0)
+			for entry_node in entry_nodes])
+		# a read-only directed view: it shares nodes, edges, and hops with lnhopgraph (and reflects its changes)
+		self.local_routing_graph = self.lnhopgraph.to_directed(as_view=True)
+		self.routing = create_routing(self.routing_backend, self.lnhopgraph, self.local_routing_graph, self.our_node)
+
+
+	def set_validation(self, validation, validation_sample_period=None):
+		'''
+			Set the validation level for all hops in the graph (see hop.set_validation).
+		'''
+		assert(validation in VALIDATION_LEVELS), validation
+		self.hop_table.set_validation(validation, validation_sample_period)
 
 
 	def __str__(self):
@@ -69,7 +144,7 @@ class Prober:
 
 	def open_channel(self, first, second, capacity, push_satoshis=0):
 		'''
-			Add a new channel to the LN model graph.
+			Add a new channel to the LN model graph (see update_channels).
 
 			Parameters:
 			- first: the node opening the channel
@@ -77,27 +152,85 @@ class Prober:
 			- capacity: the new channel's capacity
 			- push_satoshis: the initial balance of second (default: 0, i.e., all capacity is at first)
 		'''
-		if first not in self.lnhopgraph.nodes():
-			self.lnhopgraph.add_node(first)
-		if second not in self.lnhopgraph.nodes():
-			self.lnhopgraph.add_node(second)
-		direction = dir0 if first < second else dir1
-		balance_at_first = capacity if direction == dir0 else 0
-		if self.lnhopgraph.has_edge(first, second):
-			hop = self.lnhopgraph[first][second]["hop"]
-			capacities = hop.c.append(capacity)
-			if direction == dir0:
-				e_dir0 = hop.e[dir0].append(len(capacities) + 1)
-			else:
-				e_dir1 = hop.e[dir1].append(len(capacities) + 1)
-			balances = hop.balances.append(balance_at_first)
-			updated_hop = Hop(capacities, e_dir0, e_dir1, balances)
-			#print("Updated hop:", updated_hop)
-			self.lnhopgraph[first][second]["hop"] = updated_hop
-		else:
-			self.lnhopgraph.add_edge(first, second)
-			e_dir0, e_dir1 = ([0], []) if direction == dir0 else ([], [0])
-			self.lnhopgraph[first][second]["hop"] = Hop([capacity], e_dir0, e_dir1, [balance_at_first])
+		self.update_channels(open_channels=[(first, second, capacity, push_satoshis)])
+
+
+	def update_channels(self, open_channels=[], close_channels=[], enable_channels=[], disable_channels=[]):
+		'''
+			Open, close, enable, and disable many channels at once.
+
+			Each changed hop is replaced by a hop with the updated channels in the hop table:
+			its estimates are reset, and its channels are unjammed. Other hops keep their estimates.
+			The routing backend is only updated for the changed hops. Cached paths are dropped.
+
+			Parameters:
+			- open_channels: a list of (first, second, capacity, push_satoshis) tuples:
+			  open a channel from first to second with push_satoshis at second (the rest of the capacity is at first);
+			  the channel is enabled in the direction from first to second
+			- close_channels: a list of (n1, n2, i) tuples: close the i-th channel of the hop between n1 and n2
+			- enable_channels: a list of (source, destination, i) tuples: enable the i-th channel of the hop
+			  between source and destination in the direction from source to destination
+			- disable_channels: a list of (source, destination, i) tuples: disable a channel in a direction (as above)
+			Channel indices refer to the channels before the update. New channels are added after existing ones.
+			Nodes are node numbers: to open a channel to a new node, intern its ID first (see NodeIds.intern).
+		'''
+		# (n1, n2) with n1 < n2 -> the channels of the updated hop
+		updated_hops = dict()
+		def hop_channels(n1, n2):
+			pair = (n1, n2) if n1 < n2 else (n2, n1)
+			if pair not in updated_hops:
+				if self.lnhopgraph.has_edge(*pair):
+					capacities, e_dir0, e_dir1, balances = self.hop_table.hop_spec(self.lnhopgraph[pair[0]][pair[1]]["hop"].index)
+				else:
+					capacities, e_dir0, e_dir1, balances = [], [], [], []
+				updated_hops[pair] = {"capacities": capacities, "balances": balances,
+					"enabled": {dir0: set(e_dir0), dir1: set(e_dir1)}, "closed": set()}
+			return updated_hops[pair]
+		for n1, n2, i in close_channels:
+			channels = hop_channels(n1, n2)
+			assert(0 <= i < len(channels["capacities"])), (n1, n2, i)
+			channels["closed"].add(i)
+		for channel_list, enable in ((enable_channels, True), (disable_channels, False)):
+			for source, destination, i in channel_list:
+				channels = hop_channels(source, destination)
+				assert(0 <= i < len(channels["capacities"])), (source, destination, i)
+				direction = dir0 if source < destination else dir1
+				if enable:
+					channels["enabled"][direction].add(i)
+				else:
+					channels["enabled"][direction].discard(i)
+		for first, second, capacity, push_satoshis in open_channels:
+			assert(0 <= push_satoshis <= capacity)
+			channels = hop_channels(first, second)
+			direction = dir0 if first < second else dir1
+			channels["enabled"][direction].add(len(channels["capacities"]))
+			channels["capacities"].append(capacity)
+			# balances are stored for the first node of a hop in dir0
+			channels["balances"].append(capacity - push_satoshis if direction == dir0 else push_satoshis)
+		removed_hops, added_pairs, added_hops = [], [], []
+		for (n1, n2), channels in updated_hops.items():
+			if self.lnhopgraph.has_edge(n1, n2):
+				removed_hops.append(self.lnhopgraph[n1][n2]["hop"].index)
+			kept = [i for i in range(len(channels["capacities"])) if i not in channels["closed"]]
+			if not kept:
+				if self.lnhopgraph.has_edge(n1, n2):
+					self.lnhopgraph.remove_edge(n1, n2)
+				continue
+			added_pairs.append((n1, n2))
+			added_hops.append(([channels["capacities"][i] for i in kept],
+				[j for j, i in enumerate(kept) if i in channels["enabled"][dir0]],
+				[j for j, i in enumerate(kept) if i in channels["enabled"][dir1]],
+				[channels["balances"][i] for i in kept]))
+		self.n_channels += len(open_channels) - sum(len(channels["closed"]) for channels in updated_hops.values())
+		self.hop_table.remove_hops(removed_hops)
+		for (n1, n2), index in zip(added_pairs, self.hop_table.add_hops(added_hops)):
+			if not self.lnhopgraph.has_edge(n1, n2):
+				self.lnhopgraph.add_edge(n1, n2)
+			self.lnhopgraph[n1][n2]["hop"] = self.hop_table.view(index)
+		if self.routing is not None:
+			self.routing.update_edges(self.lnhopgraph, list(updated_hops))
+		# paths may have become invalid, or shorter paths may have appeared
+		self.path_iterators.clear()
 
 
 	def filtered_routing_graph_for_amount(self, amount, exclude_nodes):
@@ -106,49 +239,23 @@ class Prober:
 
 			For each routing attempt, we create a new graph view that excludes 
 			  edges that we know cannot forward the required amount.
+			(Path search itself is done by the routing backend, see routing.py.)
 
 			Parameters:
 			- amount: the required payment amount
 			- exclude_nodes: additionally, exclude these nodes from the view
 		'''
-		def filter_edge(n1, n2):
-			'''
-				Return True if the edge is kept, False if it is excluded.
-
-				Parameters:
-				- n1, n2: node IDs of the vertices
-			'''
-			hop = self.lnhopgraph[n1][n2]["hop"]
-			direction = dir0 if n1 < n2 else dir1
-			if direction == dir0:
-				# return hop.can_forward(dir0) and amount <= hop.h_u
-				return amount <= hop.h_u
-			else:
-				# return hop.can_forward(dir1) and amount <= hop.g_u
-				return amount <= hop.g_u
-		def filter_node(n):
-			'''
-				Return True if the node is kept, False if it is excluded.
-
-				A generic User generally shouldn't exclude nodes.
-				A Prober, however, excludes the target node and calculates routes to the previous node
-				  to ensure the route includes the target hop as the last hop.
-
-				Parameters:
-				- n: node ID of the node
-			'''
-			return True if not exclude_nodes else n not in exclude_nodes
-		return nx.subgraph_view(self.local_routing_graph, filter_node=filter_node, filter_edge=filter_edge)
+		return filtered_routing_graph(self.lnhopgraph, self.local_routing_graph, amount, exclude_nodes)
 
 
 	def paths_for_amount(self, target_hop, amount, exclude_nodes=[], max_paths_suggested=None):
 		'''
 			Create a generator for paths suitable for the given amount w.r.t. to our knowledge so far.
-			Return None is no such path exists.
+			The generator is empty if no such path exists.
+			Paths are generated by the routing backend, shortest first, and only searched for when requested.
 
 			Parameters:
-			- n1: the first target node ID
-			- n2: the second target node ID
+			- target_hop: the pair of target nodes (n1, n2)
 			- amount: the amount to send (in satoshis)
 			- exclude_nodes: the list of nodes to exclude form paths
 			- max_paths_suggested: stop generation after this many paths have been generated
@@ -157,60 +264,116 @@ class Prober:
 			- next_path: the next path, or StopIteration if no more paths exist or max_paths_suggested exceeded
 		'''
 		(n1, n2) = target_hop
-		routing_graph = self.filtered_routing_graph_for_amount(amount, exclude_nodes)
-		if n1 not in routing_graph:
-			#print("Target", n1, "not in filtered graph, can't find path.")
-			yield from ()
-		if not nx.has_path(routing_graph, self.our_node_id, n1):
-			#print("No path from", self.our_node_id, "to", n1)
-			yield from ()
-		paths = nx.shortest_simple_paths(routing_graph, source=self.our_node_id, target=n1)
-		paths_suggested = 0
-		while (max_paths_suggested is None or paths_suggested < max_paths_suggested):
-			try:
-				next_path = next(paths)
-				paths_suggested += 1
-				#print("Found path after suggested", paths_suggested, "paths:", next_path)
-				yield next_path + [n2]
-			except nx.exception.NetworkXNoPath:
-				yield from ()
-		yield from ()
-
-
-	def issue_probe_along_path(self, path, amount):
+		paths = self.routing.shortest_simple_paths(self.our_node, n1, amount, exclude_nodes)
+		for paths_suggested, next_path in enumerate(paths):
+			if max_paths_suggested is not None and paths_suggested >= max_paths_suggested:
+				return
+			#print("Found path after suggested", paths_suggested, "paths:", next_path)
+			yield next_path + [n2]
+
+
+	def path_admits_amount(self, path, amount):
+		'''
+			Return True if all hops in the path, except the target (last) hop, may forward the amount.
+		'''
+		for n1, n2 in zip(path[:-2], path[1:-1]):
+			hop = self.lnhopgraph[n1][n2]["hop"]
+			if amount > (hop.h_u if n1 < n2 else hop.g_u):
+				return False
+		return True
+
+
+	def path_for_amount(self, target_hop, amount, max_skipped_paths=MAX_SKIPPED_PATHS):
+		'''
+			Suggest a path for a probe of the target hop, reusing the path iterator for this hop and direction.
+
+			We keep using the current path while it admits the amount (according to our current estimates)
+			  and the amount doesn't exceed the one the iterator was created for.
+			Thus, a probe that failed for reasons other than balances (such as an offline node)
+			  is retried along the same path without searching for it again.
+			If a probe fails at an intermediate hop because of insufficient balance, the bound of that hop drops
+			  and the path no longer admits the amount. If the amount is the one the iterator was created for
+			  (as when we probe the target hop again with the same amount), we fall through to the next paths
+			  of the iterator (shortest first), skipping those that don't admit the amount either.
+			Once an edge near the source drops, many of the remaining paths go through it:
+			  after skipping max_skipped_paths paths, we search for a new shortest path instead.
+			Otherwise, we search for new paths: a smaller amount may pass hops that the iterator's amount couldn't,
+			  so the iterator may miss shorter paths (or have none at all).
+
+			Parameters:
+			- target_hop: the pair of target nodes (n1, n2), in the probe direction
+			- amount: the amount to send (in satoshis)
+			- max_skipped_paths: start a new search after skipping this many paths of the iterator
+
+			Return:
+			- path: a path, or None if there is no path for this amount
+		'''
+		target_hop = tuple(target_hop)
+		path_iterator = self.path_iterators.get(target_hop)
+		if path_iterator is not None and amount <= path_iterator.amount:
+			path = path_iterator.path
+			if path is not None and self.path_admits_amount(path, amount):
+				return path
+			if path is not None and amount == path_iterator.amount:
+				for _ in range(max_skipped_paths):
+					path = path_iterator.next_path()
+					# bounds only decrease, so the iterator only ends once there are no more paths for this amount
+					if path is None or self.path_admits_amount(path, amount):
+						return path
+		path_iterator = PathIterator(self.paths_for_amount(target_hop, amount), amount)
+		self.path_iterators[target_hop] = path_iterator
+		return path_iterator.next_path()
+
+
+	def issue_probe_along_path(self, path, amount, failure_position=None):
 		'''
 			Send a probe along a path and observe the result.
 
 			Parameters:
 			- path: a list of node pairs defining a path
 			- amount: the probe amount
+			- failure_position: where the probe fails for reasons unrelated to liquidity
+			  (see FailureModel.failure_position; if None, it is drawn from the prober's failure model)
+
+			Return:
+			- reached_target: True if the probe reached (either passed or failed) the target hop,
+			  False if the probe failed at an intermediary hop
+		'''
+		reached_target, num_hops_forwarded = self.probe_along_path(path, amount, failure_position)
+		return reached_target
+
+
+	def probe_along_path(self, path, amount, failure_position=None):
+		'''
+			Send a probe along a path and observe the result (see issue_probe_along_path).
+
+			Parameters:
+			- path: a list of node pairs defining a path
+			- amount: the probe amount
+			- failure_position: see issue_probe_along_path
 
 			Return:
 			- reached_target: True if the probe reached (either passed or failed) the target hop,
 			  False if the probe failed at an intermediary hop
+			- num_hops_forwarded: the number of hops the probe was forwarded along before it failed
+			  (the error travels back along the same hops)
 		'''
 		# ensure we don't probe our own channels
-		assert(path[0] == self.our_node_id)
-		node_pairs = [p for p in zip(path, path[1:])]
+		assert(path[0] == self.our_node)
+		if failure_position is None:
+			failure_position = self.failure_model.failure_position(path)
 		reached_target = False
-		for n1, n2 in node_pairs:
-			# A very rought approximation of failures at nodes unrelated to liquidity (e.g., node
-			# being offline).
-			# For simplicity, this approach has no memory: a node that failed in previous iteration
-			# may be fine in the next iteration.
-			failure = random()
-			FAILURE_RATE = 0.1
-			if failure <= FAILURE_RATE:
-				break
-
+		num_hops_forwarded = 0
+		for n1, n2 in zip(path[:failure_position], path[1:failure_position + 1]):
 			reached_target = n2 == path[-1]
 			hop = self.lnhopgraph[n1][n2]["hop"]
 			direction = dir0 if n1 < n2 else dir1
 			probe_passed = hop.probe(direction, amount)
 			if not probe_passed:
 				break
+			num_hops_forwarded += 1
 		#print("probe reached_target?", reached_target)
-		return reached_target
+		return reached_target, num_hops_forwarded
 
 
 	def probe_hop(self, target_node_pair, bs, jamming, max_failed_probes_per_hop=10, best_dir_chance=0.75):
@@ -218,7 +381,7 @@ class Prober:
 			Probe a given target hop (in general, with multiple probes along different paths).
 
 			Parameters:
-			- target_node_pair: a pair of node IDs defining the target hop
+			- target_node_pair: a pair of nodes defining the target hop
 			- bs: specify probe amount choice method
 			- jamming: use jamming-enhanced probing after "regular" probing
 			- max_failed_probes_per_hop: stop probing the hop is this many probes didn't reach it
@@ -228,6 +391,28 @@ class Prober:
 			- num_probes: how many probes were made
 			- reached_target: True if we ever reached the target
 		'''
+		probes = self.probes_for_hop(target_node_pair, bs, jamming, max_failed_probes_per_hop, best_dir_chance)
+		try:
+			path, amount = next(probes)
+			while True:
+				path, amount = probes.send(self.issue_probe_along_path(path, amount))
+		except StopIteration as stop:
+			return stop.value
+
+
+	def probes_for_hop(self, target_node_pair, bs, jamming, max_failed_probes_per_hop=10, best_dir_chance=0.75):
+		'''
+			Choose the probes to probe a given target hop (see probe_hop).
+
+			This is a generator: it yields a (path, amount) pair for each probe,
+			and the caller sends back whether the probe reached the target (see issue_probe_along_path).
+			This way, the caller decides how and when probes are sent (e.g., asynchronously, see async_prober.py).
+
+			Parameters: see probe_hop
+
+			Return (when the generator is exhausted):
+			- num_probes: how many probes were made
+		'''
 		target_hop = self.lnhopgraph[target_node_pair[0]][target_node_pair[1]]["hop"]
 		known_failed_amount = {dir0: None, dir1: None}
 		#print("\n----------------------\nProbing hop", target_node_pair)
@@ -247,16 +432,15 @@ class Prober:
 				guaranteed_fail = amount >= known_failed_amount[direction] if known_failed_amount[direction] is not None else False
 				if not guaranteed_fail:
 					hop_direction = dir0 if target_node_pair[0] < target_node_pair[1] else dir1
-					target_node_pair_in_order = target_node_pair if hop_direction == direction else reversed(target_node_pair)
-					paths = self.paths_for_amount(target_node_pair_in_order, amount)
-					try:
-						#print("Trying next path for direction", "dir0" if direction else "dir1", ", amount:", amount)
-						path = next(paths)
-						reached_target = self.issue_probe_along_path(path, amount)
-						made_probe = True
-					except StopIteration:
-						#print("Path iteration stopped for direction", "dir0" if direction else "dir1", ", amount:", amount)
+					target_node_pair_in_order = target_node_pair if hop_direction == direction else tuple(reversed(target_node_pair))
+					#print("Trying next path for direction", "dir0" if direction else "dir1", ", amount:", amount)
+					path = self.path_for_amount(target_node_pair_in_order, amount)
+					if path is None:
+						#print("No paths for direction", "dir0" if direction else "dir1", ", amount:", amount)
 						known_failed_amount[direction] = amount
+					else:
+						reached_target = yield path, amount
+						made_probe = True
 				else:
 					#print("Will not probe: we know NBS amount will fail")
 					pass
@@ -276,7 +460,7 @@ class Prober:
 			# this is the suggested (best) direction
 			best_dir = target_hop.next_dir(bs, jamming)
 			if jamming:
-				available_channels_alt_dir = [i for i in target_hop.e[not best_dir] if i not in target_hop.j[not best_dir]]
+				available_channels_alt_dir = target_hop.available_channels(not best_dir)
 				if len(available_channels_alt_dir) == 0:
 					alt_dir = None
 				else:
@@ -320,7 +504,7 @@ class Prober:
 							# can probe in either of two directions
 							# choose with coin flip biased in favor of best direction
 							direction = best_dir if random() < best_dir_chance else alt_dir
-				made_probe, reached_target = probe_target_hop_in_direction(direction, jamming)
+				made_probe, reached_target = yield from probe_target_hop_in_direction(direction, jamming)
 				if not reached_target:
 					num_probes_failed += 1
 				if made_probe:
@@ -333,7 +517,7 @@ class Prober:
 			return num_probes, reached_target, num_probes_failed
 		total_num_probes, total_num_probes_failed = 0, 0
 		while target_hop.worth_probing_h() or target_hop.worth_probing_g():
-			num_probes, reached_target, probes_failed = choose_dir_amount_and_probe(jamming=False)
+			num_probes, reached_target, probes_failed = yield from choose_dir_amount_and_probe(jamming=False)
 			total_num_probes += num_probes
 			total_num_probes_failed += probes_failed
 			if not reached_target:
@@ -349,7 +533,7 @@ class Prober:
 				total_num_probes += target_hop.jam_all_except_in_direction(i, dir0)
 				total_num_probes += target_hop.jam_all_except_in_direction(i, dir1)
 				while target_hop.worth_probing_channel(i):
-					num_probes, reached_target, num_probes_failed = choose_dir_amount_and_probe(jamming=True)
+					num_probes, reached_target, num_probes_failed = yield from choose_dir_amount_and_probe(jamming=True)
 					total_num_probes += num_probes
 					if not reached_target:
 						break
@@ -362,7 +546,7 @@ class Prober:
 		return total_num_probes
 
 
-	def probe_hops(self, target_hops, bs, jamming):
+	def probe_hops(self, target_hops, bs, jamming, num_workers=1):
 		'''
 			Probe a list of target hops afresh.
 
@@ -370,6 +554,8 @@ class Prober:
 			- target_hops: a list of target hops
 			- bs: probe amount choice method
 			- jamming: True if use jamming-enhanced probing after "regular" probing
+			- num_workers: if more than 1, probe groups of target hops in this many processes
+			  (see probe_hops_in_parallel)
 
 			Return:
 			- total_gain: total achieved informatoin gain on target hops
@@ -379,9 +565,12 @@ class Prober:
 		def uncertainty_for_target_hops():
 			return sum([self.lnhopgraph[n1][n2]["hop"].uncertainty for n1, n2 in target_hops])
 		initial_uncertainty_total = uncertainty_for_target_hops()
-		num_probes = sum([self.probe_hop(target_hop, bs, jamming) for target_hop in target_hops])
-		final_uncertainty_total = uncertainty_for_target_hops()
-		total_gain_bits = initial_uncertainty_total - final_uncertainty_total
+		if num_workers > 1:
+			total_gain_bits, num_probes = self.probe_hops_in_parallel(target_hops, bs, jamming, num_workers)
+		else:
+			num_probes = sum([self.probe_hop(target_hop, bs, jamming) for target_hop in target_hops])
+			final_uncertainty_total = uncertainty_for_target_hops()
+			total_gain_bits = initial_uncertainty_total - final_uncertainty_total
 		if num_probes == 0:
 			print("Did zero probes, can't calculate probing speed!")
 			probing_speed = 0
@@ -391,9 +580,102 @@ class Prober:
 		return total_gain, probing_speed
 
 
+	def group_target_hops(self, target_hops):
+		'''
+			Group target hops whose (initial) shortest paths share hops.
+
+			Probes update the estimates of intermediate hops, and these estimates affect later path choices.
+			Target hops in one group are probed one after another in the same process,
+			so their probes see each other's updates, as in sequential probing.
+			The prober's own channels are shared by all paths, so we don't take them into account.
+
+			Parameters:
+			- target_hops: a list of target hops (node pairs)
+
+			Return: a list of groups (lists of target hops, in the original order)
+		'''
+		# union-find over target hop indices
+		parent = list(range(len(target_hops)))
+		def find(i):
+			while parent[i] != i:
+				parent[i] = parent[parent[i]]
+				i = parent[i]
+			return i
+		hop_owner = dict()
+		for i, (n1, n2) in enumerate(target_hops):
+			path = self.routing.shortest_path(self.our_node, n1, 1) or [n1]
+			for hop in [frozenset(pair) for pair in zip(path, path[1:])] + [frozenset((n1, n2))]:
+				if self.our_node in hop:
+					continue
+				if hop in hop_owner:
+					parent[find(i)] = find(hop_owner[hop])
+				else:
+					hop_owner[hop] = i
+		groups = dict()
+		for i, target_hop in enumerate(target_hops):
+			groups.setdefault(find(i), []).append(target_hop)
+		return list(groups.values())
+
+
+	def probe_hops_in_parallel(self, target_hops, bs, jamming, num_workers):
+		'''
+			Probe groups of target hops (see group_target_hops) in a pool of forked worker processes.
+
+			Workers share the graph and a snapshot of the initial estimates with this process (copy-on-write).
+			Each group is probed from the current estimates with its own random seed (drawn here).
+			Workers return per-hop gains, probe counts, and final estimates;
+			the estimates of target hops are copied back to this prober.
+			Updates of intermediate hops are not copied back, nor shared between groups.
+
+			Parameters:
+			- target_hops: a list of target hops (node pairs)
+			- bs: probe amount choice method
+			- jamming: True if use jamming-enhanced probing after "regular" probing
+			- num_workers: the number of worker processes
+
+			Return:
+			- total_gain_bits: the total information gain on target hops
+			- num_probes: the total number of probes
+		'''
+		initial_estimates = self.snapshot_estimates()
+		groups = self.group_target_hops(target_hops)
+		tasks = [(group, bs, jamming, randrange(2**32), failure_model)
+			for group, failure_model in zip(groups, self.failure_model.spawn(len(groups)))]
+		# the prober (with the graph) and the initial estimates are inherited by forked workers instead of being pickled:
+		# each task only carries its group of target hops
+		with get_context("fork").Pool(num_workers, initializer=init_worker, initargs=(self, initial_estimates)) as pool:
+			group_results = pool.map(probe_target_hop_group, tasks, chunksize=1)
+		total_gain_bits, num_probes = 0, 0
+		for results in group_results:
+			for (n1, n2), gain, num_probes_hop, estimates in results:
+				self.lnhopgraph[n1][n2]["hop"].restore_estimates(estimates)
+				total_gain_bits += gain
+				num_probes += num_probes_hop
+		self.path_iterators.clear()
+		return total_gain_bits, num_probes
+
+
 	def reset_all_estimates(self):
-		for n1,n2 in self.lnhopgraph.edges():
-			self.lnhopgraph[n1][n2]["hop"].reset_estimates()
+		self.hop_table.reset_estimates()
+		# paths were chosen based on the old estimates
+		self.path_iterators.clear()
+
+
+	def snapshot_estimates(self):
+		'''
+			Capture the estimates of all hops in the graph (e.g., to branch a what-if probing run).
+
+			Return: an immutable token to pass to restore_estimates
+		'''
+		return self.hop_table.snapshot_estimates()
+
+
+	def restore_estimates(self, estimates):
+		'''
+			Restore the estimates of all hops captured by snapshot_estimates.
+		'''
+		self.hop_table.restore_estimates(estimates)
+		self.path_iterators.clear()
 
 
 	def choose_target_hops_with_n_channels(self, max_num_target_hops, num_channels):
@@ -420,46 +702,42 @@ class Prober:
 			Calculate some stats about capacity and structure of hops in the snapshot.
 		'''
 		print("\nAnalyzing graph")
-		all_hops = [self.lnhopgraph.get_edge_data(n1,n2)["hop"] for (n1, n2) in self.lnhopgraph.edges()]
-		def n_channel_hops(all_hops, min_N, max_N):
-			return [hop for hop in all_hops if min_N <= hop.N <= max_N]
-		def share_n_channel_hops(all_hops, min_N, max_N):
-			return round(len(n_channel_hops(all_hops, min_N, max_N)) / len(all_hops), 4)
-		def capacity(hop):
-			return sum(hop.c)
-		channels_in_hops = [hop.N for hop in all_hops]
-		#capacity_in_hops = [capacity(hop) for hop in all_hops]
-		#capacity_in_hops_btc = [c / 100000000 for c in capacity_in_hops]
-		total_capacity = sum([capacity(hop) for hop in all_hops])
-		#share_capacity_in_hops = [c / total_capacity for c in capacity_in_hops]
-		def share_total_capacity_in_n_hops(all_hops, min_N, max_N, total_capacity):
-			hops = n_channel_hops(all_hops, min_N, max_N)
-			return round(sum([capacity(hop) for hop in hops]) / total_capacity, 4)
+		# hops removed from the graph stay in the table (see HopTable.remove_hops)
+		in_graph = ~self.hop_table.removed
+		channels_in_hops = self.hop_table.N[in_graph]
+		capacity_in_hops = self.hop_table.hop_capacities()[in_graph]
+		total_capacity = int(capacity_in_hops.sum())
+		def n_channel_hops(min_N, max_N):
+			return (min_N <= channels_in_hops) & (channels_in_hops <= max_N)
+		def share_n_channel_hops(min_N, max_N):
+			return round(int(n_channel_hops(min_N, max_N).sum()) / len(channels_in_hops), 4)
+		def share_total_capacity_in_n_hops(min_N, max_N, total_capacity):
+			return round(int(capacity_in_hops[n_channel_hops(min_N, max_N)].sum()) / total_capacity, 4)
 		print("Total capacity (BTC):", round(total_capacity / (100*1000*1000), 4))
-		print("Maximal number of channels in a hop:", max(channels_in_hops))
-		print("Share of 1-channel hops:", 		share_n_channel_hops(all_hops, 1, 1), len(n_channel_hops(all_hops, 1, 1)))
-		print("Share of 2-channel hops:", 		share_n_channel_hops(all_hops, 2, 2), len(n_channel_hops(all_hops, 2, 2)))
-		print("Share of 3-channel hops:", 		share_n_channel_hops(all_hops, 3, 3), len(n_channel_hops(all_hops, 3, 3)))
-		print("Share of 4-channel hops:", 		share_n_channel_hops(all_hops, 4, 4), len(n_channel_hops(all_hops, 4, 4)))
-		print("Share of 5-channel hops:", 		share_n_channel_hops(all_hops, 5, 5), len(n_channel_hops(all_hops, 5, 5)))
-		print("Share of <= 5-channel hops:", 	share_n_channel_hops(all_hops, 1, 5), len(n_channel_hops(all_hops, 1, 5)))
-		print("Share of <= 10-channel hops:", 	share_n_channel_hops(all_hops, 1, 10), len(n_channel_hops(all_hops, 1, 10)))
-		print("Share of capacity in 1-channel hops:", share_total_capacity_in_n_hops(all_hops, 1, 1, total_capacity))
-		print("Share of capacity in 2-channel hops:", share_total_capacity_in_n_hops(all_hops, 2, 2, total_capacity))
-		print("Share of capacity in 3-channel hops:", share_total_capacity_in_n_hops(all_hops, 3, 3, total_capacity))
-		print("Share of capacity in 4-channel hops:", share_total_capacity_in_n_hops(all_hops, 4, 4, total_capacity))
-		print("Share of capacity in 5-channel hops:", share_total_capacity_in_n_hops(all_hops, 5, 5, total_capacity))
-		print("Share of capacity of <= 5-channel hops:", 	share_total_capacity_in_n_hops(all_hops, 1, 5, total_capacity))
-		print("Share of capacity of <= 10-channel hops:", 	share_total_capacity_in_n_hops(all_hops, 1, 10, total_capacity))
+		print("Maximal number of channels in a hop:", int(channels_in_hops.max()))
+		print("Share of 1-channel hops:", 		share_n_channel_hops(1, 1), int(n_channel_hops(1, 1).sum()))
+		print("Share of 2-channel hops:", 		share_n_channel_hops(2, 2), int(n_channel_hops(2, 2).sum()))
+		print("Share of 3-channel hops:", 		share_n_channel_hops(3, 3), int(n_channel_hops(3, 3).sum()))
+		print("Share of 4-channel hops:", 		share_n_channel_hops(4, 4), int(n_channel_hops(4, 4).sum()))
+		print("Share of 5-channel hops:", 		share_n_channel_hops(5, 5), int(n_channel_hops(5, 5).sum()))
+		print("Share of <= 5-channel hops:", 	share_n_channel_hops(1, 5), int(n_channel_hops(1, 5).sum()))
+		print("Share of <= 10-channel hops:", 	share_n_channel_hops(1, 10), int(n_channel_hops(1, 10).sum()))
+		print("Share of capacity in 1-channel hops:", share_total_capacity_in_n_hops(1, 1, total_capacity))
+		print("Share of capacity in 2-channel hops:", share_total_capacity_in_n_hops(2, 2, total_capacity))
+		print("Share of capacity in 3-channel hops:", share_total_capacity_in_n_hops(3, 3, total_capacity))
+		print("Share of capacity in 4-channel hops:", share_total_capacity_in_n_hops(4, 4, total_capacity))
+		print("Share of capacity in 5-channel hops:", share_total_capacity_in_n_hops(5, 5, total_capacity))
+		print("Share of capacity of <= 5-channel hops:", 	share_total_capacity_in_n_hops(1, 5, total_capacity))
+		print("Share of capacity of <= 10-channel hops:", 	share_total_capacity_in_n_hops(1, 10, total_capacity))
 
 	# This function is used to test how efficient is slot jamming. It is called to disable one
 	# of the best channels (presumably, via jamming, but in practice we just flag it).
 	# The choice of top channels happens inside this function.
 	def disable_random_channels(self, target_number):
-		random_ordered_edges = sample(self.lnhopgraph.edges(), k=len(self.lnhopgraph.edges()))
+		random_ordered_edges = sample(list(self.lnhopgraph.edges()), k=len(self.lnhopgraph.edges()))
 		total_jammed_amount = 0
 		for (n1, n2) in random_ordered_edges:
-			if n1 == "PROBER" or n2 == "PROBER":
+			if n1 == self.our_node or n2 == self.our_node:
 				continue
 			# Jam % of hops
 			jammed_number, jammed_amount = self.lnhopgraph.get_edge_data(n1, n2)["hop"].jam_random()
@@ -478,51 +756,37 @@ class Prober:
 	# - or capacity for amount jamming
 	# Consider only non-jammed channels. Always consider both directions for simplicity.
 	def find_top_hops(self, slot_jamming=True):
-		hop_ranks = dict()
-		for (n1, n2) in self.lnhopgraph.edges():
-			current_hop = self.lnhopgraph.get_edge_data(n1, n2)["hop"]
-			current_hop_avail_capacity = current_hop.available_capacity()
-			if current_hop_avail_capacity < 1_000_000:
-				continue
-			if slot_jamming:
-				current_hop_throughput = current_hop.available_dirs()
-			else:
-				current_hop_throughput = current_hop_avail_capacity
+		'''
+			Rank hops for jamming (see TopHopRanking).
 
-			neighbors_avail_throughput = 0
-			for neighbor_edge in list(self.lnhopgraph.edges(n1)) + list(self.lnhopgraph.edges(n2)):
-				if neighbor_edge[0] in [n1, n2] and neighbor_edge[1] in [n1, n2]:
-					continue
-				neighbor_hop = self.lnhopgraph.get_edge_data(neighbor_edge[0], neighbor_edge[1])["hop"]
-				if slot_jamming:
-					neighbors_avail_throughput += neighbor_hop.available_dirs()
-				else:
-					neighbors_avail_throughput += neighbor_hop.available_capacity()
-			hop_ranks[(n1, n2)] = (neighbors_avail_throughput, current_hop_throughput)
-		sorted_hop_ranks = sorted(hop_ranks.items(), key=lambda item: item[1][0]/item[1][1], reverse=True)
-		return sorted_hop_ranks
+			Parameters:
+			- slot_jamming: rank by the number of available channel directions (True) or by available capacity (False)
+
+			Return: a TopHopRanking (pass it to disable_hops)
+		'''
+		return TopHopRanking(self.lnhopgraph, slot_jamming)
 
 
 	# This function is used to test how efficient is slot jamming. It is called to disable one
 	# of the best channels (presumably, via jamming, but in practice we just flag it).
 	# The choice of top channels happens inside this function.
+	# The ranking is updated as hops get jammed (their neighbors become less attractive).
 	def disable_hops(self, target_hops, channels_to_jam):
-		i = 0
 		jammed_total_amount = 0
-		while channels_to_jam > 0 and i < len(target_hops):
-			target_hop = target_hops[i]
-			jammed_channels, jammed_amount = self.lnhopgraph.get_edge_data(target_hop[0][0], target_hop[0][1])["hop"].jam_all()
+		while channels_to_jam > 0 and len(target_hops) > 0:
+			(n1, n2), _ = target_hops.pop()
+			jammed_channels, jammed_amount = self.lnhopgraph.get_edge_data(n1, n2)["hop"].jam_all()
+			target_hops.update_hop(n1, n2)
 			channels_to_jam -= jammed_channels
 			jammed_total_amount += jammed_amount
-			i += 1
-		return target_hops[i:], jammed_total_amount
+		return target_hops, jammed_total_amount
 
 	def count_jammed(self):
 		result1 = 0
 		result2 = 0
 		for (n1, n2) in self.lnhopgraph.edges():
 			current_hop = self.lnhopgraph.get_edge_data(n1, n2)["hop"]
-			result1 += len(set(current_hop.j[0] + current_hop.j[1]))
+			result1 += popcount(current_hop.j_mask[dir0] | current_hop.j_mask[dir1])
 			result2 += current_hop.N
 		return (result1, result2)
 
@@ -36,6 +36,8 @@ SPDX-License-Identifier: MIT
 import operator
 from functools import reduce
 
+import numpy as np
+
 
 class Rectangle():
 	'''
@@ -61,6 +63,8 @@ class Rectangle():
 			self.is_empty = True
 			self.l_vertex = None
 			self.u_vertex = None
+		# the RectangleBatch of this rectangle (see as_batch)
+		self.batch = None
 
 
 	def S(self):
@@ -87,6 +91,20 @@ class Rectangle():
 		return s
 
 
+	def as_batch(self, N):
+		'''
+			Return this rectangle as a RectangleBatch of one row.
+			The batch is cached: rectangles are never modified after creation
+			(to change a rectangle, create a new one; Hop copies b_u for R_b for this reason).
+
+			Parameters:
+			- N: the dimension of the rectangle (needed if it is empty)
+		'''
+		if self.batch is None:
+			self.batch = RectangleBatch.from_rectangles([self], N)
+		return self.batch
+
+
 	def contains_point(self, point):
 		'''
 			Return True if a given point is inside the rectangle, False otherwise.
@@ -175,3 +193,134 @@ class EmptyRectangle(Rectangle):
 	def __init__(self):
 		Rectangle.__init__(self, None, None)
 
+
+
+class RectangleBatch():
+	'''
+		A batch of k rectangles of the same dimension N, stored as two (k, N) integer arrays:
+		the lower-left vertices and the upper-right vertices (one rectangle per row).
+		is_empty is a boolean array that is True for empty rectangles.
+		A batch of one rectangle is broadcast against a batch of k rectangles in all operations.
+	'''
+
+	def __init__(self, l_vertices, u_vertices):
+		'''
+			Initialize a batch of rectangles.
+
+			Parameters:
+			l_vertices: a (k, N) array of lower-left vertices
+			u_vertices: a (k, N) array of upper-right vertices
+		'''
+		self.l_vertices = np.asarray(l_vertices, dtype=np.int64)
+		self.u_vertices = np.asarray(u_vertices, dtype=np.int64)
+		assert(self.l_vertices.ndim == 2 and self.l_vertices.shape[1] == self.u_vertices.shape[1])
+
+
+	@property
+	def is_empty(self):
+		# if at at least one dimension l_vertex is higher than u_vertex, the rectangle is empty
+		return (self.l_vertices > self.u_vertices).any(axis=1)
+
+
+	@classmethod
+	def from_rectangles(cls, rectangles, N):
+		'''
+			Stack Rectangle objects into a batch.
+
+			Parameters:
+			- rectangles: a list of Rectangle's (possibly empty)
+			- N: the dimension of the rectangles
+
+			Return: a RectangleBatch with one row per rectangle
+		'''
+		l_vertices = [[1] * N if R.is_empty else R.l_vertex for R in rectangles]
+		u_vertices = [[0] * N if R.is_empty else R.u_vertex for R in rectangles]
+		return cls(l_vertices, u_vertices)
+
+
+	def __len__(self):
+		return len(self.l_vertices)
+
+
+	def __getitem__(self, i):
+		'''
+			Return the i-th rectangle as a Rectangle.
+		'''
+		return Rectangle(self.l_vertices[i].tolist(), self.u_vertices[i].tolist())
+
+
+	def __str__(self):
+		return "\n".join(str(self[i]) for i in range(len(self)))
+
+
+	def S(self, exact=True):
+		'''
+			Calculate the areas of all rectangles (see Rectangle.S).
+
+			Parameters:
+			- exact: if True, areas are Python integers (they easily overflow 64 bits);
+			  if False, areas are floating point numbers (faster, but imprecise for large areas)
+
+			Return: an array of k areas
+		'''
+		widths = np.maximum(self.u_vertices - self.l_vertices + 1, 0)
+		return widths.astype(object if exact else float).prod(axis=1)
+
+
+	def contains_point(self, points):
+		'''
+			Return a boolean array: True if the point is inside the respective rectangle.
+
+			Parameters:
+			- points: a (k, N) array of points (or one point for all rectangles)
+		'''
+		points = np.atleast_2d(np.asarray(points, dtype=np.int64))
+		assert(points.shape[1] == self.l_vertices.shape[1])
+		return ((self.l_vertices <= points) & (points <= self.u_vertices)).all(axis=1)
+
+
+	def is_inside(self, other_batch):
+		'''
+			Check if rectangles in this batch are inside the respective rectangles of another batch.
+			An empty rectangle is inside any rectangle.
+
+			Parameters:
+			- other_batch: the other ("outside") RectangleBatch
+
+			Return: a boolean array
+		'''
+		assert(self.l_vertices.shape[1] == other_batch.l_vertices.shape[1])
+		inside = ((self.l_vertices >= other_batch.l_vertices) & (self.u_vertices <= other_batch.u_vertices)).all(axis=1)
+		return inside | self.is_empty
+
+
+	def intersect_with(self, other_batch):
+		'''
+			Intersect each rectangle with the respective rectangle of another batch.
+			Along each dimension, l is max of l's, u is min of u's.
+			If the intersection is empty, so is the resulting rectangle.
+
+			Parameters:
+			- other_batch: the other RectangleBatch
+
+			Return: a RectangleBatch of intersections
+		'''
+		assert(self.l_vertices.shape[1] == other_batch.l_vertices.shape[1])
+		return RectangleBatch(
+			np.maximum(self.l_vertices, other_batch.l_vertices),
+			np.minimum(self.u_vertices, other_batch.u_vertices))
+
+
+
+class ProbingRectangleBatch(RectangleBatch):
+	'''
+		A batch of ProbingRectangle's for the same direction and different bounds.
+	'''
+	def __init__(self, hop, direction, bounds):
+		# bounds = amounts - 1
+		# hop must provide capacities (c) and effective_vertices
+		vertices = hop.effective_vertices(direction, bounds)
+		other_vertices = np.empty_like(vertices)
+		other_vertices[:] = 0 if direction else hop.c
+		l_vertices, u_vertices = (other_vertices, vertices) if direction else (vertices, other_vertices)
+		RectangleBatch.__init__(self, l_vertices, u_vertices)
@@ -0,0 +1,570 @@
+#! /usr/bin/python3
+
+'''
+This file is part of Lightning Network Probing Simulator.
+
+Copyright © 2020-2021 University of Luxembourg
+
+	Permission is hereby granted, free of charge, to any person obtaining a copy
+	of this software and associated documentation files (the "Software"), to deal
+	in the Software without restriction, including without limitation the rights
+	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+	copies of the Software, and to permit persons to whom the Software is
+	furnished to do so, subject to the following conditions:
+
+	The above copyright notice and this permission notice shall be included in all
+	copies or substantial portions of the Software.
+
+	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+	SOFTWARE.
+
+SPDX-FileType: SOURCE
+SPDX-FileCopyrightText: 2020-2021 University of Luxembourg
+SPDX-License-Identifier: MIT
+'''
+
+'''
+	Amount-aware path search over the hop graph.
+
+	Each hop is an undirected edge of the hop graph; for routing, it is two directed edges.
+	A directed edge n1 -> n2 can forward an amount if the amount doesn't exceed the upper bound
+	on the maximal balance in this direction: h_u if n1 < n2 (dir0), g_u otherwise (dir1).
+
+	There are two interchangeable routing backends that find the same paths in the same order:
+	- CSRRouting: nodes are numbered, and the adjacency is stored as CSR arrays
+	  (successors and predecessors of each node); bounds are read from the HopTable columns.
+	  Path search checks all edges of a BFS level at once with NumPy instead of calling a Python filter per edge.
+	- NetworkXRouting: NetworkX path search on a filtered view of the directed graph (the reference implementation).
+	A third backend, ShortestPathTreeRouting, answers queries from a fixed root with cached shortest path trees.
+	Its paths are just as short, but ties between equally short paths may be broken differently.
+'''
+
+from hop_table import HopView
+
+from heapq import heappush, heappop
+from itertools import count
+
+import networkx as nx
+import numpy as np
+
+
+ROUTING_CSR = "csr"
+ROUTING_NETWORKX = "networkx"
+ROUTING_TREES = "trees"
+ROUTING_BACKENDS = [ROUTING_CSR, ROUTING_NETWORKX, ROUTING_TREES]
+
+
+def create_routing(backend, hop_graph, directed_graph=None, root=None):
+	'''
+		Create a routing backend.
+
+		Parameters:
+		- backend: ROUTING_CSR, ROUTING_NETWORKX, or ROUTING_TREES
+		- hop_graph: the hop graph
+		- directed_graph: the directed version of the hop graph (only used by the NetworkX backend)
+		- root: the node most paths start from (only used by the shortest path trees backend)
+
+		Return: a CSRRouting, a NetworkXRouting, or a ShortestPathTreeRouting
+	'''
+	assert(backend in ROUTING_BACKENDS), backend
+	if backend == ROUTING_NETWORKX:
+		return NetworkXRouting(hop_graph, hop_graph.to_directed(as_view=True) if directed_graph is None else directed_graph)
+	if backend == ROUTING_TREES:
+		return ShortestPathTreeRouting(hop_graph, root)
+	return CSRRouting(hop_graph)
+
+
+def filtered_routing_graph(hop_graph, directed_graph, amount, exclude_nodes=None):
+	'''
+		Create a view of the directed graph that excludes edges that we know cannot forward the amount.
+
+		Parameters:
+		- hop_graph: the hop graph (its edges hold the hops)
+		- directed_graph: the directed version of the hop graph
+		- amount: the required payment amount
+		- exclude_nodes: additionally, exclude these nodes from the view
+	'''
+	def filter_edge(n1, n2):
+		'''
+			Return True if the edge is kept, False if it is excluded.
+
+			Parameters:
+			- n1, n2: node numbers of the vertices
+		'''
+		hop = hop_graph[n1][n2]["hop"]
+		return amount <= (hop.h_u if n1 < n2 else hop.g_u)
+	def filter_node(n):
+		'''
+			Return True if the node is kept, False if it is excluded.
+
+			A generic User generally shouldn't exclude nodes.
+			A Prober, however, excludes the target node and calculates routes to the previous node
+			  to ensure the route includes the target hop as the last hop.
+
+			Parameters:
+			- n: node number of the node
+		'''
+		return True if not exclude_nodes else n not in exclude_nodes
+	return nx.subgraph_view(directed_graph, filter_node=filter_node, filter_edge=filter_edge)
+
+
+def shortest_simple_paths(shortest_path, source, target):
+	'''
+		Generate simple paths from source to target, starting from the shortest ones (Yen's algorithm).
+		This follows nx.shortest_simple_paths step by step, so the paths come in the same order.
+
+		Parameters:
+		- shortest_path: a function (source, target, ignore_nodes, ignore_edges) -> path or None
+		- source: the source node
+		- target: the target node
+
+		Return:
+		- a generator of paths (lists of nodes)
+	'''
+	# candidate paths ordered by length (and then by the order they were found)
+	candidates, candidate_set, counter = [], set(), count()
+	def push(length, path):
+		if tuple(path) not in candidate_set:
+			heappush(candidates, (length, next(counter), path))
+			candidate_set.add(tuple(path))
+	found_paths = []
+	prev_path = None
+	while True:
+		if not prev_path:
+			path = shortest_path(source, target, set(), set())
+			if path is not None:
+				push(len(path), path)
+		else:
+			ignore_nodes, ignore_edges = set(), set()
+			for i in range(1, len(prev_path)):
+				root = prev_path[:i]
+				for path in found_paths:
+					if path[:i] == root:
+						ignore_edges.add((path[i - 1], path[i]))
+				spur = shortest_path(root[-1], target, ignore_nodes, ignore_edges)
+				if spur is not None:
+					push(len(root) + len(spur), root[:-1] + spur)
+				ignore_nodes.add(root[-1])
+		if not candidates:
+			return
+		_, _, path = heappop(candidates)
+		candidate_set.remove(tuple(path))
+		yield path
+		found_paths.append(path)
+		prev_path = path
+
+
+
+class PathIterator:
+	'''
+		Paths to a target that may forward amounts up to a given amount, shortest first.
+		The iterator is kept across probes, so that we don't search for the same paths again:
+		the current path is reused, and we move on to the next one when it can't be used anymore
+		(see Prober.path_for_amount).
+	'''
+
+	def __init__(self, paths, amount):
+		'''
+			Parameters:
+			- paths: a generator of paths (see Prober.paths_for_amount)
+			- amount: the amount the paths were searched for
+		'''
+		self.paths = paths
+		self.amount = amount
+		# the current path (None if we should move on to the next path)
+		self.path = None
+
+
+	def next_path(self):
+		self.path = next(self.paths, None)
+		return self.path
+
+
+
+class NetworkXRouting:
+	'''
+		The reference routing backend: NetworkX path search on a filtered view of the directed graph.
+	'''
+
+	def __init__(self, hop_graph, directed_graph):
+		self.hop_graph = hop_graph
+		self.directed_graph = directed_graph
+
+
+	def shortest_simple_paths(self, source, target, amount, exclude_nodes=None):
+		'''
+			Generate paths along which an amount may be forwarded, starting from the shortest ones.
+		'''
+		routing_graph = filtered_routing_graph(self.hop_graph, self.directed_graph, amount, exclude_nodes)
+		if source not in routing_graph or target not in routing_graph:
+			return
+		try:
+			yield from nx.shortest_simple_paths(routing_graph, source=source, target=target)
+		except nx.exception.NetworkXNoPath:
+			return
+
+
+	def shortest_path(self, source, target, amount, exclude_nodes=None):
+		'''
+			Find a shortest path along which an amount may be forwarded (None if there is no such path).
+		'''
+		return next(self.shortest_simple_paths(source, target, amount, exclude_nodes), None)
+
+
+	def update_edges(self, hop_graph, node_pairs):
+		'''
+			Nothing to update: the directed graph is a view of the hop graph (see CSRRouting.update_edges).
+		'''
+		pass
+
+
+
+class CSRRouting:
+	'''
+		The array-based routing backend.
+		Bounds are read from the HopTable columns, so the index always reflects the current estimates.
+	'''
+	def __init__(self, hop_graph):
+		'''
+			Index the directed edges of a hop graph.
+
+			Edges are numbered and ordered exactly as in hop_graph.to_directed(as_view=True),
+			so that the order of neighbors (and hence, tie-breaking in path search) is the same.
+			(In the directed view, both successors and predecessors of a node follow its adjacency order.)
+
+			Parameters:
+			- hop_graph: the hop graph (each edge holds a HopView of a hop in the graph's HopTable)
+		'''
+		self.hop_table = hop_graph.graph["hop_table"]
+		self.nodes = list(hop_graph.nodes())
+		self.node_index = {node: i for i, node in enumerate(self.nodes)}
+		num_edges = 2 * hop_graph.number_of_edges()
+		src = np.empty(num_edges, dtype=np.int64)
+		dst = np.empty(num_edges, dtype=np.int64)
+		hop_index = np.empty(num_edges, dtype=np.int64)
+		dir0 = np.empty(num_edges, dtype=bool)
+		e = 0
+		for n1, neighbors in hop_graph.adjacency():
+			for n2, edge_data in neighbors.items():
+				hop = edge_data["hop"]
+				assert(isinstance(hop, HopView) and hop.table is self.hop_table), "Hops must be stored in the hop table"
+				src[e], dst[e], hop_index[e], dir0[e] = self.node_index[n1], self.node_index[n2], hop.index, n1 < n2
+				e += 1
+		assert(e == num_edges)
+		self.src, self.dst, self.hop_index, self.dir0 = src, dst, hop_index, dir0
+		self.edge_index = {(self.nodes[s], self.nodes[d]): e for e, (s, d) in enumerate(zip(src.tolist(), dst.tolist()))}
+		# the edge n2 -> n1 for each edge n1 -> n2
+		self.reverse_edge = np.array([self.edge_index[(self.nodes[d], self.nodes[s])]
+			for s, d in zip(src.tolist(), dst.tolist())], dtype=np.int64)
+		# False for edges of removed hops (see update_edges)
+		self.edge_alive = np.ones(num_edges, dtype=bool)
+		self.search_stamp = 0
+		self.index_adjacency()
+
+
+	def index_adjacency(self):
+		'''
+			Build the successor and predecessor arrays from the edge arrays, and reset the BFS state.
+		'''
+		# successors: edges grouped by source (in the order of the adjacency)
+		# edges are numbered in the order they were added, as NetworkX orders neighbors: a stable sort keeps this order
+		alive_edges = np.flatnonzero(self.edge_alive)
+		self.succ_edges = alive_edges[np.argsort(self.src[alive_edges], kind="stable")]
+		self.succ_indptr = np.concatenate(([0], np.cumsum(np.bincount(self.src[alive_edges], minlength=len(self.nodes)))))
+		# predecessors: the reverse edges of the successor edges (n1 -> n2 for each n2 -> n1)
+		self.pred_edges = self.reverse_edge[self.succ_edges]
+		self.pred_indptr = self.succ_indptr
+		# BFS state (see shortest_path)
+		self.pred_stamp, self.succ_stamp = np.zeros(len(self.nodes), dtype=np.int64), np.zeros(len(self.nodes), dtype=np.int64)
+		self.pred, self.succ = np.full(len(self.nodes), -1, dtype=np.int64), np.full(len(self.nodes), -1, dtype=np.int64)
+
+
+	def update_edges(self, hop_graph, node_pairs):
+		'''
+			Update the index after hops were added to, removed from, or replaced in the hop graph.
+			Only the given hops are looked up; the adjacency arrays are rebuilt with NumPy.
+
+			Parameters:
+			- hop_graph: the hop graph (the same one the index was built from)
+			- node_pairs: the (undirected) node pairs of the hops that changed
+		'''
+		new_edges = []
+		for n1, n2 in node_pairs:
+			for node in (n1, n2):
+				if node not in self.node_index:
+					self.node_index[node] = len(self.nodes)
+					self.nodes.append(node)
+			if hop_graph.has_edge(n1, n2):
+				hop = hop_graph[n1][n2]["hop"]
+				assert(isinstance(hop, HopView) and hop.table is self.hop_table), "Hops must be stored in the hop table"
+				if (n1, n2) in self.edge_index:
+					self.hop_index[[self.edge_index[(n1, n2)], self.edge_index[(n2, n1)]]] = hop.index
+				else:
+					new_edges.append((n1, n2, hop.index))
+			elif (n1, n2) in self.edge_index:
+				for edge in ((n1, n2), (n2, n1)):
+					self.edge_alive[self.edge_index.pop(edge)] = False
+		if new_edges:
+			# each hop becomes two directed edges with consecutive numbers
+			first_edge = len(self.src)
+			src, dst, hop_index = [], [], []
+			for n1, n2, index in new_edges:
+				src.extend((self.node_index[n1], self.node_index[n2]))
+				dst.extend((self.node_index[n2], self.node_index[n1]))
+				hop_index.extend((index, index))
+			src, dst = np.array(src, dtype=np.int64), np.array(dst, dtype=np.int64)
+			new_edge_numbers = np.arange(first_edge, first_edge + len(src), dtype=np.int64)
+			self.src, self.dst = np.concatenate((self.src, src)), np.concatenate((self.dst, dst))
+			self.hop_index = np.concatenate((self.hop_index, np.array(hop_index, dtype=np.int64)))
+			self.dir0 = np.concatenate((self.dir0, [self.nodes[s] < self.nodes[d] for s, d in zip(src.tolist(), dst.tolist())]))
+			self.reverse_edge = np.concatenate((self.reverse_edge, new_edge_numbers + 1 - 2 * ((new_edge_numbers - first_edge) % 2)))
+			self.edge_alive = np.concatenate((self.edge_alive, np.ones(len(src), dtype=bool)))
+			for e, (s, d) in enumerate(zip(src.tolist(), dst.tolist()), start=first_edge):
+				self.edge_index[(self.nodes[s], self.nodes[d])] = e
+		self.index_adjacency()
+
+
+	def upper_bounds(self, edges=None):
+		'''
+			Return the current upper bounds on the amount each directed edge can forward.
+
+			Parameters:
+			- edges: an array of edge indices (all edges if None)
+		'''
+		if edges is None:
+			edges = slice(None)
+		hop_index = self.hop_index[edges]
+		return np.where(self.dir0[edges], self.hop_table.h_u[hop_index], self.hop_table.g_u[hop_index])
+
+
+	def eligible_edges(self, amount, edges=None):
+		'''
+			Return a boolean array: True for directed edges that may forward the amount.
+
+			Parameters:
+			- amount: the amount to forward
+			- edges: an array of edge indices (all edges if None)
+		'''
+		return amount <= self.upper_bounds(edges)
+
+
+	def expand(self, level, indptr, edges, other_end, amount, excluded, ignored_edges=None):
+		'''
+			Collect all eligible edges adjacent to a BFS level (in the order of the level and the adjacency).
+			Only the bounds of these edges are checked.
+
+			Parameters:
+			- level: an array of node indices
+			- indptr, edges: the adjacency (successors or predecessors)
+			- other_end: the array of edge ends to return (dst for successors, src for predecessors)
+			- amount: the amount to forward
+			- excluded: a boolean mask of excluded nodes (or None)
+			- ignored_edges: an array of ignored edge indices (or None)
+
+			Return:
+			- origins: the node in the level each edge is adjacent to
+			- neighbors: the other end of each edge
+			- adjacent_edges: the edges
+		'''
+		starts, counts = indptr[level], indptr[level + 1] - indptr[level]
+		total = int(counts.sum())
+		# positions of adjacency entries of all nodes in the level, concatenated
+		offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+		adjacent_edges = edges[offsets + np.arange(total)]
+		origins, neighbors = np.repeat(level, counts), other_end[adjacent_edges]
+		keep = self.eligible_edges(amount, adjacent_edges)
+		if excluded is not None:
+			keep &= ~excluded[neighbors]
+		if ignored_edges is not None:
+			keep &= ~np.isin(adjacent_edges, ignored_edges)
+		return origins[keep], neighbors[keep], adjacent_edges[keep]
+
+
+	def shortest_path(self, source, target, amount, exclude_nodes=None, ignore_nodes=None, ignore_edges=None):
+		'''
+			Find a shortest path (by the number of hops) along which an amount may be forwarded.
+
+			This is a bidirectional BFS that visits and breaks ties exactly as NetworkX does
+			(see nx.shortest_simple_paths: its first path is the same as ours),
+			but expands whole BFS levels at once.
+
+			Parameters:
+			- source: the source node
+			- target: the target node
+			- amount: the amount to forward
+			- exclude_nodes: don't use these nodes in the path
+			- ignore_nodes, ignore_edges: additionally, don't use these nodes and (directed) edges
+
+			Return:
+			- path: a list of nodes from source to target, or None if no such path exists
+		'''
+		if source not in self.node_index or target not in self.node_index:
+			return None
+		excluded_nodes = set(exclude_nodes or ()) | set(ignore_nodes or ())
+		if source in excluded_nodes or target in excluded_nodes:
+			return None
+		excluded = None
+		if excluded_nodes:
+			excluded = np.zeros(len(self.nodes), dtype=bool)
+			excluded[[self.node_index[node] for node in excluded_nodes if node in self.node_index]] = True
+		ignored_edges = None
+		if ignore_edges:
+			ignored_edges = np.array([self.edge_index[edge] for edge in ignore_edges if edge in self.edge_index], dtype=np.int64)
+		s, t = self.node_index[source], self.node_index[target]
+		if s == t:
+			return [source]
+		# pred: the previous node on the way from the source; succ: the next node on the way to the target
+		# (the arrays are reused across searches: a node is visited if its stamp equals this search's stamp)
+		self.search_stamp += 1
+		stamp = self.search_stamp
+		self.pred_stamp[s], self.succ_stamp[t] = stamp, stamp
+		forward_fringe, reverse_fringe = np.array([s]), np.array([t])
+		meeting_node = None
+		while meeting_node is None and len(forward_fringe) and len(reverse_fringe):
+			forward = len(forward_fringe) <= len(reverse_fringe)
+			if forward:
+				origins, neighbors, _ = self.expand(forward_fringe, self.succ_indptr, self.succ_edges, self.dst, amount, excluded, ignored_edges)
+				visited, links, other_visited = self.pred_stamp, self.pred, self.succ_stamp
+			else:
+				origins, neighbors, _ = self.expand(reverse_fringe, self.pred_indptr, self.pred_edges, self.src, amount, excluded, ignored_edges)
+				visited, links, other_visited = self.succ_stamp, self.succ, self.pred_stamp
+			# the search stops at the first neighbor reached from the other side
+			hits = np.flatnonzero(other_visited[neighbors] == stamp)
+			if len(hits):
+				origins, neighbors = origins[:hits[0] + 1], neighbors[:hits[0] + 1]
+				meeting_node = int(neighbors[-1])
+			# newly visited nodes, in the order of their first appearance
+			candidates = np.flatnonzero(visited[neighbors] != stamp)
+			_, first_appearance = np.unique(neighbors[candidates], return_index=True)
+			candidates = candidates[np.sort(first_appearance)]
+			new_nodes = neighbors[candidates]
+			links[new_nodes] = origins[candidates]
+			visited[new_nodes] = stamp
+			if forward:
+				forward_fringe = new_nodes
+			else:
+				reverse_fringe = new_nodes
+		if meeting_node is None:
+			return None
+		path = [meeting_node]
+		while path[-1] != t:
+			path.append(int(self.succ[path[-1]]))
+		while path[0] != s:
+			path.insert(0, int(self.pred[path[0]]))
+		return [self.nodes[node] for node in path]
+
+
+	def shortest_simple_paths(self, source, target, amount, exclude_nodes=None):
+		'''
+			Generate paths along which an amount may be forwarded, starting from the shortest ones.
+			Further paths are only searched for when requested.
+		'''
+		def shortest_path(source, target, ignore_nodes, ignore_edges):
+			return self.shortest_path(source, target, amount, exclude_nodes, ignore_nodes, ignore_edges)
+		return shortest_simple_paths(shortest_path, source, target)
+
+
+
+class ShortestPathTreeRouting(CSRRouting):
+	'''
+		The CSR backend with cached shortest path trees rooted at one node (the prober).
+
+		Amounts are bucketed by powers of two.
+		The tree for threshold T is a BFS tree over the edges with upper bounds of at least T.
+		For an amount a in [T, 2T), these edges include all edges that may forward a.
+		Hence, if the target is not in the tree, there is no path for a;
+		and if the tree path to the target may forward a, it is a shortest path for a.
+		Otherwise (the path has an edge with an upper bound in [T, a)), we fall back to a BFS for a.
+
+		Upper bounds only decrease as we probe, so a tree only becomes outdated when one of its edges
+		drops below its threshold: we check this for the edges of each path we look up.
+		(If edges outside the path drop, the path is still a shortest one.)
+		All trees are dropped if any upper bound may have increased (see HopTable.upper_bounds_epoch).
+	'''
+
+	def __init__(self, hop_graph, root):
+		CSRRouting.__init__(self, hop_graph)
+		assert(root in self.node_index), root
+		self.root = root
+		# threshold -> (epoch, pred_edge): pred_edge is the tree edge to each node (-1 if not in the tree)
+		self.trees = dict()
+		self.num_trees_built = 0
+
+
+	def update_edges(self, hop_graph, node_pairs):
+		'''
+			Update the index (see CSRRouting.update_edges) and drop all trees.
+		'''
+		CSRRouting.update_edges(self, hop_graph, node_pairs)
+		self.trees.clear()
+
+
+	def tree(self, threshold):
+		'''
+			Return the predecessor edges of the shortest path tree for the threshold (build it if needed).
+		'''
+		epoch = self.hop_table.upper_bounds_epoch
+		if threshold in self.trees and self.trees[threshold][0] == epoch:
+			return self.trees[threshold][1]
+		root = self.node_index[self.root]
+		pred_edge = np.full(len(self.nodes), -1, dtype=np.int64)
+		in_tree = np.zeros(len(self.nodes), dtype=bool)
+		in_tree[root] = True
+		level = np.array([root])
+		while len(level):
+			_, neighbors, edges = self.expand(level, self.succ_indptr, self.succ_edges, self.dst, threshold, None)
+			# newly reached nodes, in the order of their first appearance
+			candidates = np.flatnonzero(~in_tree[neighbors])
+			_, first_appearance = np.unique(neighbors[candidates], return_index=True)
+			candidates = candidates[np.sort(first_appearance)]
+			level = neighbors[candidates]
+			pred_edge[level] = edges[candidates]
+			in_tree[level] = True
+		self.trees[threshold] = (epoch, pred_edge)
+		self.num_trees_built += 1
+		return pred_edge
+
+
+	def tree_path_edges(self, threshold, target):
+		'''
+			Return the edges of the tree path from the root to the target (None if it's not in the tree).
+		'''
+		pred_edge, root, node = self.tree(threshold), self.node_index[self.root], self.node_index[target]
+		edges = []
+		while node != root:
+			edge = int(pred_edge[node])
+			if edge < 0:
+				return None
+			edges.append(edge)
+			node = int(self.src[edge])
+		edges.reverse()
+		return edges
+
+
+	def shortest_path(self, source, target, amount, exclude_nodes=None, ignore_nodes=None, ignore_edges=None):
+		'''
+			Find a shortest path along which an amount may be forwarded (see CSRRouting.shortest_path).
+			Paths from the root are looked up in the trees.
+		'''
+		if source != self.root or target not in self.node_index or amount < 1 or exclude_nodes or ignore_nodes or ignore_edges:
+			return CSRRouting.shortest_path(self, source, target, amount, exclude_nodes, ignore_nodes, ignore_edges)
+		threshold = 1 << (int(amount).bit_length() - 1)
+		edges = self.tree_path_edges(threshold, target)
+		if edges is None:
+			return None
+		bounds = self.upper_bounds(np.array(edges, dtype=np.int64))
+		if (bounds < threshold).any():
+			# the tree is outdated
+			del self.trees[threshold]
+			edges = self.tree_path_edges(threshold, target)
+			if edges is None:
+				return None
+			bounds = self.upper_bounds(np.array(edges, dtype=np.int64))
+		if (bounds < amount).any():
+			return CSRRouting.shortest_path(self, source, target, amount)
+		return [source] + [self.nodes[int(self.dst[edge])] for edge in edges]
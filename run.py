@@ -32,7 +32,10 @@ import argparse
 import time
 
 from experiments import experiment_1, experiment_2
+from hop import set_validation, VALIDATION_LEVELS, VALIDATION_FULL
+from routing import ROUTING_BACKENDS, ROUTING_TREES
 from prober import Prober
+from snapshot_cache import compile_snapshot
 
 
 SNAPSHOT_FILENAME = "./snapshots/listchannels-2021-12-09.json"
@@ -67,19 +70,37 @@ def main():
 		help="Pick target hops from snapshot? (Then do both direct and remote probing.)")
 	#parser.add_argument("--jamming", dest="jamming", action="store_true",
 	#	help="Use jamming after h and g are known?")
+	parser.add_argument("--validation", default=VALIDATION_FULL, choices=VALIDATION_LEVELS,
+		help="Check hop invariants after every update (full), after every N-th update (sampled), or never (off).")
+	parser.add_argument("--validation_sample_period", default=100, type=int,
+		help="In sampled validation mode, check invariants after every this many updates of a hop.")
+	parser.add_argument("--routing", default=ROUTING_TREES, choices=ROUTING_BACKENDS,
+		help="Path search backend for remote probing: cached shortest path trees (trees), arrays (csr), "
+		"or the NetworkX reference implementation (networkx). Only trees may break ties between paths differently.")
+	parser.add_argument("--num_workers", default=1, type=int,
+		help="Probe groups of target hops in this many worker processes in remote probing (1: probe sequentially).")
+	parser.add_argument("--compile_snapshot", dest="compile_snapshot", action="store_true",
+		help="Compile the snapshot into a binary file (loaded automatically by later runs) and exit.")
 	args = parser.parse_args()
 
+	if args.compile_snapshot:
+		compile_snapshot(SNAPSHOT_FILENAME)
+		return
+
+	set_validation(args.validation, args.validation_sample_period)
+
 	if args.use_snapshot and args.max_num_channels > MAX_MAX_NUM_CHANNELS:
 		print("Too high max_num_channels: snapshot doesn't have that many hops with that many channels.")
 		exit()
 
-	prober = Prober(SNAPSHOT_FILENAME, "PROBER", ENTRY_NODES, ENTRY_CHANNEL_CAPACITY) if args.use_snapshot else None
+	prober = Prober(SNAPSHOT_FILENAME, "PROBER", ENTRY_NODES, ENTRY_CHANNEL_CAPACITY,
+		routing=args.routing) if args.use_snapshot else None
 	
 	if prober:
 		prober.analyze_graph()
 
 	experiment_1(prober, args.num_target_hops, args.num_runs_per_experiment, 
-		args.min_num_channels, args.max_num_channels)#, args.use_snapshot, args.jamming)
+		args.min_num_channels, args.max_num_channels, args.num_workers)#, args.use_snapshot, args.jamming)
 	experiment_2(args.num_target_hops, args.num_runs_per_experiment)
 
 
@@ -0,0 +1,212 @@
+#! /usr/bin/python3
+
+'''
+This file is part of Lightning Network Probing Simulator.
+
+Copyright © 2020-2021 University of Luxembourg
+
+	Permission is hereby granted, free of charge, to any person obtaining a copy
+	of this software and associated documentation files (the "Software"), to deal
+	in the Software without restriction, including without limitation the rights
+	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+	copies of the Software, and to permit persons to whom the Software is
+	furnished to do so, subject to the following conditions:
+
+	The above copyright notice and this permission notice shall be included in all
+	copies or substantial portions of the Software.
+
+	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+	SOFTWARE.
+
+SPDX-FileType: SOURCE
+SPDX-FileCopyrightText: 2020-2021 University of Luxembourg
+SPDX-License-Identifier: MIT
+'''
+
+'''
+	Compiled snapshots: the hop graph structure of a snapshot in a binary file, for fast startup.
+
+	Parsing a JSON snapshot, finding its largest connected component, and grouping channels into hops
+	takes a while for large snapshots. A compiled snapshot stores the result
+	(node IDs, hop ends, per-hop channel ranges, capacities, enabled flags) as NumPy arrays.
+	Balances are not stored: they are drawn randomly whenever a hop graph is created.
+
+	A compiled snapshot lives next to the snapshot (with an added suffix). Its header records the size,
+	the modification time, and the SHA-256 hash of the snapshot it was compiled from.
+	If the snapshot's size and modification time match, the compiled snapshot is used without reading the snapshot.
+	Otherwise, the snapshot is hashed, and the compiled snapshot is only used if the hashes match
+	(e.g., the snapshot was copied), so a changed snapshot is never loaded from a stale file.
+
+	File format: magic bytes, format version (uint32), header length (uint32), JSON header, arrays.
+	The header describes the arrays (dtype, shape, offset); arrays are aligned and can be memory-mapped.
+'''
+
+from graph import snapshot_hop_graph_structure, create_hop_graph, assemble_hop_graph
+from hop_table import HopTable
+from node_ids import NodeIds
+
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+
+COMPILED_SNAPSHOT_MAGIC = b"LNHOPGR\0"
+COMPILED_SNAPSHOT_VERSION = 3
+COMPILED_SNAPSHOT_SUFFIX = ".hopgraph"
+# arrays start at multiples of this many bytes
+ARRAY_ALIGNMENT = 64
+
+
+def aligned(size):
+	return -(-size // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+
+def data_start(header_length):
+	'''
+		Return the position of the first array in a compiled snapshot (array offsets are relative to it).
+	'''
+	return aligned(len(COMPILED_SNAPSHOT_MAGIC) + 8 + header_length)
+
+
+def snapshot_digest(snapshot_filename):
+	'''
+		Return the SHA-256 hash (hex) of a snapshot file.
+	'''
+	digest = hashlib.sha256()
+	with open(snapshot_filename, "rb") as snapshot_file:
+		for chunk in iter(lambda: snapshot_file.read(1 << 20), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def snapshot_key(snapshot_filename):
+	'''
+		Return the (size, modification time in nanoseconds) of a snapshot file: a cheap check whether it changed.
+	'''
+	stat = os.stat(snapshot_filename)
+	return stat.st_size, stat.st_mtime_ns
+
+
+def compiled_snapshot_filename(snapshot_filename):
+	'''
+		Return the path of the compiled snapshot for a snapshot (whether it exists or not).
+	'''
+	return snapshot_filename + COMPILED_SNAPSHOT_SUFFIX
+
+
+def compile_snapshot(snapshot_filename):
+	'''
+		Parse a snapshot and write its compiled version (see compiled_snapshot_filename).
+
+		Parameters:
+		- snapshot_filename: path to the snapshot
+
+		Return: the path of the compiled snapshot
+	'''
+	size, mtime_ns = snapshot_key(snapshot_filename)
+	digest = snapshot_digest(snapshot_filename)
+	nodes, hops, n_channels = snapshot_hop_graph_structure(snapshot_filename)
+	node_index = {node: i for i, node in enumerate(nodes)}
+	N = [len(capacities) for _, _, capacities, _, _ in hops]
+	channels_indptr = np.concatenate(([0], np.cumsum(N))).astype(np.int64)
+	enabled = {0: np.zeros(int(channels_indptr[-1]), dtype=bool), 1: np.zeros(int(channels_indptr[-1]), dtype=bool)}
+	for start, (_, _, _, e_dir0, e_dir1) in zip(channels_indptr.tolist(), hops):
+		enabled[0][[start + i for i in e_dir0]] = True
+		enabled[1][[start + i for i in e_dir1]] = True
+	arrays = {
+		"node_ids": np.array([node.encode() for node in nodes]),
+		"hop_ends": np.array([(node_index[n1], node_index[n2]) for n1, n2, _, _, _ in hops], dtype=np.int64).reshape(-1, 2),
+		"channels_indptr": channels_indptr,
+		"capacities": np.array([c for _, _, capacities, _, _ in hops for c in capacities], dtype=np.int64),
+		"enabled_dir0": enabled[0],
+		"enabled_dir1": enabled[1]}
+	header = {"size": size, "mtime_ns": mtime_ns, "digest": digest, "n_channels": n_channels, "arrays": dict()}
+	offset = 0
+	for name, array in arrays.items():
+		header["arrays"][name] = {"dtype": array.dtype.str, "shape": array.shape, "offset": offset}
+		offset += aligned(array.nbytes)
+	header_bytes = json.dumps(header).encode()
+	filename = compiled_snapshot_filename(snapshot_filename)
+	# write to a temporary file first, so that other processes never see a partially written file
+	temporary_filename = filename + "." + str(os.getpid()) + ".tmp"
+	with open(temporary_filename, "wb") as compiled_file:
+		compiled_file.write(COMPILED_SNAPSHOT_MAGIC)
+		compiled_file.write(struct.pack("<II", COMPILED_SNAPSHOT_VERSION, len(header_bytes)))
+		compiled_file.write(header_bytes)
+		for name, array in arrays.items():
+			compiled_file.seek(data_start(len(header_bytes)) + header["arrays"][name]["offset"])
+			compiled_file.write(np.ascontiguousarray(array).tobytes())
+	os.replace(temporary_filename, filename)
+	print("Compiled snapshot", snapshot_filename, "to", filename)
+	return filename
+
+
+def load_compiled_snapshot(filename, snapshot_filename=None):
+	'''
+		Load a compiled snapshot (memory-mapped).
+
+		Parameters:
+		- filename: path to the compiled snapshot
+		- snapshot_filename: the snapshot it must have been compiled from (not checked if None)
+		  (the snapshot is only hashed if its size or modification time changed since it was compiled)
+
+		Return: a (header, arrays) tuple (arrays are read-only and memory-mapped),
+		or None if the file has a different format version or was compiled from another snapshot
+	'''
+	with open(filename, "rb") as compiled_file:
+		magic = compiled_file.read(len(COMPILED_SNAPSHOT_MAGIC))
+		version, header_length = struct.unpack("<II", compiled_file.read(8))
+		if magic != COMPILED_SNAPSHOT_MAGIC or version != COMPILED_SNAPSHOT_VERSION:
+			return None
+		header = json.loads(compiled_file.read(header_length))
+	if snapshot_filename is not None and list(snapshot_key(snapshot_filename)) != [header["size"], header["mtime_ns"]]:
+		if header["digest"] != snapshot_digest(snapshot_filename):
+			return None
+	arrays = dict()
+	for name, description in header["arrays"].items():
+		shape = tuple(description["shape"])
+		if 0 in shape:
+			# empty arrays can't be memory-mapped
+			arrays[name] = np.zeros(shape, dtype=description["dtype"])
+		else:
+			arrays[name] = np.memmap(filename, dtype=description["dtype"], mode="r",
+				offset=data_start(header_length) + description["offset"], shape=shape)
+	return header, arrays
+
+
+def load_hop_graph(snapshot_filename):
+	'''
+		Create a hop graph for a snapshot (see graph.ln_multigraph_to_hop_graph).
+		Use the compiled snapshot if there is one (see compile_snapshot); otherwise, parse the snapshot.
+
+		Parameters:
+		- snapshot_filename: path to the snapshot
+
+		Return:
+		- hop_graph: the hop graph (of the largest connected component)
+		- n_channels: the number of channels in the snapshot
+	'''
+	filename = compiled_snapshot_filename(snapshot_filename)
+	compiled = load_compiled_snapshot(filename, snapshot_filename) if os.path.exists(filename) else None
+	if compiled is None:
+		nodes, hops, n_channels = snapshot_hop_graph_structure(snapshot_filename)
+		return create_hop_graph(nodes, hops), n_channels
+	print("Loading compiled snapshot:", filename)
+	header, arrays = compiled
+	node_ids = NodeIds([node.decode() for node in arrays["node_ids"].tolist()])
+	# node IDs are numbered in sorted order (see NodeIds): number each node in the order of the file
+	numbers = np.empty(len(node_ids), dtype=np.int64)
+	numbers[np.argsort(arrays["node_ids"], kind="stable")] = np.arange(len(node_ids))
+	# the table copies the columns, so the file is not kept open
+	hop_table = HopTable.from_columns(arrays["channels_indptr"], arrays["capacities"],
+		arrays["enabled_dir0"], arrays["enabled_dir1"])
+	hop_ends = numbers[arrays["hop_ends"]].tolist()
+	return assemble_hop_graph(node_ids, numbers.tolist(), hop_ends, hop_table), header["n_channels"]
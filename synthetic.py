@@ -35,6 +35,7 @@ SPDX-License-Identifier: MIT
 from random import random, randint
 
 from hop import Hop, dir0, dir1
+from cohort import HopCohort
 
 
 def generate_hop(min_N, max_N, min_capacity, max_capacity, probability_bidirectional, balances=None):
@@ -107,16 +108,8 @@ def probe_single_hop(hop, bs, jamming):
 	initial_uncertainty = hop.uncertainty
 	num_probes, num_jams = probe_hop_without_jamming(hop, bs), 0
 	if jamming:
-		for i in range(hop.N):
-			#print("\nJamming-enhanced probing channel", i)
-			hop.unjam(i, direction = dir0)
-			hop.unjam(i, direction = dir1)
-			# TODO: can we jam in one direction only? (fewer jams)
-			num_jams += hop.jam_all_except_in_direction(i, direction = dir0)
-			num_jams += hop.jam_all_except_in_direction(i, direction = dir1)
-			num_probes_i, num_jams_i = jam_hop_and_probe_single_channel(hop, bs, i)
-			num_probes += num_probes_i
-			num_jams += num_jams_i
+		num_probes_jamming, num_jams = probe_hop_with_jamming(hop, bs)
+		num_probes += num_probes_jamming
 	hop.unjam_all()
 	final_uncertainty = hop.uncertainty
 	gain = initial_uncertainty - final_uncertainty
@@ -124,6 +117,32 @@ def probe_single_hop(hop, bs, jamming):
 	return gain, num_probes, num_jams
 
 
+def probe_hop_with_jamming(hop, bs):
+	'''
+		Do jamming-enhanced probing of each channel of a hop (after h and g are fully probed).
+
+		Parameters:
+		- hop: the target hop
+		- bs: amount choice method
+
+		Return:
+		- num_probes: the total number of probes done
+		- num_jams: the total number of jams done
+	'''
+	num_probes, num_jams = 0, 0
+	for i in range(hop.N):
+		#print("\nJamming-enhanced probing channel", i)
+		hop.unjam(i, direction = dir0)
+		hop.unjam(i, direction = dir1)
+		# TODO: can we jam in one direction only? (fewer jams)
+		num_jams += hop.jam_all_except_in_direction(i, direction = dir0)
+		num_jams += hop.jam_all_except_in_direction(i, direction = dir1)
+		num_probes_i, num_jams_i = jam_hop_and_probe_single_channel(hop, bs, i)
+		num_probes += num_probes_i
+		num_jams += num_jams_i
+	return num_probes, num_jams
+
+
 def probe_hop_without_jamming(hop, bs):
 	'''
 		Probe a hop without jamming.
@@ -137,11 +156,10 @@ def probe_hop_without_jamming(hop, bs):
 	'''
 	num_probes = 0
 	while hop.worth_probing_h() or hop.worth_probing_g():
-		chosen_dir = hop.next_dir(bs, jamming=False)
+		chosen_dir, amount = hop.next_dir_and_a(bs, jamming=False)
 		if chosen_dir is None:
 			print("Hop is disabled in both directions, cannot probe")
 			break
-		amount = hop.next_a(chosen_dir, bs, jamming=False)
 		hop.probe(chosen_dir, amount)
 		num_probes += 1
 	return num_probes
@@ -162,17 +180,39 @@ def jam_hop_and_probe_single_channel(hop, bs, i):
 	'''
 	num_probes, num_jams = 0, 0
 	while hop.worth_probing_channel(i):
-		chosen_dir = hop.next_dir(bs, jamming=True)
+		chosen_dir, amount = hop.next_dir_and_a(bs, jamming=True)
 		if chosen_dir is None:
 			print("Hop is disabled in both directions, cannot probe")
 			break
-		amount = hop.next_a(chosen_dir, bs, jamming=True)
 		hop.probe(chosen_dir, amount)
 		num_probes += 1
 	return num_probes, num_jams
 
 
-def probe_hops_direct(hops, bs, jamming):
+def probe_hops_without_jamming(hops, bs):
+	'''
+		Probe many hops without jamming.
+		Hops with the same number of channels are probed in lockstep as a HopCohort.
+
+		Parameters:
+		- hops: a list of target hops
+		- bs: amount choice method
+
+		Return:
+		- num_probes: a list of the numbers of probes done, one per hop
+	'''
+	hop_indices_by_N = {}
+	for k, hop in enumerate(hops):
+		hop_indices_by_N.setdefault(hop.N, []).append(k)
+	num_probes = [0] * len(hops)
+	for hop_indices in hop_indices_by_N.values():
+		cohort = HopCohort([hops[k] for k in hop_indices])
+		for k, num_probes_hop in zip(hop_indices, cohort.probe_without_jamming(bs)):
+			num_probes[k] = num_probes_hop
+	return num_probes
+
+
+def probe_hops_direct(hops, bs, jamming, batched=True):
 	'''
 		Probe each hop from a list of hops.
 
@@ -180,6 +220,8 @@ def probe_hops_direct(hops, bs, jamming):
 		- hops: a list of target hops
 		- bs: amount choice method
 		- jamming: do jamming-enhanced probing after h and g are fully probed
+		- batched: probe hops without jamming in lockstep (see probe_hops_without_jamming);
+		  if False, probe hops one by one (the results are the same)
 
 		Return:
 		- total_gain: total information gain (total resolved uncertainty to initial uncertainty)
@@ -189,11 +231,23 @@ def probe_hops_direct(hops, bs, jamming):
 		hop.reset_estimates()
 	initial_uncertainty_total = sum([hop.uncertainty for hop in hops])
 	gains, probes_list = [], []
-	for hop in hops:
-		gain, probes, jams = probe_single_hop(hop, bs=bs, jamming=jamming)
-		gains.append(gain)
-		# count jams as probes (they are payments too!)
-		probes_list.append(probes + jams)
+	if batched:
+		initial_uncertainties = [hop.uncertainty for hop in hops]
+		for hop, initial_uncertainty, num_probes in zip(hops, initial_uncertainties, probe_hops_without_jamming(hops, bs)):
+			num_jams = 0
+			if jamming:
+				num_probes_jamming, num_jams = probe_hop_with_jamming(hop, bs)
+				num_probes += num_probes_jamming
+			hop.unjam_all()
+			gains.append(initial_uncertainty - hop.uncertainty)
+			# count jams as probes (they are payments too!)
+			probes_list.append(num_probes + num_jams)
+	else:
+		for hop in hops:
+			gain, probes, jams = probe_single_hop(hop, bs=bs, jamming=jamming)
+			gains.append(gain)
+			# count jams as probes (they are payments too!)
+			probes_list.append(probes + jams)
 	#print("\nProbed with method:", "bs" if bs else "nbs", "with jamming" if jamming else "without jamming")
 	final_uncertainty_total = sum([hop.uncertainty for hop in hops])
 	#print("Final uncertainty:", final_uncertainty_total)
@@ -203,4 +257,3 @@ def probe_hops_direct(hops, bs, jamming):
 	probing_speed = total_gain_bits / sum(probes_list)
 	total_gain = total_gain_bits / initial_uncertainty_total
 	return total_gain, probing_speed
-
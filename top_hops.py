@@ -0,0 +1,153 @@
+#! /usr/bin/python3
+
+'''
+This file is part of Lightning Network Probing Simulator.
+
+Copyright © 2020-2021 University of Luxembourg
+
+	Permission is hereby granted, free of charge, to any person obtaining a copy
+	of this software and associated documentation files (the "Software"), to deal
+	in the Software without restriction, including without limitation the rights
+	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+	copies of the Software, and to permit persons to whom the Software is
+	furnished to do so, subject to the following conditions:
+
+	The above copyright notice and this permission notice shall be included in all
+	copies or substantial portions of the Software.
+
+	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+	SOFTWARE.
+
+SPDX-FileType: SOURCE
+SPDX-FileCopyrightText: 2020-2021 University of Luxembourg
+SPDX-License-Identifier: MIT
+'''
+
+'''
+	Ranking of hops for jamming (see Prober.find_top_hops).
+'''
+
+from heapq import heappush, heappop
+
+
+class TopHopRanking:
+	'''
+		Hops ranked by their place in the topology and their throughput, best first.
+
+		A hop's throughput is the number of its available (not jammed) channel directions (for slot jamming)
+		or its available capacity (for amount jamming).
+		A hop's score is (the total throughput of its neighbor hops, its own throughput),
+		and hops are ranked by the ratio of the two (ties are broken by the order of edges in the graph).
+		Only hops with enough available capacity are ranked.
+
+		Scores are kept in a heap with lazy deletion: when a hop changes (see update_hop),
+		the hop and its neighbors get new heap entries, and outdated entries are skipped when popped.
+		The total throughput of hops adjacent to each node is kept,
+		so a hop's score is computed in constant time.
+	'''
+
+	def __init__(self, hop_graph, slot_jamming=True, min_available_capacity=1_000_000):
+		'''
+			Parameters:
+			- hop_graph: the hop graph
+			- slot_jamming: if True, throughput is the number of available channel directions;
+			  if False, it is the available capacity
+			- min_available_capacity: only rank hops with at least this much available capacity
+		'''
+		self.hop_graph = hop_graph
+		self.slot_jamming = slot_jamming
+		self.min_available_capacity = min_available_capacity
+		# (n1, n2) -> position in the order of edges in the graph
+		self.order = dict()
+		self.throughput = dict()
+		self.node_throughput = dict()
+		# (n1, n2) -> the current score of each ranked hop
+		self.scores = dict()
+		ranked = []
+		for n1, n2 in hop_graph.edges():
+			self.order[(n1, n2)] = len(self.order)
+			hop = hop_graph[n1][n2]["hop"]
+			available_capacity = hop.available_capacity()
+			throughput = hop.available_dirs() if slot_jamming else available_capacity
+			self.throughput[(n1, n2)] = throughput
+			for node in (n1, n2):
+				self.node_throughput[node] = self.node_throughput.get(node, 0) + throughput
+			if available_capacity >= min_available_capacity:
+				ranked.append((n1, n2))
+		self.heap = []
+		for pair in ranked:
+			self.push(pair)
+
+
+	def __len__(self):
+		return len(self.scores)
+
+
+	def key(self, n1, n2):
+		return (n1, n2) if (n1, n2) in self.order else (n2, n1)
+
+
+	def score(self, pair):
+		'''
+			Return the score of a hop: (the total throughput of its neighbors, its own throughput).
+		'''
+		n1, n2 = pair
+		throughput = self.throughput[pair]
+		return (self.node_throughput[n1] + self.node_throughput[n2] - 2 * throughput, throughput)
+
+
+	def push(self, pair):
+		'''
+			Store the current score of a ranked hop (and add a heap entry for it).
+		'''
+		score = self.score(pair)
+		self.scores[pair] = score
+		heappush(self.heap, (-(score[0] / score[1]), self.order[pair], pair, score))
+
+
+	def pop(self):
+		'''
+			Remove the best hop from the ranking.
+
+			Return: the hop's node pair and its score (None if no hops are left)
+		'''
+		while self.heap:
+			_, _, pair, score = heappop(self.heap)
+			# skip outdated entries
+			if self.scores.get(pair) == score:
+				del self.scores[pair]
+				return pair, score
+		return None
+
+
+	def update_hop(self, n1, n2):
+		'''
+			Update the ranking after a hop changed (e.g., its channels were jammed).
+			The hop is dropped from the ranking if it has too little available capacity left.
+			(Hops that are not ranked, or no longer ranked, are not added back.)
+		'''
+		pair = self.key(n1, n2)
+		hop = self.hop_graph[n1][n2]["hop"]
+		available_capacity = hop.available_capacity()
+		throughput = hop.available_dirs() if self.slot_jamming else available_capacity
+		change = throughput - self.throughput[pair]
+		self.throughput[pair] = throughput
+		self.node_throughput[n1] += change
+		self.node_throughput[n2] += change
+		if pair in self.scores:
+			if available_capacity >= self.min_available_capacity:
+				self.push(pair)
+			else:
+				del self.scores[pair]
+		if change != 0:
+			# the scores of all neighbor hops changed
+			for node in (n1, n2):
+				for _, neighbor in self.hop_graph.edges(node):
+					neighbor_pair = self.key(node, neighbor)
+					if neighbor_pair != pair and neighbor_pair in self.scores:
+						self.push(neighbor_pair)